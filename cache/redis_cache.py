@@ -1,9 +1,85 @@
-import config.config as config
+# 2 个空格对齐
+import hashlib
+from typing import Any, List, Optional, Sequence
+from redis.asyncio import Redis
+from loguru import logger as _log
 
+# 滑动过期脚本：为会话的所有 key 续期；若提供索引 key(zset)，
+# 索引中每个成员对应的 "{member_prefix}{member}" 也一并续期（例如每个快照的 writes key）
+# KEYS: 会话的固定 key；ARGV[1]=seconds, ARGV[2]=索引 key(可为空串), ARGV[3]=成员 key 前缀
+_REFRESH_TTL_SCRIPT = """
+local seconds = tonumber(ARGV[1])
+for i = 1, #KEYS do
+  redis.call('EXPIRE', KEYS[i], seconds)
+end
+if ARGV[2] ~= '' then
+  for _, member in ipairs(redis.call('ZRANGE', ARGV[2], 0, -1)) do
+    redis.call('EXPIRE', ARGV[3] .. member, seconds)
+  end
+end
+return 1
+"""
 
-def _refresh_ttl(self, thread_id: str, seconds: int):
-  # 假设你使用的是 redis-py 客户端
-  # LangGraph RedisSaver 存储的 key 通常带有前缀，例如 "checkpoint:<thread_id>"
-  key = f"checkpoint:{thread_id}"
-  self.redis_client.expire(key, seconds)
-  _log.debug(f"已为用户 {thread_id} 续期 {seconds} 秒")
\ No newline at end of file
+class SlidingTTL:
+  """
+  活跃会话的滑动过期：每次访问都把会话相关 key 的过期时间重置为 seconds
+  """
+  def __init__(self, redis_client: Redis, seconds: int):
+    self.seconds = seconds
+    self._script = redis_client.register_script(_REFRESH_TTL_SCRIPT)
+
+  async def refresh(
+    self,
+    keys: List[str],
+    index_key: Optional[str] = None,
+    member_prefix: str = "",
+    client: Optional[Redis] = None
+  ) -> None:
+    """client 为 key 所在的分片，默认使用注册脚本的客户端"""
+    if not self.seconds:
+      return
+    try:
+      await self._script(keys=keys, args=[self.seconds, index_key or "", member_prefix], client=client)
+      _log.debug("已为 {} 续期 {} 秒", keys[0] if keys else index_key, self.seconds)
+    except Exception as e:
+      # 续期失败不影响业务，最坏情况是会话按原 TTL 过期
+      _log.warning("会话续期失败: {}", e)
+
+def _jump_hash(key: int, buckets: int) -> int:
+  """Jump consistent hash：分片数从 n 扩到 n+1 时只有约 1/(n+1) 的 key 需要迁移"""
+  b, j = -1, 0
+  while j < buckets:
+    b = j
+    key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+    j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+  return b
+
+class RedisShardRouter:
+  """
+  多个独立 Redis 实例之间的客户端分片：按分片标签（例如 thread_id）把同一会话的所有 key 路由到同一实例。
+  分片顺序即配置顺序，扩容时只能在末尾追加实例。
+  """
+  def __init__(self, clients: Sequence[Redis]):
+    if not clients:
+      raise ValueError("RedisShardRouter requires at least one client")
+    self.clients = list(clients)
+
+  def client_for(self, tag: str) -> Redis:
+    if len(self.clients) == 1:
+      return self.clients[0]
+    digest = hashlib.md5(str(tag).encode("utf-8")).digest()
+    return self.clients[_jump_hash(int.from_bytes(digest[:8], "big"), len(self.clients))]
+
+  def register_script(self, script: str) -> Any:
+    # 脚本对象按 sha 调用，执行时通过 client= 指定目标分片，缺失时自动在该分片上加载
+    return self.clients[0].register_script(script)
+
+  async def aclose(self) -> None:
+    for c in self.clients:
+      await c.aclose()
+
+def client_for(redis_client: Any, tag: str) -> Redis:
+  """返回 tag 对应的客户端：分片路由器按 tag 选实例，单机与 Redis Cluster 直接使用原客户端"""
+  if isinstance(redis_client, RedisShardRouter):
+    return redis_client.client_for(tag)
+  return redis_client
@@ -31,6 +31,33 @@ def get_server_process_num():
 
 def get_max_thread_workers():
   return config.getint('server','max_thread_workers', fallback=int(os.environ.get('MAX_THREAD_WORKERS', 0)))
+
+# loadUserHistory: default/max number of messages per request, and messages per response chunk
+def get_history_page_size():
+  return config.getint('server','history_page_size', fallback=int(os.environ.get('HISTORY_PAGE_SIZE', 50)))
+
+def get_history_max_page_size():
+  return config.getint('server','history_max_page_size', fallback=int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 200)))
+
+def get_history_chunk_size():
+  return config.getint('server','history_chunk_size', fallback=int(os.environ.get('HISTORY_CHUNK_SIZE', 20)))
+
+# chat run budget: default/max deadline (the request may set deadlineMs), max llm calls per run,
+# time reserved for the forced final answer, and min remaining time for optional tools (jd comparison)
+def get_chat_deadline_ms():
+  return config.getint('server','chat_deadline_ms', fallback=int(os.environ.get('CHAT_DEADLINE_MS', 30000)))
+
+def get_chat_max_deadline_ms():
+  return config.getint('server','chat_max_deadline_ms', fallback=int(os.environ.get('CHAT_MAX_DEADLINE_MS', 120000)))
+
+def get_chat_max_model_calls():
+  return config.getint('server','chat_max_model_calls', fallback=int(os.environ.get('CHAT_MAX_MODEL_CALLS', 6)))
+
+def get_chat_answer_reserve_ms():
+  return config.getint('server','chat_answer_reserve_ms', fallback=int(os.environ.get('CHAT_ANSWER_RESERVE_MS', 8000)))
+
+def get_chat_optional_tool_min_ms():
+  return config.getint('server','chat_optional_tool_min_ms', fallback=int(os.environ.get('CHAT_OPTIONAL_TOOL_MIN_MS', 12000)))
 ################################################################################################
 ### tls configurations
 def get_certificate_chain_file():
@@ -60,6 +87,21 @@ def get_hunyuan_api_key():
 def get_qwen_api_key():
   return config.get('qwen', 'api_key', fallback=os.environ.get('QWEN_API_KEY',"sk-xxxxxxxxxxxx"))
 
+# query embedding cache: per-worker LRU entries, and ttl of the shared redis tier (0 means no expiry)
+def get_embedding_cache_size():
+  return config.getint('qwen', 'embedding_cache_size', fallback=int(os.environ.get('QWEN_EMBEDDING_CACHE_SIZE',1024)))
+
+def get_embedding_cache_ttl_in_seconds():
+  return config.getint('qwen', 'embedding_cache_ttl_in_seconds', fallback=int(os.environ.get('QWEN_EMBEDDING_CACHE_TTL_IN_SECONDS',604800)))
+
+# concurrent query embeddings arriving within the window are sent as one batch request, 0 disables batching
+def get_embedding_batch_window_ms():
+  return config.getint('qwen', 'embedding_batch_window_ms', fallback=int(os.environ.get('QWEN_EMBEDDING_BATCH_WINDOW_MS',5)))
+
+# text-embedding-v3 accepts at most 10 texts per request
+def get_embedding_batch_max_size():
+  return config.getint('qwen', 'embedding_batch_max_size', fallback=int(os.environ.get('QWEN_EMBEDDING_BATCH_MAX_SIZE',10)))
+
 ################################################################################################
 ### logging system
 def get_log_file_name():
@@ -90,6 +132,56 @@ def get_redis_port():
 def get_redis_msg_ttl_in_seconds():
   return config.getint('redis', 'msg_ttl_in_seconds', fallback=int(os.environ.get('REDIS_MSG_TTL_IN_SECONDS',7200)))
 
+# conversation storage topology: standalone (token redis node) | cluster (Redis Cluster) | sharded (client-side sharding)
+def get_redis_mode():
+  return config.get('redis', 'mode', fallback=os.environ.get('REDIS_MODE',"standalone")).lower()
+
+# comma separated host:port list, cluster startup nodes or shard list (shard order must not change, append only)
+def get_redis_nodes():
+  nodes = config.get('redis', 'nodes', fallback=os.environ.get('REDIS_NODES',""))
+  return [n.strip() for n in nodes.split(',') if n.strip()]
+
+# max user-visible messages kept in the materialized transcript (transcript:{userCode}) used by loadUserHistory
+def get_redis_transcript_max_entries():
+  return config.getint('redis', 'transcript_max_entries', fallback=int(os.environ.get('REDIS_TRANSCRIPT_MAX_ENTRIES',200)))
+
+# read conversations still stored under the pre hash-tag key names (checkpoints:<thread> ...) on the token redis node
+# and move them to the current keys on first access; turn off after tools/migrate_conversation_keys.py has run
+def get_redis_legacy_key_fallback():
+  return config.getboolean('redis', 'legacy_key_fallback', fallback=os.environ.get('REDIS_LEGACY_KEY_FALLBACK',"true").lower() in ['true', '1', 'yes'])
+
+# checkpoint delta storage: only store channel values changed since the parent checkpoint
+def get_redis_checkpoint_delta():
+  return config.getboolean('redis', 'checkpoint_delta', fallback=os.environ.get('REDIS_CHECKPOINT_DELTA',"false").lower() in ['true', '1', 'yes'])
+
+# max checkpoints kept per thread (older ones and their writes are pruned on write), 0 means unlimited
+def get_redis_max_checkpoints_per_thread():
+  return config.getint('redis', 'max_checkpoints_per_thread', fallback=int(os.environ.get('REDIS_MAX_CHECKPOINTS_PER_THREAD',20)))
+
+# checkpoint durability per chat run: sync (persist every step) | batch (persist every flush_every steps and at run end) | exit (persist once at run end)
+def get_redis_checkpoint_durability():
+  return config.get('redis', 'checkpoint_durability', fallback=os.environ.get('REDIS_CHECKPOINT_DURABILITY',"sync")).lower()
+
+def get_redis_checkpoint_flush_every():
+  return config.getint('redis', 'checkpoint_flush_every', fallback=int(os.environ.get('REDIS_CHECKPOINT_FLUSH_EVERY',4)))
+
+# per-worker LRU of latest checkpoints (validated against redis on read), 0 disables it
+def get_redis_l1_cache_size():
+  return config.getint('redis', 'l1_cache_size', fallback=int(os.environ.get('REDIS_L1_CACHE_SIZE',1000)))
+
+# zstd compression of checkpoint blobs (dictionary trained by tools/train_checkpoint_dict.py)
+def get_redis_compression_enabled():
+  return config.getboolean('redis', 'compression_enabled', fallback=os.environ.get('REDIS_COMPRESSION_ENABLED',"false").lower() in ['true', '1', 'yes'])
+
+def get_redis_compression_dict_file():
+  return config.get('redis', 'compression_dict_file', fallback=os.environ.get('REDIS_COMPRESSION_DICT_FILE',""))
+
+def get_redis_compression_threshold():
+  return config.getint('redis', 'compression_threshold', fallback=int(os.environ.get('REDIS_COMPRESSION_THRESHOLD',512)))
+
+def get_redis_compression_level():
+  return config.getint('redis', 'compression_level', fallback=int(os.environ.get('REDIS_COMPRESSION_LEVEL',3)))
+
 ################################################################################################
 ### token
 def get_token_ttl_in_seconds():
@@ -143,6 +235,105 @@ def get_jd_position_id():
 def get_icbc_voucher_rate():
   return config.getint('icbc_mall', 'voucher_rate', fallback=int(os.environ.get('ICBC_MALL_VOUCHER_RATE',1100)))
 
+# product search backend: chroma | mmap (exact search over the matrix exported by tools/export_product_index.py)
+def get_product_backend():
+  return config.get('icbc_mall', 'product_backend', fallback=os.environ.get('ICBC_MALL_PRODUCT_BACKEND',"chroma"))
+
+def get_product_index_file():
+  return config.get('icbc_mall', 'product_index_file', fallback=os.environ.get('ICBC_MALL_PRODUCT_INDEX_FILE',"data/product_index.npy"))
+
+# hybrid product search: char n-gram BM25 index (built at ingest) fused with vector results, exact name matches skip embedding
+def get_hybrid_search_enabled():
+  return config.getboolean('icbc_mall', 'hybrid_search_enabled', fallback=os.environ.get('ICBC_MALL_HYBRID_SEARCH_ENABLED',"true").lower() in ['true', '1', 'yes'])
+
+def get_product_keyword_index_file():
+  return config.get('icbc_mall', 'product_keyword_index_file', fallback=os.environ.get('ICBC_MALL_PRODUCT_KEYWORD_INDEX_FILE',"data/product_keywords.json"))
+
+# start the mall vector search with the raw user prompt in parallel with the first llm call
+def get_speculative_search_enabled():
+  return config.getboolean('icbc_mall', 'speculative_search_enabled', fallback=os.environ.get('ICBC_MALL_SPECULATIVE_SEARCH_ENABLED',"false").lower() in ['true', '1', 'yes'])
+
+# min share (0-1) of the tool query covered by the prompt (char bigrams, 1 when contained) for reusing the prefetched result
+def get_speculative_search_threshold():
+  return config.getfloat('icbc_mall', 'speculative_search_threshold', fallback=float(os.environ.get('ICBC_MALL_SPECULATIVE_SEARCH_THRESHOLD',0.8)))
+
+################################################################################################
+### llm context window
+# estimated token budget for history sent to the llm (system prompt and summary included)
+def get_context_max_tokens():
+  return config.getint('context', 'max_tokens', fallback=int(os.environ.get('CONTEXT_MAX_TOKENS',6000)))
+
+# tool outputs of recent previous turns are truncated to this many chars, older turns drop tool messages
+def get_context_tool_output_chars():
+  return config.getint('context', 'tool_output_chars', fallback=int(os.environ.get('CONTEXT_TOOL_OUTPUT_CHARS',800)))
+
+def get_context_keep_tool_turns():
+  return config.getint('context', 'keep_tool_turns', fallback=int(os.environ.get('CONTEXT_KEEP_TOOL_TURNS',1)))
+
+# rolling summary of turns that fell out of the window, generated in background after a chat run
+def get_context_summary_enabled():
+  return config.getboolean('context', 'summary_enabled', fallback=os.environ.get('CONTEXT_SUMMARY_ENABLED',"true").lower() in ['true', '1', 'yes'])
+
+def get_context_summary_max_chars():
+  return config.getint('context', 'summary_max_chars', fallback=int(os.environ.get('CONTEXT_SUMMARY_MAX_CHARS',600)))
+
+################################################################################################
+### llm provider pool
+# send a second (hedged) request to the next provider when the first chunk is slower than the provider's p95
+def get_llm_hedge_enabled():
+  return config.getboolean('llm', 'hedge_enabled', fallback=os.environ.get('LLM_HEDGE_ENABLED',"true").lower() in ['true', '1', 'yes'])
+
+# hedge delay bounds in seconds; max_delay is used before enough latency samples are collected
+def get_llm_hedge_min_delay():
+  return config.getfloat('llm', 'hedge_min_delay', fallback=float(os.environ.get('LLM_HEDGE_MIN_DELAY',1.0)))
+
+def get_llm_hedge_max_delay():
+  return config.getfloat('llm', 'hedge_max_delay', fallback=float(os.environ.get('LLM_HEDGE_MAX_DELAY',8.0)))
+
+# a provider failing this many times in a row is skipped for cooldown seconds
+def get_llm_failure_threshold():
+  return config.getint('llm', 'failure_threshold', fallback=int(os.environ.get('LLM_FAILURE_THRESHOLD',3)))
+
+def get_llm_failure_cooldown():
+  return config.getfloat('llm', 'failure_cooldown', fallback=float(os.environ.get('LLM_FAILURE_COOLDOWN',30)))
+
+# send simple turns (greetings, short follow-ups) to the fast tier models of model_pool first
+def get_llm_cascade_enabled():
+  return config.getboolean('llm', 'cascade_enabled', fallback=os.environ.get('LLM_CASCADE_ENABLED',"true").lower() in ['true', '1', 'yes'])
+
+# fast tier answers longer than this are escalated to the strong tier
+def get_llm_cascade_max_chars():
+  return config.getint('llm', 'cascade_max_chars', fallback=int(os.environ.get('LLM_CASCADE_MAX_CHARS',300)))
+
+################################################################################################
+### first-turn answer cache
+# reuse answers to first-turn questions (no history) that are semantically identical, numbers must match exactly
+def get_answer_cache_enabled():
+  return config.getboolean('answer_cache', 'enabled', fallback=os.environ.get('ANSWER_CACHE_ENABLED',"false").lower() in ['true', '1', 'yes'])
+
+def get_answer_cache_ttl_in_seconds():
+  return config.getint('answer_cache', 'ttl_in_seconds', fallback=int(os.environ.get('ANSWER_CACHE_TTL_IN_SECONDS',3600)))
+
+# min cosine similarity between question embeddings
+def get_answer_cache_threshold():
+  return config.getfloat('answer_cache', 'threshold', fallback=float(os.environ.get('ANSWER_CACHE_THRESHOLD',0.95)))
+
+def get_answer_cache_max_entries():
+  return config.getint('answer_cache', 'max_entries', fallback=int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES',1000)))
+
+# bump after re-importing the mall catalog or voucher rules, cached answers of the old version are no longer used
+def get_answer_cache_catalog_version():
+  return config.get('answer_cache', 'catalog_version', fallback=os.environ.get('ANSWER_CACHE_CATALOG_VERSION',"1"))
+
+################################################################################################
+### prometheus metrics endpoint
+# /metrics is served only when enabled and a token is set; scrapers must send "Authorization: Bearer <token>"
+def get_metrics_enabled():
+  return config.getboolean('metrics', 'enabled', fallback=os.environ.get('METRICS_ENABLED',"false").lower() in ['true', '1', 'yes'])
+
+def get_metrics_token():
+  return config.get('metrics', 'token', fallback=os.environ.get('METRICS_TOKEN',""))
+
 ################################################################################################
 ### for files location
 def get_resource_file():
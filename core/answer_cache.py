@@ -0,0 +1,152 @@
+# 2 个空格对齐
+import re
+import json
+import time
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger as _log
+
+from cache.redis_cache import client_for
+from core.speculation import normalize_query
+
+# 数字（i豆数量、金额等）不同的问题答案必然不同，语义相似也不能复用
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# 写入脚本：写入答案和向量，再淘汰已过期的条目；仍超过 max_entries 时淘汰最早过期（即最早写入）的条目
+# KEYS[1]=ans, KEYS[2]=vec, KEYS[3]=exp（zset，score 为过期时间）, KEYS[4]=ver
+# ARGV[1]=field, ARGV[2]=答案 JSON, ARGV[3]=向量字节, ARGV[4]=过期时间, ARGV[5]=当前时间, ARGV[6]=max_entries, ARGV[7]=ttl
+# 返回淘汰的条数
+_STORE_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+local evicted = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])
+local over = redis.call('ZCARD', KEYS[3]) - #evicted - tonumber(ARGV[6])
+if over > 0 then
+  for _, field in ipairs(redis.call('ZRANGE', KEYS[3], #evicted, #evicted + over - 1)) do
+    table.insert(evicted, field)
+  end
+end
+for _, field in ipairs(evicted) do
+  redis.call('HDEL', KEYS[1], field)
+  redis.call('HDEL', KEYS[2], field)
+  redis.call('ZREM', KEYS[3], field)
+end
+redis.call('INCR', KEYS[4])
+for i = 1, 4 do
+  redis.call('EXPIRE', KEYS[i], ARGV[7])
+end
+return #evicted
+"""
+
+def prompt_numbers(text: str) -> List[str]:
+  return _NUMBER_RE.findall(text or "")
+
+class AnswerCache:
+  """
+  首轮问题的语义答案缓存（多个 worker 通过 Redis 共享）：
+  - answer_cache:{scope}:ans  hash，field 为归一化问题的 sha1，value 为 {prompt, numbers, answer, expires}
+  - answer_cache:{scope}:vec  hash，同一 field 下保存问题向量（float32 字节）
+  - answer_cache:{scope}:exp  zset，field 的过期时间；写入时淘汰过期条目，超过 max_entries 时淘汰最早的条目
+  - answer_cache:{scope}:ver  写入计数，worker 发现变化时重新加载向量到本地矩阵
+  scope 由商品目录版本和系统提示词版本组成，任一变化后旧答案自然失效。
+  归一化后完全相同的问题不需要计算向量；否则按余弦相似度查找，且问题中的数字必须完全一致。
+  """
+  def __init__(self, redis_client: Any, embed: Callable[[str], Awaitable[List[float]]], scope: str,
+               ttl: int = 3600, threshold: float = 0.95, max_entries: int = 1000):
+    self.redis_client = redis_client
+    self.embed = embed
+    self.scope = scope
+    self.ttl = ttl
+    self.threshold = threshold
+    self.max_entries = max_entries
+    self._store_script = redis_client.register_script(_STORE_SCRIPT)
+    # 本地向量矩阵（已归一化）及对应的 field
+    self._version = None
+    self._fields: List[str] = []
+    self._matrix: Optional[np.ndarray] = None
+
+  def _key(self, suffix: str) -> str:
+    return f"answer_cache:{{{self.scope}}}:{suffix}"
+
+  def _client(self) -> Any:
+    return client_for(self.redis_client, self.scope)
+
+  @staticmethod
+  def _field(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+  async def _load_vectors(self) -> None:
+    """写入计数变化时从 Redis 重新加载向量"""
+    client = self._client()
+    version = await client.get(self._key("ver"))
+    if version == self._version:
+      return
+    raw = await client.hgetall(self._key("vec"))
+    fields, vectors = [], []
+    for field, value in raw.items():
+      fields.append(field.decode("utf-8") if isinstance(field, bytes) else field)
+      vectors.append(np.frombuffer(value, dtype=np.float32))
+    self._fields = fields
+    self._matrix = np.vstack(vectors) if vectors else None
+    self._version = version
+
+  async def _get_entry(self, field: str) -> Optional[Dict[str, Any]]:
+    raw = await self._client().hget(self._key("ans"), field)
+    if not raw:
+      return None
+    entry = json.loads(raw)
+    if entry.get("expires", 0) < time.time():
+      return None
+    return entry
+
+  async def lookup(self, prompt: str) -> Tuple[Optional[str], Optional[List[float]]]:
+    """
+    返回 (缓存的答案, 问题向量)。向量在未命中时交给 store 复用，避免再计算一次；
+    完全相同的问题命中时不计算向量，返回的向量为 None
+    """
+    normalized = normalize_query(prompt)
+    if not normalized:
+      return None, None
+    entry = await self._get_entry(self._field(normalized))
+    if entry is not None:
+      _log.info("答案缓存命中（相同问题）: {}", prompt)
+      return entry["answer"], None
+
+    vector = await self.embed(normalized)
+    await self._load_vectors()
+    if self._matrix is None:
+      return None, vector
+    query = np.asarray(vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    scores = self._matrix @ query
+    numbers = prompt_numbers(prompt)
+    # 从最相似的开始检查，数字不一致或已过期的跳过
+    for idx in np.argsort(-scores)[:5]:
+      if scores[idx] < self.threshold:
+        break
+      entry = await self._get_entry(self._fields[idx])
+      if entry is not None and entry.get("numbers") == numbers:
+        _log.info("答案缓存命中（相似度 {:.3f}）: {} / {}", float(scores[idx]), prompt, entry["prompt"])
+        return entry["answer"], vector
+    return None, vector
+
+  async def store(self, prompt: str, answer: str, vector: Optional[List[float]] = None) -> None:
+    normalized = normalize_query(prompt)
+    if not normalized or not answer:
+      return
+    if vector is None:
+      vector = await self.embed(normalized)
+    vector = np.asarray(vector, dtype=np.float32)
+    vector = vector / (np.linalg.norm(vector) or 1.0)
+    now = time.time()
+    entry = {"prompt": prompt, "numbers": prompt_numbers(prompt), "answer": answer, "expires": now + self.ttl}
+    evicted = await self._store_script(
+      keys=[self._key(suffix) for suffix in ("ans", "vec", "exp", "ver")],
+      args=[self._field(normalized), json.dumps(entry, ensure_ascii=False), vector.tobytes(), entry["expires"], now,
+            self.max_entries, self.ttl],
+      client=self._client()
+    )
+    if evicted:
+      _log.debug("答案缓存淘汰了 {} 条过期或最早的条目", evicted)
@@ -0,0 +1,73 @@
+# 2 个空格对齐
+import os
+import glob
+from typing import Dict, Optional
+from loguru import logger as _log
+
+# zstandard 为可选依赖，未安装时压缩层自动关闭（已压缩的数据无法读取，会报错提示安装）
+try:
+  import zstandard as zstd
+except ImportError:
+  zstd = None
+
+# 压缩 blob 的格式头：0xc1 + 'Z'。0xc1 是 msgpack 保留字节，
+# 第二个字节与序列化器的版本号区分开，因此压缩/未压缩/旧格式的 blob 可以共存
+_COMPRESSED_MAGIC = b"\xc1Z"
+
+class BlobCompressor:
+  """
+  基于 zstd 字典的 blob 压缩。
+  - dict_file 为当前用于压缩的字典；同目录下的其它 *.dict 也会被加载，用于解压旧字典压缩的数据
+  - 小于 threshold 字节的 blob 不压缩；压缩后没有变小的也保留原样
+  - enabled=False 时只解压不压缩，关闭压缩后已写入的压缩数据仍可读取
+  """
+  def __init__(self, dict_file: str = "", threshold: int = 512, level: int = 3, enabled: bool = True):
+    self.threshold = threshold
+    self.enabled = enabled and zstd is not None
+    if zstd is None:
+      if enabled:
+        _log.warning("未安装 zstandard，checkpoint 压缩未启用")
+      return
+
+    dict_data = self._load_dict(dict_file) if dict_file else None
+    self._compressor = zstd.ZstdCompressor(level=level, dict_data=dict_data)
+    # dict_id -> 解压器，0 表示未使用字典
+    self._decompressors: Dict[int, "zstd.ZstdDecompressor"] = {0: zstd.ZstdDecompressor()}
+    if dict_file:
+      for path in glob.glob(os.path.join(os.path.dirname(dict_file) or ".", "*.dict")):
+        d = dict_data if os.path.abspath(path) == os.path.abspath(dict_file) else self._load_dict(path)
+        if d is not None:
+          self._decompressors[d.dict_id()] = zstd.ZstdDecompressor(dict_data=d)
+    if self.enabled:
+      _log.info(
+        "checkpoint 压缩已启用，字典: {} (id={})，阈值 {} 字节",
+        dict_file or "无", dict_data.dict_id() if dict_data else 0, threshold
+      )
+
+  def _load_dict(self, path: str) -> Optional["zstd.ZstdCompressionDict"]:
+    try:
+      with open(path, "rb") as f:
+        return zstd.ZstdCompressionDict(f.read())
+    except Exception as e:
+      _log.error("加载 zstd 字典 {} 失败: {}", path, e)
+      return None
+
+  def compress(self, data: bytes) -> bytes:
+    if not self.enabled or len(data) < self.threshold:
+      return data
+    compressed = self._compressor.compress(data)
+    if len(compressed) + len(_COMPRESSED_MAGIC) >= len(data):
+      return data
+    return _COMPRESSED_MAGIC + compressed
+
+  def decompress(self, data: bytes) -> bytes:
+    if data[:2] != _COMPRESSED_MAGIC:
+      return data
+    if zstd is None:
+      raise RuntimeError("blob is zstd compressed but zstandard is not installed")
+    frame = data[2:]
+    dict_id = zstd.get_frame_parameters(frame).dict_id
+    decompressor = self._decompressors.get(dict_id)
+    if decompressor is None:
+      raise ValueError(f"zstd dictionary {dict_id} not loaded")
+    return decompressor.decompress(frame)
@@ -0,0 +1,151 @@
+# 2 个空格对齐
+import re
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
+from loguru import logger as _log
+
+from cache.redis_cache import client_for
+
+# 中日韩字符及全角符号：大多数模型的分词器里约 1 字 1 token，其余字符按约 4 字符 1 token 估算
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 每条消息的格式开销（role、分隔符等）
+_MESSAGE_OVERHEAD = 4
+
+def estimate_tokens(text: Any) -> int:
+  """粗略估算 token 数，不依赖具体模型的分词器"""
+  if not text:
+    return 0
+  text = text if isinstance(text, str) else str(text)
+  cjk = len(_CJK_RE.findall(text))
+  return cjk + (len(text) - cjk + 3) // 4
+
+def message_tokens(msg: BaseMessage) -> int:
+  tokens = _MESSAGE_OVERHEAD + estimate_tokens(msg.content)
+  tool_calls = getattr(msg, "tool_calls", None)
+  if tool_calls:
+    tokens += estimate_tokens(json.dumps([c.get("args") for c in tool_calls], ensure_ascii=False))
+  return tokens
+
+def split_turns(messages: Sequence[BaseMessage], start: int = 0) -> List[Tuple[int, int]]:
+  """按用户消息切分轮次，返回每轮在 messages 中的 [begin, end) 区间"""
+  turns = []
+  begin = start
+  for i in range(start, len(messages)):
+    if isinstance(messages[i], HumanMessage) and i > begin:
+      turns.append((begin, i))
+      begin = i
+  if begin < len(messages):
+    turns.append((begin, len(messages)))
+  return turns
+
+class ContextWindow:
+  """
+  按 token 预算裁剪发给模型的历史消息：
+  - 以轮次（一条用户消息及其后的 AI/工具消息）为单位，从最新往前保留，当前轮次总是完整保留
+  - 之前 keep_tool_turns 轮的工具输出截断为 tool_output_chars 个字符，更早轮次的工具交互整体去掉，只保留问答
+  - 已被摘要覆盖的消息（summary.upto 之前）不再发送
+  """
+  def __init__(self, max_tokens: int = 6000, tool_output_chars: int = 800, keep_tool_turns: int = 1):
+    self.max_tokens = max_tokens
+    self.tool_output_chars = tool_output_chars
+    self.keep_tool_turns = keep_tool_turns
+
+  def _compact_turn(self, messages: Sequence[BaseMessage], age: int) -> List[BaseMessage]:
+    """age 为距当前轮次的轮数，0 表示当前轮次"""
+    if age == 0:
+      return list(messages)
+    if age <= self.keep_tool_turns:
+      compacted = []
+      for msg in messages:
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        if isinstance(msg, ToolMessage) and len(content) > self.tool_output_chars:
+          msg = msg.model_copy(update={"content": content[:self.tool_output_chars] + "…(已截断)"})
+        compacted.append(msg)
+      return compacted
+    # 去掉工具调用指令和工具结果；工具调用指令与结果必须成对出现，因此一起去掉
+    return [
+      msg for msg in messages
+      if not isinstance(msg, ToolMessage) and not getattr(msg, "tool_calls", None)
+    ]
+
+  def select(self, messages: Sequence[BaseMessage], upto: int = 0, reserved_tokens: int = 0, budget: Optional[int] = None) -> Tuple[int, List[BaseMessage]]:
+    """
+    返回 (窗口起始下标, 裁剪后的消息)。reserved_tokens 为 system prompt、摘要等固定部分的估算。
+    """
+    budget = (self.max_tokens if budget is None else budget) - reserved_tokens
+    upto = upto if 0 <= upto <= len(messages) else 0
+    turns = split_turns(messages, upto)
+    selected: List[List[BaseMessage]] = []
+    start = len(messages)
+    used = 0
+    for age, (begin, end) in enumerate(reversed(turns)):
+      turn = self._compact_turn(messages[begin:end], age)
+      tokens = sum(message_tokens(m) for m in turn)
+      if age > 0 and used + tokens > budget:
+        break
+      selected.append(turn)
+      used += tokens
+      start = begin
+    window = [m for turn in reversed(selected) for m in turn]
+    _log.debug("上下文窗口: {} 条消息中保留 {} 条，约 {} tokens", len(messages), len(window), used + reserved_tokens)
+    return start, window
+
+  def half_budget(self, reserved_tokens: int) -> int:
+    """历史部分只用一半预算时的总预算"""
+    return reserved_tokens + (self.max_tokens - reserved_tokens) // 2
+
+  def select_stable(self, messages: Sequence[BaseMessage], upto: int = 0, reserved_tokens: int = 0) -> Tuple[int, List[BaseMessage]]:
+    """
+    面向服务商前缀缓存的选择：窗口起点尽量不动。从摘要位置起全部放得下时保持起点为 upto；
+    放不下时一次跳到只用一半预算的位置（与摘要的目标位置一致），摘要追上后起点又回到 upto，
+    而不是每轮丢一轮、让整段历史的字节每次都变化。
+    """
+    start, window = self.select(messages, upto, reserved_tokens)
+    if start <= max(upto, 0):
+      return start, window
+    return self.select(messages, upto, reserved_tokens, budget=self.half_budget(reserved_tokens))
+
+def summary_message(summary: Optional[Dict[str, Any]]) -> Optional[SystemMessage]:
+  if not summary or not summary.get("text"):
+    return None
+  return SystemMessage(content=f"## 之前对话的摘要\n{summary['text']}")
+
+class RollingSummary:
+  """
+  滚动摘要：Redis 中 summary:{userCode} 保存 {upto, text}，text 概括了会话消息中 upto 之前的内容。
+  摘要在对话结束后由后台任务生成，不在请求路径上。
+  prompt 来自 resource.yaml 的 summarize_conversation_prompt，其中的 {max_chars} 替换为摘要字数上限。
+  """
+  def __init__(self, redis_client: Any, prompt: str, ttl: int = 86400, max_chars: int = 600):
+    self.redis_client = redis_client
+    self.ttl = ttl
+    self.max_chars = max_chars
+    self.prompt = prompt.replace("{max_chars}", str(max_chars))
+
+  def _key(self, user_id: str) -> str:
+    return f"summary:{{{user_id}}}"
+
+  async def aload(self, user_id: str) -> Optional[Dict[str, Any]]:
+    user_id = str(user_id)
+    raw = await client_for(self.redis_client, user_id).get(self._key(user_id))
+    return json.loads(raw) if raw else None
+
+  async def asave(self, user_id: str, upto: int, text: str) -> None:
+    user_id = str(user_id)
+    value = json.dumps({"upto": upto, "text": text}, ensure_ascii=False)
+    await client_for(self.redis_client, user_id).set(self._key(user_id), value, ex=self.ttl or None)
+
+  async def asummarize(self, llm: Any, previous: str, messages: Sequence[BaseMessage]) -> str:
+    """把已有摘要和新移出窗口的问答合并成新摘要（工具交互不参与摘要）"""
+    lines = []
+    for msg in messages:
+      if isinstance(msg, ToolMessage) or getattr(msg, "tool_calls", None) or not msg.content:
+        continue
+      role = "用户" if isinstance(msg, HumanMessage) else "管家"
+      lines.append(f"{role}：{msg.content}")
+    response = await llm.ainvoke([
+      SystemMessage(content=self.prompt),
+      HumanMessage(content=f"【已有摘要】\n{previous or '无'}\n\n【新增对话】\n" + "\n".join(lines))
+    ])
+    return str(response.content).strip()[:self.max_chars * 2]
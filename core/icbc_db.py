@@ -1,8 +1,14 @@
 # 2 个空格对齐
 import asyncio
+import os
 import re
-from typing import List, Optional, Dict, Any
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Optional, Dict, Any, Set, Tuple
 import sys
+import numpy as np
 from loguru import logger as _log
 
 import config.config as config
@@ -16,7 +22,157 @@ except ImportError:
 import chromadb
 
 from langchain_community.embeddings import DashScopeEmbeddings
+from langchain_community.embeddings.dashscope import embed_with_retry
 from util.singleton import SingletonMeta
+from cache.redis_cache import client_for
+from core.product_index import ProductIndex
+from core.keyword_index import KeywordIndex, build_keyword_index, reciprocal_rank_fusion, in_points_range
+
+_EMBEDDING_MODEL = "text-embedding-v3"
+_WHITESPACE_RE = re.compile(r"\s+")
+# 混合检索时每一路取 limit 的倍数作为融合候选
+_HYBRID_CANDIDATE_FACTOR = 4
+
+def _points_where(min_points: Optional[int], max_points: Optional[int]) -> Optional[Dict[str, Any]]:
+  """积分范围转成 Chroma 的 where 条件，两个边界都有时用 $and 组合"""
+  conditions = []
+  if min_points is not None:
+    conditions.append({"points": {"$gte": min_points}})
+  if max_points is not None:
+    conditions.append({"points": {"$lte": max_points}})
+  if not conditions:
+    return None
+  return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def _mark_out_of_range(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+  """积分范围内没有商品时返回的不限范围结果，逐条标记 out_of_range"""
+  return [{**item, "out_of_range": True} for item in results]
+
+def normalize_embedding_text(text: str) -> str:
+  """全角转半角、合并空白：写法不同但内容相同的查询共用一个向量"""
+  return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+class EmbeddingCache:
+  """
+  查询向量的两级缓存，key 为 模型名 + 归一化文本：
+  - 进程内 LRU（线程安全，同步检索在线程池中执行也可以使用）
+  - Redis（多个 worker 共享），value 为 float32 字节，embedding:{model}:{sha1}
+  """
+  def __init__(self, model: str, max_size: int = 1024):
+    self.model = model
+    self.max_size = max_size
+    self.redis_client = None
+    self.ttl = 0
+    self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+    self._lock = threading.Lock()
+
+  def _digest(self, text: str) -> str:
+    return hashlib.sha1(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+  def _redis_key(self, digest: str) -> str:
+    return f"embedding:{self.model}:{{{digest}}}"
+
+  def get_local(self, text: str) -> Optional[List[float]]:
+    digest = self._digest(text)
+    with self._lock:
+      vector = self._lru.get(digest)
+      if vector is not None:
+        self._lru.move_to_end(digest)
+      return vector
+
+  def put_local(self, text: str, vector: List[float]) -> None:
+    if self.max_size <= 0:
+      return
+    digest = self._digest(text)
+    with self._lock:
+      self._lru[digest] = vector
+      self._lru.move_to_end(digest)
+      while len(self._lru) > self.max_size:
+        self._lru.popitem(last=False)
+
+  async def aget(self, text: str) -> Optional[List[float]]:
+    vector = self.get_local(text)
+    if vector is not None or self.redis_client is None:
+      return vector
+    digest = self._digest(text)
+    try:
+      raw = await client_for(self.redis_client, digest).get(self._redis_key(digest))
+    except Exception as e:
+      _log.warning("读取 Redis 向量缓存失败: {}", e)
+      return None
+    if not raw:
+      return None
+    vector = np.frombuffer(raw, dtype=np.float32).tolist()
+    self.put_local(text, vector)
+    return vector
+
+  async def aput(self, text: str, vector: List[float]) -> None:
+    self.put_local(text, vector)
+    if self.redis_client is None:
+      return
+    digest = self._digest(text)
+    try:
+      await client_for(self.redis_client, digest).set(
+        self._redis_key(digest), np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl or None
+      )
+    except Exception as e:
+      _log.warning("写入 Redis 向量缓存失败: {}", e)
+
+class EmbeddingBatcher:
+  """
+  查询向量的微批合并：window 秒内到达的查询（最多 max_batch 条）合并成一次批量请求，结果分发给各个等待者。
+  窗口内或请求中的相同文本只请求一次
+  """
+  def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], window: float, max_batch: int):
+    self.embed_batch = embed_batch
+    self.window = window
+    self.max_batch = max(1, max_batch)
+    self._pending: List[Tuple[str, asyncio.Future]] = []
+    self._inflight: Dict[str, asyncio.Future] = {}
+    self._timer: Optional[asyncio.TimerHandle] = None
+    self._tasks: Set[asyncio.Task] = set()
+
+  async def embed(self, text: str) -> List[float]:
+    future = self._inflight.get(text)
+    if future is None:
+      loop = asyncio.get_running_loop()
+      future = loop.create_future()
+      self._inflight[text] = future
+      self._pending.append((text, future))
+      if len(self._pending) >= self.max_batch:
+        self._flush()
+      elif self._timer is None:
+        self._timer = loop.call_later(self.window, self._flush)
+    # 某个等待者被取消时不能影响同一批次的其他等待者
+    return await asyncio.shield(future)
+
+  def _flush(self) -> None:
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    batch, self._pending = self._pending, []
+    if batch:
+      task = asyncio.ensure_future(self._run(batch))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+    texts = [text for text, _ in batch]
+    try:
+      vectors = await asyncio.to_thread(self.embed_batch, texts)
+    except Exception as e:
+      _log.warning("批量计算查询向量失败（{} 条）: {}", len(texts), e)
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+    else:
+      _log.debug("批量计算查询向量 {} 条", len(texts))
+      for (_, future), vector in zip(batch, vectors):
+        if not future.done():
+          future.set_result(vector)
+    finally:
+      for text, _ in batch:
+        self._inflight.pop(text, None)
 
 class ICBCVectorDB(metaclass=SingletonMeta):
   def __init__(self):
@@ -25,38 +181,180 @@ class ICBCVectorDB(metaclass=SingletonMeta):
     
     # 2. 初始化 Qwen Embedding 接口
     self.embeddings = DashScopeEmbeddings(
-      model="text-embedding-v3",
+      model=_EMBEDDING_MODEL,
       dashscope_api_key=config.get_qwen_api_key()
     )
+    # 查询向量缓存：重复的查询（如每轮都会检索的“京东E卡”）不再请求 DashScope
+    self.embedding_cache = EmbeddingCache(_EMBEDDING_MODEL, config.get_embedding_cache_size())
+    # 并发查询合并成批量请求，减少对外请求数和线程占用；窗口为 0 时不合并
+    window_ms = config.get_embedding_batch_window_ms()
+    self.embedding_batcher = EmbeddingBatcher(
+      self._embed_queries, window_ms / 1000, config.get_embedding_batch_max_size()
+    ) if window_ms > 0 else None
     
     # 3. 初始化各 Collection
     self.product_collection = self.client.get_or_create_collection(name="icbc_products")
     self.strategy_collection = self.client.get_or_create_collection(name="icbc_strategies")
     self.voucher_collection = self.client.get_or_create_collection(name="icbc_standing_vouchers")
+    # 商品检索后端：chroma（默认）或 mmap（由 tools/export_product_index.py 导出的内存映射矩阵）
+    self.product_index = None
+    if config.get_product_backend() == "mmap":
+      try:
+        self.product_index = ProductIndex(config.get_product_index_file())
+      except Exception as e:
+        _log.error("商品向量索引 {} 加载失败，回退到 Chroma: {}", config.get_product_index_file(), e)
+    # 商品名关键词索引（入库时构建）：与向量结果融合；查询明确指向一个商品时不计算向量
+    self.keyword_index = None
+    if config.get_hybrid_search_enabled():
+      keyword_file = config.get_product_keyword_index_file()
+      if os.path.exists(keyword_file):
+        try:
+          self.keyword_index = KeywordIndex(keyword_file)
+        except Exception as e:
+          _log.error("商品关键词索引 {} 加载失败，只使用向量检索: {}", keyword_file, e)
+      else:
+        _log.warning("商品关键词索引 {} 不存在，只使用向量检索（运行 tools/export_product_index.py 生成）", keyword_file)
     _log.info("ICBCVectorDB 向量库连接池初始化成功")
 
+  def set_redis_client(self, redis_client: Any, ttl: int = 0) -> None:
+    """启用 Redis 共享向量缓存（在 lifespan 中调用）"""
+    self.embedding_cache.redis_client = redis_client
+    self.embedding_cache.ttl = ttl
+
+  def embed_query(self, query: str) -> List[float]:
+    """同步取查询向量：只使用进程内缓存（离线脚本、线程池中调用）"""
+    text = normalize_embedding_text(query)
+    vector = self.embedding_cache.get_local(text)
+    if vector is None:
+      vector = self.embeddings.embed_query(text)
+      self.embedding_cache.put_local(text, vector)
+    return vector
+
+  async def aembed_query(self, query: str) -> List[float]:
+    """异步取查询向量：进程内 LRU → Redis → DashScope（与并发的其他查询合并请求）"""
+    text = normalize_embedding_text(query)
+    vector = await self.embedding_cache.aget(text)
+    if vector is None:
+      if self.embedding_batcher is not None:
+        vector = await self.embedding_batcher.embed(text)
+      else:
+        vector = await asyncio.to_thread(self.embeddings.embed_query, text)
+      await self.embedding_cache.aput(text, vector)
+    return vector
+
+  def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+    """批量计算查询向量。embed_documents 使用 document 类型，查询需要 query 类型，因此直接调用底层接口"""
+    result = embed_with_retry(self.embeddings, input=texts, text_type="query", model=self.embeddings.model)
+    return [item["embedding"] for item in result]
+
   # --- 异步包装方法 ---
   
-  async def asearch(self, query: str, limit: int = 3):
-    """异步搜索商品"""
-    return await asyncio.to_thread(self.search, query, limit)
+  async def asearch(self, query: str, limit: int = 3, min_points: Optional[int] = None, max_points: Optional[int] = None):
+    """
+    异步搜索商品，只返回所需积分在 [min_points, max_points] 内的商品；
+    范围内没有匹配的商品时返回不限范围的结果，并标记 out_of_range
+    """
+    _log.debug("正在执行商品向量搜索: {}，积分范围 [{}, {}]", query, min_points, max_points)
+    exact = self._keyword_exact_match(query, min_points, max_points)
+    if exact is not None:
+      return exact
+    query_vector = await self.aembed_query(query)
+    results = await self._asearch_products(query, query_vector, limit, min_points, max_points)
+    if not results and (min_points is not None or max_points is not None):
+      _log.debug("积分范围内没有匹配的商品，返回不限范围的结果: {}", query)
+      results = _mark_out_of_range(await self._asearch_products(query, query_vector, limit))
+    return results
+
+  async def _asearch_products(self, query: str, query_vector: List[float], limit: int,
+                              min_points: Optional[int] = None, max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    candidates = limit if self.keyword_index is None else limit * _HYBRID_CANDIDATE_FACTOR
+    if self.product_index is not None:
+      # 内存映射矩阵的精确检索只需一次矩阵向量乘法，不经过线程池
+      results = self.product_index.search(query_vector, candidates, min_points, max_points)
+    else:
+      results = await asyncio.to_thread(self._query_products, query_vector, candidates, min_points, max_points)
+    return self._fuse_keyword_results(query, results, limit, min_points, max_points)
 
   async def asearch_voucher_info(self, query: str, limit: int = 2) -> List[str]:
     """异步搜索立减金规则"""
-    return await asyncio.to_thread(self.search_voucher_info, query, limit)
+    _log.debug("正在搜索立减金规则: {}", query)
+    return await asyncio.to_thread(self._query_voucher_info, await self.aembed_query(query), limit)
 
   async def asearch_strategy(self, query: str, limit: int = 2) -> List[Dict[str, Any]]:
     """异步搜索积分策略"""
-    return await asyncio.to_thread(self.search_strategy, query, limit)
+    _log.debug("正在搜索积分策略: {}", query)
+    return await asyncio.to_thread(self._query_strategy, await self.aembed_query(query), limit)
+
+  # --- 原有同步方法 ---
+
+  def search(self, query: str, limit: int = 3, min_points: Optional[int] = None, max_points: Optional[int] = None):
+    _log.debug("正在执行商品向量搜索: {}，积分范围 [{}, {}]", query, min_points, max_points)
+    exact = self._keyword_exact_match(query, min_points, max_points)
+    if exact is not None:
+      return exact
+    query_vector = self.embed_query(query)
+    candidates = limit if self.keyword_index is None else limit * _HYBRID_CANDIDATE_FACTOR
+    results = self._fuse_keyword_results(
+      query, self._query_products(query_vector, candidates, min_points, max_points), limit, min_points, max_points
+    )
+    if not results and (min_points is not None or max_points is not None):
+      results = _mark_out_of_range(self._fuse_keyword_results(query, self._query_products(query_vector, candidates), limit))
+    return results
+
+  def search_voucher_info(self, query: str, limit: int = 2) -> List[str]:
+    _log.debug("正在搜索立减金规则: {}", query)
+    return self._query_voucher_info(self.embed_query(query), limit)
+
+  def search_strategy(self, query: str, limit: int = 2) -> List[Dict[str, Any]]:
+    _log.debug("正在搜索积分策略: {}", query)
+    return self._query_strategy(self.embed_query(query), limit)
+
+  # --- 关键词检索 ---
+
+  def _keyword_exact_match(self, query: str, min_points: Optional[int] = None,
+                           max_points: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    查询明确指向一个商品名时直接返回该商品，不计算向量。
+    用户点名的商品不受积分范围限制，超出范围时标记 out_of_range
+    """
+    if self.keyword_index is None:
+      return None
+    item = self.keyword_index.exact_match(query)
+    if item is None:
+      return None
+    _log.debug("商品名关键词精确命中，跳过向量检索: {}", item["name"])
+    result = [{"name": item["name"], "points": item["points"], "distance": 0.0}]
+    return result if in_points_range(item["points"], min_points, max_points) else _mark_out_of_range(result)
 
-  # --- 原有同步方法（被 asearch 系列内部调用） ---
+  def _fuse_keyword_results(self, query: str, vector_results: List[Dict[str, Any]], limit: int,
+                            min_points: Optional[int] = None, max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    BM25 结果与向量结果按倒数排名融合（同名商品视为同一条）。
+    只由关键词召回的商品没有向量距离，distance 为 None
+    """
+    if self.keyword_index is None:
+      return vector_results[:limit]
+    keyword_hits = self.keyword_index.search(query, limit * _HYBRID_CANDIDATE_FACTOR, min_points, max_points)
+    if not keyword_hits:
+      return vector_results[:limit]
+    by_name = {item["name"]: item for item in vector_results}
+    for item, _ in keyword_hits:
+      by_name.setdefault(item["name"], {"name": item["name"], "points": item["points"], "distance": None})
+    fused = reciprocal_rank_fusion([
+      [item["name"] for item in vector_results],
+      [item["name"] for item, _ in keyword_hits]
+    ], limit)
+    return [by_name[name] for name in fused]
 
-  def search(self, query: str, limit: int = 3):
-    _log.debug("正在执行商品向量搜索: {}", query)
-    query_vector = self.embeddings.embed_query(query)
+  # --- 按向量查询（同步，异步方法在线程池中调用） ---
+
+  def _query_products(self, query_vector: List[float], limit: int, min_points: Optional[int] = None, max_points: Optional[int] = None):
+    if self.product_index is not None:
+      return self.product_index.search(query_vector, limit, min_points, max_points)
     results = self.product_collection.query(
       query_embeddings=[query_vector],
-      n_results=limit
+      n_results=limit,
+      where=_points_where(min_points, max_points)
     )
     
     output = []
@@ -71,9 +369,7 @@ class ICBCVectorDB(metaclass=SingletonMeta):
         })
     return output
 
-  def search_voucher_info(self, query: str, limit: int = 2) -> List[str]:
-    _log.debug("正在搜索立减金规则: {}", query)
-    query_vector = self.embeddings.embed_query(query)
+  def _query_voucher_info(self, query_vector: List[float], limit: int) -> List[str]:
     results = self.voucher_collection.query(
       query_embeddings=[query_vector],
       n_results=limit
@@ -82,9 +378,7 @@ class ICBCVectorDB(metaclass=SingletonMeta):
       return results["documents"][0]
     return []
 
-  def search_strategy(self, query: str, limit: int = 2) -> List[Dict[str, Any]]:
-    _log.debug("正在搜索积分策略: {}", query)
-    query_vector = self.embeddings.embed_query(query)
+  def _query_strategy(self, query_vector: List[float], limit: int) -> List[Dict[str, Any]]:
     results = self.strategy_collection.query(
       query_embeddings=[query_vector],
       n_results=limit
@@ -117,6 +411,16 @@ class ICBCVectorDB(metaclass=SingletonMeta):
       metadatas=metadatas
     )
     _log.info("成功导入 {} 条商品数据", len(ids))
+    self.rebuild_keyword_index()
+
+  def rebuild_keyword_index(self) -> None:
+    """按 icbc_products 中的全部商品重建关键词索引（增量导入后也覆盖已有商品）"""
+    data = self.product_collection.get(include=["metadatas"])
+    items = [
+      {"id": item_id, "name": (metadata or {}).get("name", "未知商品"), "points": (metadata or {}).get("points", 0)}
+      for item_id, metadata in zip(data["ids"], data["metadatas"])
+    ]
+    build_keyword_index(items, config.get_product_keyword_index_file())
 
   def add_voucher_knowledge(self, qa_content: str):
     parts = re.split(r'Q[:：]', qa_content)
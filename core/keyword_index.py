@@ -0,0 +1,137 @@
+# 2 个空格对齐
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from loguru import logger as _log
+
+# 连续的汉字切成二元组；字母、数字分别按词保留（mate60 与 mate 60 切分结果相同）
+_CJK_RUN_RE = re.compile(r"[一-鿿]+")
+_ALNUM_RE = re.compile(r"[a-z]+|[0-9]+(?:\.[0-9]+)?")
+_STRIP_RE = re.compile(r"[\W_]+")
+
+# BM25 参数
+_K1 = 1.2
+_B = 0.75
+# 倒数排名融合的平滑常数
+_RRF_K = 60
+
+def in_points_range(points: Any, min_points: Optional[int] = None, max_points: Optional[int] = None) -> bool:
+  return (min_points is None or points >= min_points) and (max_points is None or points <= max_points)
+
+def normalize_text(text: str) -> str:
+  """全角转半角、小写、去掉空白与标点"""
+  return _STRIP_RE.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+def tokenize(text: str) -> List[str]:
+  text = unicodedata.normalize("NFKC", text or "").lower()
+  tokens = _ALNUM_RE.findall(text)
+  for run in _CJK_RUN_RE.findall(text):
+    if len(run) == 1:
+      tokens.append(run)
+    else:
+      tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+  return tokens
+
+def build_keyword_index(items: Sequence[Dict[str, Any]], path: str) -> None:
+  """
+  入库时构建商品名的字符 n-gram 倒排索引（BM25），写入 JSON 文件。
+  items 为 [{id, name, points}]，先写临时文件再替换，运行中的服务下次检索时自动重新加载
+  """
+  postings: Dict[str, List[List[int]]] = defaultdict(list)
+  lengths = []
+  for idx, item in enumerate(items):
+    counts = Counter(tokenize(item["name"]))
+    lengths.append(sum(counts.values()))
+    for token, tf in counts.items():
+      postings[token].append([idx, tf])
+  data = {
+    "items": [{"id": item.get("id"), "name": item["name"], "points": item.get("points", 0)} for item in items],
+    "lengths": lengths,
+    "postings": postings
+  }
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with open(path + ".tmp", "w", encoding="utf-8") as f:
+    json.dump(data, f, ensure_ascii=False)
+  os.replace(path + ".tmp", path)
+  _log.info("商品关键词索引已写入 {}，{} 条商品，{} 个词项", path, len(items), len(postings))
+
+class KeywordIndex:
+  """商品名的 BM25 倒排索引（只读，文件变化时重新加载）"""
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._mtime = None
+    self._load()
+
+  def _load(self) -> None:
+    mtime = os.stat(self.path).st_mtime_ns
+    with open(self.path, "r", encoding="utf-8") as f:
+      data = json.load(f)
+    self.items: List[Dict[str, Any]] = data["items"]
+    self.lengths: List[int] = data["lengths"]
+    self.postings: Dict[str, List[List[int]]] = data["postings"]
+    self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 1.0
+    self.normalized_names = [normalize_text(item["name"]) for item in self.items]
+    self._mtime = mtime
+    _log.info("商品关键词索引已加载: {}，{} 条", self.path, len(self.items))
+
+  def _maybe_reload(self) -> None:
+    try:
+      if os.stat(self.path).st_mtime_ns == self._mtime:
+        return
+      with self._lock:
+        if os.stat(self.path).st_mtime_ns != self._mtime:
+          self._load()
+    except Exception as e:
+      _log.warning("重新加载商品关键词索引失败: {}", e)
+
+  def search(self, query: str, limit: int = 10, min_points: Optional[int] = None,
+             max_points: Optional[int] = None) -> List[Tuple[Dict[str, Any], float]]:
+    """返回 [(商品, BM25 分数)]，按分数从高到低；只保留所需积分在 [min_points, max_points] 内的商品"""
+    self._maybe_reload()
+    items, lengths, postings, avg_length = self.items, self.lengths, self.postings, self.avg_length
+    n = len(items)
+    scores: Dict[int, float] = defaultdict(float)
+    for token in set(tokenize(query)):
+      posting = postings.get(token)
+      if not posting:
+        continue
+      idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+      for idx, tf in posting:
+        if not in_points_range(items[idx]["points"], min_points, max_points):
+          continue
+        norm = _K1 * (1 - _B + _B * lengths[idx] / avg_length)
+        scores[idx] += idf * tf * (_K1 + 1) / (tf + norm)
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [(items[idx], score) for idx, score in ranked]
+
+  def exact_match(self, query: str) -> Optional[Dict[str, Any]]:
+    """
+    查询明确指向一个商品时返回该商品：归一化后与商品名完全相同，
+    或者是且仅是一个商品名的一部分（至少 4 个字符，避免“e卡”之类的短词）
+    """
+    self._maybe_reload()
+    items, names = self.items, self.normalized_names
+    normalized = normalize_text(query)
+    if not normalized:
+      return None
+    exact = [i for i, name in enumerate(names) if name == normalized]
+    if len(exact) == 1:
+      return items[exact[0]]
+    if exact or len(normalized) < 4:
+      return None
+    contained = [i for i, name in enumerate(names) if normalized in name]
+    return items[contained[0]] if len(contained) == 1 else None
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], limit: int) -> List[str]:
+  """倒数排名融合：各路结果按 1/(k + 名次) 累加，返回融合后的前 limit 个 key"""
+  scores: Dict[str, float] = defaultdict(float)
+  for ranking in rankings:
+    for rank, key in enumerate(ranking):
+      scores[key] += 1.0 / (_RRF_K + rank + 1)
+  return sorted(scores, key=lambda key: scores[key], reverse=True)[:limit]
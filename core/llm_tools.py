@@ -1,11 +1,98 @@
 # 2 个空格对齐
 from langchain_core.tools import tool
+import re
+import asyncio
 import random
+from typing import Annotated, Any, Dict, List, Optional
 import httpx # 建议用于异步 HTTP 请求
+from langgraph.prebuilt import InjectedState
 from loguru import logger as _log
 
 import config.config as config
 from core.icbc_db import ICBCVectorDB
+from core.keyword_index import in_points_range
+from core import speculation
+from core import run_budget
+from core.redemption_plan import compute_plans
+
+# 商城检索返回的候选数量
+_ICBC_SEARCH_LIMIT = 3
+# 预取不限积分范围，多取一些候选，工具按积分范围过滤后仍有足够的商品时直接复用
+_ICBC_SPECULATION_LIMIT = _ICBC_SEARCH_LIMIT * 3
+_ICBC_SEARCH_SPECULATION = "vector_search_icbc_mall"
+
+# 模拟的京东商品库（实际场景可换成 httpx 请求京东联盟接口）
+_JD_DATABASE = [
+  {"name": "霸王茶姬代金券20元", "price": 20.0, "support_ecard": True},
+  {"name": "禧天龙保鲜盒两件套H80407", "price": 18.9, "support_ecard": False},
+  {"name": "特来电500元余额充值", "price": 500.0, "support_ecard": True},
+  {"name": "小米米家桌面暖风机", "price": 89.0, "support_ecard": False},
+  {"name": "雪碧 含糖雪碧 200mlx12罐", "price": 15.9, "support_ecard": False},
+  {"name": "奈雪的茶代金券10元", "price": 6.6, "support_ecard": True},
+  {"name": "华为Mate 60 Pro", "price": 5499.0, "support_ecard": True}
+]
+
+# 从工行商城的E卡商品名中解析面额，如“京东E卡50元”
+_ECARD_NAME_RE = re.compile(r"[eE]卡")
+_YUAN_RE = re.compile(r"(\d+(?:\.\d+)?)\s*元")
+_ECARD_QUERY = "京东E卡"
+
+def speculate_icbc_search(prompt: str) -> None:
+  """用用户原始输入提前发起商城检索，与第一次 LLM 调用并行；工具的查询与之足够相似时直接复用结果"""
+  speculation.start(
+    _ICBC_SEARCH_SPECULATION,
+    prompt,
+    lambda: ICBCVectorDB().asearch(prompt, limit=_ICBC_SPECULATION_LIMIT)
+  )
+
+async def _search_icbc(query: str, min_points: Optional[int] = None, max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+  # 与第一次 LLM 调用并行发起的预取命中时直接复用：预取不限积分范围，在这里按范围过滤，
+  # 范围内的商品不足 _ICBC_SEARCH_LIMIT 条时不能代表范围内的最佳结果，重新按范围检索
+  speculative = speculation.claim(_ICBC_SEARCH_SPECULATION, query, config.get_speculative_search_threshold())
+  if speculative is not None:
+    try:
+      results = [item for item in await speculative if in_points_range(item["points"], min_points, max_points)]
+      if len(results) >= _ICBC_SEARCH_LIMIT:
+        return results[:_ICBC_SEARCH_LIMIT]
+      _log.debug("预取结果在积分范围 [{}, {}] 内只有 {} 条，重新检索", min_points, max_points, len(results))
+    except Exception as e:
+      _log.warning("预取的商城检索失败，重新检索: {}", e)
+  return await ICBCVectorDB().asearch(query, limit=_ICBC_SEARCH_LIMIT, min_points=min_points, max_points=max_points)
+
+# 时间预算不足、跳过京东比价时返回给模型的说明
+_JD_SKIPPED = "本轮时间预算不足，已跳过京东比价，请只基于工行商城的数据回答，并提示用户可稍后再比价。"
+
+async def _none() -> None:
+  return None
+
+async def _lookup_jd(keyword: str) -> Optional[Dict[str, Any]]:
+  """在京东搜索同款，没有时返回 None"""
+  # 模拟异步 IO 操作（实际场景可换成 httpx 请求）
+  match = next((item for item in _JD_DATABASE if keyword in item["name"]), None)
+  
+  if match:
+    return {
+      "sku_name": f"京东自营-{match['name']}",
+      "price": match["price"],
+      "promo_link": f"https://u.jd.com/p?k={keyword}",
+      "source": "JD_MALL",
+      "support_ecard": match["support_ecard"]
+    }
+  
+  return None
+
+def ecard_rate_from_results(results: List[Dict[str, Any]]) -> Optional[float]:
+  """从工行商城检索结果中找出京东E卡，按 i豆价/面额 换算兑换比率（豆/元），取最划算的一档"""
+  rates = []
+  for item in results or []:
+    name = str(item.get("name", ""))
+    yuan = _YUAN_RE.search(name)
+    if not _ECARD_NAME_RE.search(name) or not yuan or not item.get("points"):
+      continue
+    face = float(yuan.group(1))
+    if face > 0:
+      rates.append(float(item["points"]) / face)
+  return min(rates) if rates else None
 
 # --- 1. 定义工具集 (Tools) ---
 
@@ -28,26 +115,32 @@ from core.icbc_db import ICBCVectorDB
 #  }
 
 @tool
-async def vector_search_icbc_mall(query: str):
+async def vector_search_icbc_mall(
+  query: str,
+  min_points: Optional[int] = None,
+  max_points: Optional[int] = None,
+  state: Annotated[Optional[dict], InjectedState] = None
+):
   """
   【核心指令】调用此工具检索工银i豆商城中的商品候选列表，此数据库为向量数据库。
   
   重要操作规范：
-  1. 语义筛选：返回结果基于向量相似度，可能包含噪音。你必须作为审计员，剔除任何不符合用户意图的商品。
+  1. 语义筛选：返回结果融合了向量相似度和商品名关键词匹配，可能包含噪音。你必须作为审计员，剔除任何不符合用户意图的商品。
+  2. 积分范围：只返回所需i豆在 [min_points, max_points] 内的商品。不填 max_points 时默认使用用户已告知的i豆余额。
+     范围内没有匹配的商品时返回不限范围的结果，这些商品带有 out_of_range: true，不要再为此重复检索。
 
   Args:
     query (str): 用户的原始需求、意图关键词或具体的商品名称。
+    min_points (int): 所需i豆下限，没有要求时不填。
+    max_points (int): 所需i豆上限，没有要求时不填。
     
   Returns:
-    list[dict]: 商品字典列表。每个字典包含: name, points, distance。
+    list[dict]: 商品字典列表。每个字典包含: name, points, distance（仅由关键词匹配到的商品为 null），超出积分范围时还有 out_of_range。
   """
-  _log.info("vector_search_icbc_mall tool: 搜索工银i豆商城，查询语句：{}", query)
-  
-  # 假设 ICBCVectorDB 已经支持异步搜索，或者在内部处理了线程池
-  icbc_db = ICBCVectorDB()
-  results = await icbc_db.asearch(query, limit=3) 
-  
-  return results
+  if max_points is None and state:
+    max_points = state.get("user_points")
+  _log.info("vector_search_icbc_mall tool: 搜索工银i豆商城，查询语句：{}，积分范围 [{}, {}]", query, min_points, max_points)
+  return await _search_icbc(query, min_points, max_points)
 
 @tool
 async def search_jd_promotion(keyword: str):
@@ -61,31 +154,110 @@ async def search_jd_promotion(keyword: str):
     dict: 京东数据。包含 sku_name, price, promo_link, support_ecard 等。
   """
   _log.info("search_jd_promotion tool: 搜索京东，关键词：{}", keyword)
-  
-  # 模拟异步 IO 操作（实际场景可换成 httpx 请求）
-  jd_database = [
-    {"name": "霸王茶姬代金券20元", "price": 20.0, "support_ecard": True},
-    {"name": "禧天龙保鲜盒两件套H80407", "price": 18.9, "support_ecard": False},
-    {"name": "特来电500元余额充值", "price": 500.0, "support_ecard": True},
-    {"name": "小米米家桌面暖风机", "price": 89.0, "support_ecard": False},
-    {"name": "雪碧 含糖雪碧 200mlx12罐", "price": 15.9, "support_ecard": False},
-    {"name": "奈雪的茶代金券10元", "price": 6.6, "support_ecard": True},
-    {"name": "华为Mate 60 Pro", "price": 5499.0, "support_ecard": True}
-  ]
+  if not run_budget.allow_optional("search_jd_promotion"):
+    return _JD_SKIPPED
+  return await _lookup_jd(keyword)
+
+@tool
+async def compare_redemption_options(
+  intent: str,
+  user_points: Optional[int] = None,
+  state: Annotated[Optional[dict], InjectedState] = None
+):
+  """
+  【首选比价工具】一次完成：工行商城检索候选商品、京东同款比价、京东E卡实时兑换比率查询，并精算每个候选商品的三种兑换方案。
+  用户有明确的商品需求时优先调用此工具，不需要再分别调用 vector_search_icbc_mall、search_jd_promotion 和 calculate_redemption_plans。
+  返回的候选来自向量检索，可能包含噪音，你必须剔除不符合用户意图的商品。
+  已知i豆余额时只检索余额买得起的商品；没有买得起的商品时返回不限范围的候选，这些候选带有 out_of_range: true。
+
+  Args:
+    intent (str): 用户想要的商品或需求关键词，如“华为手机”、“霸王茶姬代金券”。
+    user_points (int): 用户当前的i豆余额，未知时不填。
+
+  Returns:
+    dict: ecard_rate（E卡兑换比率，豆/元）、candidates（每个候选商品的工行i豆价、京东同款、各方案精算结果）、jd_for_intent（按需求直接搜到的京东商品）。
+  """
+  # 与 vector_search_icbc_mall 相同：没有传余额时使用用户已告知的余额作为积分上限
+  if user_points is None and state:
+    user_points = state.get("user_points")
+  _log.info("compare_redemption_options tool: 比价，intent={}, user_points={}", intent, user_points)
+
+  # 时间预算不足时只查工行商城，跳过京东比价（E卡比率也只在京东比价时有用）
+  with_jd = run_budget.allow_optional("compare_redemption_options.jd")
+
+  # 1. 商城检索、E卡检索、按原始需求查京东并行执行
+  icbc_results, ecard_results, jd_for_intent = await asyncio.gather(
+    _search_icbc(intent, max_points=user_points),
+    ICBCVectorDB().asearch(_ECARD_QUERY, limit=_ICBC_SEARCH_LIMIT) if with_jd else _none(),
+    _lookup_jd(intent) if with_jd else _none()
+  )
+  ecard_rate = ecard_rate_from_results(ecard_results)
+
+  # 2. 每个候选商品并行查京东同款
+  jd_results = await asyncio.gather(*(_lookup_jd(item["name"]) if with_jd else _none() for item in icbc_results))
+
+  voucher_rate = config.get_icbc_voucher_rate()
+  candidates = []
+  for item, jd in zip(icbc_results, jd_results):
+    candidates.append({
+      "icbc_name": item["name"],
+      "icbc_points": item["points"],
+      "distance": item.get("distance"),
+      "out_of_range": item.get("out_of_range", False),
+      "jd": jd,
+      "plans": compute_plans(
+        item["points"],
+        jd["price"] if jd else None,
+        bool(jd and jd["support_ecard"]),
+        ecard_rate,
+        voucher_rate,
+        user_points
+      )
+    })
+  # 工行商城没有合适商品时，仍然给出京东同款的卡券方案
+  if not candidates and jd_for_intent:
+    candidates.append({
+      "icbc_name": None,
+      "icbc_points": None,
+      "jd": jd_for_intent,
+      "plans": compute_plans(None, jd_for_intent["price"], jd_for_intent["support_ecard"], ecard_rate, voucher_rate, user_points)
+    })
+
+  return {
+    "ecard_rate": ecard_rate,
+    "voucher_rate": voucher_rate,
+    "candidates": candidates,
+    # 按原始需求在京东找到的商品，候选商品在京东没有同款时可作参考
+    "jd_for_intent": jd_for_intent,
+    "note": None if with_jd else _JD_SKIPPED
+  }
+
+@tool
+async def calculate_redemption_plans(
+  icbc_points: Optional[int] = None,
+  jd_price: Optional[float] = None,
+  support_ecard: bool = False,
+  ecard_rate: Optional[float] = None,
+  user_points: Optional[int] = None
+):
+  """
+  精算三种兑换路径（A 工行直兑 / B 京东E卡 / C 微信立减金）的i豆消耗、现金差价和风控提示。
+  拿到商品价格后必须调用此工具计算，禁止自行计算。
+
+  Args:
+    icbc_points (int): 工行商城该商品的i豆价，商城没有该商品时不填。
+    jd_price (float): 京东同款售价（元），京东没有同款时不填。
+    support_ecard (bool): 京东商品是否支持E卡（search_jd_promotion 的 support_ecard）。
+    ecard_rate (float): E卡实时兑换比率（豆/元），由检索“京东E卡”的结果换算，如 50000豆兑50元 则为 1000。
+    user_points (int): 用户当前的i豆余额，未知时不填。
+
+  Returns:
+    dict: plans（每个方案的 feasible、points、card_yuan、cash、affordable 或不可行原因）、best_plan、saving_points、warnings。
+  """
+  _log.info("calculate_redemption_plans tool: icbc_points={}, jd_price={}, support_ecard={}, ecard_rate={}, user_points={}",
+            icbc_points, jd_price, support_ecard, ecard_rate, user_points)
+  return compute_plans(icbc_points, jd_price, support_ecard, ecard_rate, config.get_icbc_voucher_rate(), user_points)
 
-  match = next((item for item in jd_database if keyword in item["name"]), None)
-  
-  if match:
-    return {
-      "sku_name": f"京东自营-{match['name']}",
-      "price": match["price"],
-      "promo_link": f"https://u.jd.com/p?k={keyword}",
-      "source": "JD_MALL",
-      "support_ecard": match["support_ecard"]
-    }
-  
-  return None
-  
 @tool
 async def get_points_activities(gap_points: int = 0):
   """
@@ -0,0 +1,139 @@
+# 2 个空格对齐
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger as _log
+
+from util.singleton import SingletonMeta
+
+# Redis 中汇总所有 worker 进程指标的 hash，field 为 "指标名|标签"，value 为累计值
+_METRICS_KEY = "metrics:{llm}"
+
+_HELP = {
+  "llm_requests_total": ("counter", "LLM 调用次数"),
+  "llm_prompt_tokens_total": ("counter", "输入 token 总数"),
+  "llm_prompt_cached_tokens_total": ("counter", "命中服务商前缀缓存的输入 token 数"),
+  "llm_prompt_uncached_tokens_total": ("counter", "未命中前缀缓存的输入 token 数"),
+  "llm_completion_tokens_total": ("counter", "输出 token 总数"),
+  "llm_first_token_seconds_sum": ("counter", "首个分片延迟累计秒数"),
+  "llm_first_token_seconds_count": ("counter", "首个分片延迟样本数"),
+  "llm_hedged_requests_total": ("counter", "首分片超时后发起的对冲请求数（标签为慢的服务商）"),
+  "llm_provider_errors_total": ("counter", "服务商调用失败次数"),
+  "chat_degraded_total": ("counter", "因时间或轮次预算不足而降级的对话次数（deadline / max_model_calls / skipped）"),
+  "answer_cache_hits_total": ("counter", "首轮问题命中答案缓存的次数"),
+  "llm_cascade_total": ("counter", "简单轮次由快速模型回答（route=fast）或升级到强模型（route=escalated）的次数"),
+}
+
+def _field(name: str, labels: Dict[str, str]) -> str:
+  return name + "|" + ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+def _parse_field(field: str) -> Tuple[str, str]:
+  name, _, labels = field.partition("|")
+  rendered = ",".join(f'{k}="{v}"' for k, v in (item.split("=", 1) for item in labels.split(",") if item))
+  return name, rendered
+
+def cached_prompt_tokens(message: Any) -> Optional[int]:
+  """
+  从模型返回中读取命中前缀缓存的输入 token 数：
+  - OpenAI / Qwen：usage.prompt_tokens_details.cached_tokens（langchain 映射为 input_token_details.cache_read）
+  - DeepSeek：usage.prompt_cache_hit_tokens
+  服务商未返回时为 None
+  """
+  usage = getattr(message, "usage_metadata", None) or {}
+  cache_read = (usage.get("input_token_details") or {}).get("cache_read")
+  if cache_read is not None:
+    return int(cache_read)
+  token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+  if "prompt_cache_hit_tokens" in token_usage:
+    return int(token_usage["prompt_cache_hit_tokens"])
+  cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+  return int(cached) if cached is not None else None
+
+class LLMMetrics(metaclass=SingletonMeta):
+  """
+  LLM 调用指标。进程内累加，由后台任务定期把增量写入 Redis 汇总（多 worker 进程共享端口，
+  /metrics 请求可能落到任意进程，因此输出的是所有进程的汇总值）。
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._pending: Dict[str, float] = {}
+    self._local: Dict[str, float] = {}
+
+  def inc(self, name: str, value: float = 1, **labels: str) -> None:
+    field = _field(name, labels)
+    with self._lock:
+      self._pending[field] = self._pending.get(field, 0) + value
+      self._local[field] = self._local.get(field, 0) + value
+
+  def record_call(self, model: str, message: Any, first_token_seconds: Optional[float]) -> None:
+    """记录一次 LLM 调用的 token 用量与首分片延迟"""
+    self.inc("llm_requests_total", model=model)
+    if first_token_seconds is not None:
+      self.inc("llm_first_token_seconds_sum", first_token_seconds, model=model)
+      self.inc("llm_first_token_seconds_count", model=model)
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+      return
+    prompt_tokens = usage.get("input_tokens", 0)
+    self.inc("llm_prompt_tokens_total", prompt_tokens, model=model)
+    self.inc("llm_completion_tokens_total", usage.get("output_tokens", 0), model=model)
+    cached = cached_prompt_tokens(message)
+    if cached is not None:
+      self.inc("llm_prompt_cached_tokens_total", cached, model=model)
+      self.inc("llm_prompt_uncached_tokens_total", prompt_tokens - cached, model=model)
+    _log.debug("LLM 用量 model={} prompt={} cached={} completion={}", model, prompt_tokens, cached, usage.get("output_tokens", 0))
+
+  async def flush(self, redis_client: Any) -> None:
+    with self._lock:
+      pending, self._pending = self._pending, {}
+    if not pending:
+      return
+    try:
+      async with redis_client.pipeline(transaction=False) as pipe:
+        for field, value in pending.items():
+          pipe.hincrbyfloat(_METRICS_KEY, field, value)
+        await pipe.execute()
+    except Exception as e:
+      # 写回待发送的增量，下次再试
+      with self._lock:
+        for field, value in pending.items():
+          self._pending[field] = self._pending.get(field, 0) + value
+      _log.warning("指标写入 Redis 失败: {}", e)
+
+  async def run_flusher(self, redis_client: Any, interval: float = 10) -> None:
+    """后台任务：定期汇总到 Redis，取消时最后写一次"""
+    try:
+      while True:
+        await asyncio.sleep(interval)
+        await self.flush(redis_client)
+    except asyncio.CancelledError:
+      await self.flush(redis_client)
+      raise
+
+  async def render(self, redis_client: Any = None) -> str:
+    """Prometheus 文本格式；Redis 不可用时输出本进程的值"""
+    values = None
+    if redis_client is not None:
+      try:
+        await self.flush(redis_client)
+        raw = await redis_client.hgetall(_METRICS_KEY)
+        values = {k.decode("utf-8") if isinstance(k, bytes) else k: float(v) for k, v in raw.items()}
+      except Exception as e:
+        _log.warning("读取 Redis 汇总指标失败: {}", e)
+    if values is None:
+      with self._lock:
+        values = dict(self._local)
+
+    lines = []
+    by_name: Dict[str, list] = {}
+    for field, value in sorted(values.items()):
+      name, labels = _parse_field(field)
+      by_name.setdefault(name, []).append((labels, value))
+    for name, samples in by_name.items():
+      kind, help_text = _HELP.get(name, ("untyped", name))
+      lines.append(f"# HELP {name} {help_text}")
+      lines.append(f"# TYPE {name} {kind}")
+      for labels, value in samples:
+        value = int(value) if float(value).is_integer() else round(value, 6)
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -7,6 +7,8 @@ from loguru import logger as _log
 
 # 使用全局变量实现简单的进程内单例
 _model_instance = None
+# 按档位（fast / strong）缓存的模型池
+_pool_instances = {}
 
 def get_model():
   """
@@ -21,7 +23,28 @@ def get_model():
   resource = get_resource()
   # 优先从配置获取，默认混元
   mode_name = resource.get("active_model", "hunyuan")
-  
+  _model_instance = create_model(mode_name)
+  return _model_instance
+
+def get_model_pool(tier: str = "strong"):
+  """
+  获取多服务商模型池（进程内单例，每个档位一个）。
+  成员来自 resource.yaml 的 model_pool 列表，按各模型定义中的 tier（fast / strong，默认 strong）分档；
+  未配置 model_pool 时只包含 active_model。某档位没有成员时返回 None。
+  """
+  if tier in _pool_instances:
+    return _pool_instances[tier]
+
+  from core.model_pool import ModelPool
+  resource = get_resource()
+  names = resource.get("model_pool") or [resource.get("active_model", "hunyuan")]
+  members = [name for name in names if resource["models"].get(name, {}).get("tier", "strong") == tier]
+  _pool_instances[tier] = ModelPool({name: create_model(name) for name in members}) if members else None
+  return _pool_instances[tier]
+
+def create_model(mode_name: str):
+  """按 resource.yaml 中 models 下的定义创建一个 LLM 实例"""
+  resource = get_resource()
   if mode_name not in resource["models"]:
     _log.error("配置中未找到模型 {} 的定义", mode_name)
     raise ValueError(f"Model {mode_name} not configured")
@@ -36,15 +59,15 @@ def get_model():
             model_param["model_name"], 
             model_param["base_url"])
 
-  _model_instance = ChatOpenAI(
+  return ChatOpenAI(
     model=model_param["model_name"],
     api_key=real_api_key,
     base_url=model_param["base_url"],
     temperature=model_param.get("temperature", 0),
     # 增加超时配置，防止异步链路死锁
-    timeout=60,
+    timeout=model_param.get("timeout", 60),
     # 开启流式支持
-    streaming=True 
+    streaming=True,
+    # 流式输出时同样返回 token 用量（最后一个分片的 usage_metadata）
+    stream_usage=True
   )
-  
-  return _model_instance
\ No newline at end of file
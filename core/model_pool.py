@@ -0,0 +1,179 @@
+# 2 个空格对齐
+import time
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from langchain_core.messages import BaseMessage, BaseMessageChunk
+from loguru import logger as _log
+
+import config.config as config
+from core.metrics import LLMMetrics
+
+# 每个服务商保留的首分片延迟样本数；样本不足时不计算分位数
+_LATENCY_SAMPLES = 50
+_MIN_SAMPLES = 5
+# 错误率的指数滑动平均系数
+_ERROR_DECAY = 0.9
+
+class ProviderHealth:
+  """单个服务商的健康度：最近的首分片延迟、错误率（指数滑动平均）以及连续失败后的熔断"""
+  def __init__(self, name: str):
+    self.name = name
+    self.latencies = deque(maxlen=_LATENCY_SAMPLES)
+    self.error_rate = 0.0
+    self.failures = 0
+    self.cooldown_until = 0.0
+
+  def record_latency(self, seconds: float) -> None:
+    self.latencies.append(seconds)
+
+  def record_success(self) -> None:
+    self.error_rate *= _ERROR_DECAY
+    self.failures = 0
+
+  def record_failure(self, threshold: int, cooldown: float) -> None:
+    self.error_rate = self.error_rate * _ERROR_DECAY + (1 - _ERROR_DECAY)
+    self.failures += 1
+    if self.failures >= threshold:
+      self.cooldown_until = time.monotonic() + cooldown
+      _log.warning("模型服务商 {} 连续失败 {} 次，暂停使用 {} 秒", self.name, self.failures, cooldown)
+
+  def available(self) -> bool:
+    return time.monotonic() >= self.cooldown_until
+
+  def quantile(self, q: float) -> Optional[float]:
+    if len(self.latencies) < _MIN_SAMPLES:
+      return None
+    ordered = sorted(self.latencies)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class ModelPool:
+  """
+  多服务商模型池，对外提供与 ChatOpenAI 相同的 bind_tools / astream / ainvoke 接口：
+  - 按健康度（首分片延迟中位数 × 错误率惩罚）排序选择服务商，熔断中的服务商排在最后
+  - astream 在首分片超过当前服务商 p95 延迟时向下一个服务商发起对冲请求，先返回首分片的一方胜出，另一方被取消
+  - 首分片之前失败（包括没有任何分片的空响应）时立即切换到下一个服务商；首分片之后失败直接抛出（已输出的内容无法撤回）
+  """
+  def __init__(self, models: Dict[str, Any], health: Optional[Dict[str, ProviderHealth]] = None):
+    self.models = models
+    self.health = health if health is not None else {name: ProviderHealth(name) for name in models}
+    self.model_name = "+".join(models)
+    self.hedge_enabled = config.get_llm_hedge_enabled()
+    self.hedge_min_delay = config.get_llm_hedge_min_delay()
+    self.hedge_max_delay = config.get_llm_hedge_max_delay()
+    self.failure_threshold = config.get_llm_failure_threshold()
+    self.failure_cooldown = config.get_llm_failure_cooldown()
+
+  def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "ModelPool":
+    """每个服务商各自绑定工具，健康度共享"""
+    return ModelPool({name: model.bind_tools(tools, **kwargs) for name, model in self.models.items()}, self.health)
+
+  def ranked(self) -> List[str]:
+    def score(name: str) -> float:
+      health = self.health[name]
+      median = health.quantile(0.5)
+      # 没有样本的服务商按最小对冲延迟估计，使其有机会被选中并积累样本
+      latency = self.hedge_min_delay if median is None else median
+      return latency * (1 + 4 * health.error_rate)
+    available = [name for name in self.models if self.health[name].available()]
+    cooling = [name for name in self.models if not self.health[name].available()]
+    # 全部熔断时仍按原顺序尝试，避免完全不可用
+    return sorted(available, key=score) + sorted(cooling, key=lambda name: self.health[name].cooldown_until)
+
+  def hedge_delay(self, name: str) -> float:
+    p95 = self.health[name].quantile(0.95)
+    if p95 is None:
+      return self.hedge_max_delay
+    return min(max(p95, self.hedge_min_delay), self.hedge_max_delay)
+
+  def _failed(self, name: str, error: BaseException) -> None:
+    self.health[name].record_failure(self.failure_threshold, self.failure_cooldown)
+    LLMMetrics().inc("llm_provider_errors_total", model=name)
+    _log.warning("模型服务商 {} 调用失败: {}", name, error)
+
+  async def astream(self, messages: Sequence[BaseMessage], **kwargs: Any) -> AsyncIterator[BaseMessageChunk]:
+    candidates = self.ranked()
+    # 正在等待首分片的请求：task -> (服务商, 流, 开始时间)
+    attempts: Dict[asyncio.Future, tuple] = {}
+    winner = None
+    hedged = False
+    last_error: Optional[BaseException] = None
+
+    def launch() -> None:
+      name = candidates.pop(0)
+      stream = self.models[name].astream(messages, **kwargs)
+      attempts[asyncio.ensure_future(stream.__anext__())] = (name, stream, time.monotonic())
+
+    try:
+      while winner is None:
+        if not attempts:
+          if not candidates:
+            raise last_error or RuntimeError("没有可用的模型服务商")
+          launch()
+        delay = None
+        if self.hedge_enabled and not hedged and candidates and len(attempts) == 1:
+          name, _, started = next(iter(attempts.values()))
+          delay = max(0.0, self.hedge_delay(name) - (time.monotonic() - started))
+        done, _ = await asyncio.wait(attempts, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+          hedged = True
+          LLMMetrics().inc("llm_hedged_requests_total", model=name)
+          launch()
+          _log.info("模型服务商 {} 首分片超过 {:.2f} 秒，对冲请求 {}", name, delay, list(attempts.values())[-1][0])
+          continue
+        for task in done:
+          name, stream, started = attempts.pop(task)
+          error = task.exception()
+          if error is None:
+            if winner is None:
+              winner = (name, stream, task.result(), time.monotonic() - started)
+            else:
+              await stream.aclose()
+          else:
+            if isinstance(error, StopAsyncIteration):
+              error = RuntimeError(f"模型服务商 {name} 返回了空响应")
+            last_error = error
+            self._failed(name, error)
+    finally:
+      # 取消仍在等待首分片的请求（对冲的输家），其已等待的时长作为延迟的下界记录
+      for task, (name, stream, started) in attempts.items():
+        task.cancel()
+        self.health[name].record_latency(time.monotonic() - started)
+      for task, (name, stream, _) in attempts.items():
+        try:
+          await task
+        except BaseException:
+          pass
+        await stream.aclose()
+
+    name, stream, first, first_token_seconds = winner
+    health = self.health[name]
+    health.record_latency(first_token_seconds)
+    response = first
+    yield first
+    try:
+      async for chunk in stream:
+        response = response + chunk
+        yield chunk
+    except Exception as e:
+      self._failed(name, e)
+      raise
+    finally:
+      await stream.aclose()
+    health.record_success()
+    LLMMetrics().record_call(name, response, first_token_seconds)
+
+  async def ainvoke(self, messages: Sequence[BaseMessage], **kwargs: Any) -> Any:
+    """非流式调用（如后台摘要）：不对冲，失败时按健康度顺序切换服务商"""
+    last_error: Optional[BaseException] = None
+    for name in self.ranked():
+      try:
+        result = await self.models[name].ainvoke(messages, **kwargs)
+      except Exception as e:
+        last_error = e
+        self._failed(name, e)
+        continue
+      self.health[name].record_success()
+      LLMMetrics().record_call(name, result, None)
+      return result
+    raise last_error or RuntimeError("没有可用的模型服务商")
@@ -0,0 +1,39 @@
+# 2 个空格对齐
+import re
+from typing import Optional, Sequence
+from langchain_core.messages import BaseMessage, HumanMessage
+
+# 出现这些内容时需要比价、检索或计算，交给强模型（输入已转成小写）
+_COMPLEX_RE = re.compile(r"\d|豆|积分|换|兑|买|价|划算|京东|e卡|立减金|商品|推荐|比|多少|活动|攒|规则|怎么用|方案|帮我|查|找|搜")
+# 快速模型的回答中出现这些内容说明它没把握，升级到强模型
+_UNSURE_RE = re.compile(r"无法|不确定|不清楚|抱歉|没有相关|查询一下|稍后")
+
+# 只有不超过这个长度的输入才可能被判为简单轮次
+_SIMPLE_MAX_CHARS = 30
+
+def is_simple_turn(messages: Sequence[BaseMessage]) -> bool:
+  """
+  判断本次模型调用能否交给快速模型：只看每轮的第一次调用（最后一条是用户消息），
+  工具返回之后的调用总是需要强模型综合计算。
+  寒暄、致谢等短句交给快速模型；只要出现需要检索或计算的内容就交给强模型，
+  即使句子以寒暄开头（如“你好，我有5万豆想换个华为手机”）
+  """
+  if not messages or not isinstance(messages[-1], HumanMessage):
+    return False
+  text = str(messages[-1].content).strip().lower()
+  if not text or len(text) > _SIMPLE_MAX_CHARS:
+    return False
+  return not _COMPLEX_RE.search(text)
+
+def reject_reason(message: BaseMessage, max_chars: int) -> Optional[str]:
+  """检查快速模型的输出，返回需要升级的原因；可以直接使用时返回 None"""
+  if getattr(message, "tool_calls", None) or getattr(message, "tool_call_chunks", None):
+    return "tools"
+  content = message.content if isinstance(message.content, str) else str(message.content)
+  if not content.strip():
+    return "empty"
+  if len(content) > max_chars:
+    return "too_long"
+  if _UNSURE_RE.search(content):
+    return "unsure"
+  return None
@@ -0,0 +1,167 @@
+# 2 个空格对齐
+import os
+import glob
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from loguru import logger as _log
+
+# int8 量化：归一化后的分量在 [-1, 1]，统一乘以该系数取整
+_INT8_SCALE = 127.0
+# 检索时每次参与计算的行数
+_BLOCK_ROWS = 4096
+_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+def _meta_path(path: str) -> str:
+  return path + ".meta.json"
+
+def _versioned_path(path: str, version: str) -> str:
+  """某个版本的矩阵文件：data/product_index.npy -> data/product_index.<version>.npy"""
+  root, ext = os.path.splitext(path)
+  return f"{root}.{version}{ext}"
+
+def _remove_stale_matrices(path: str, keep: Sequence[str]) -> None:
+  """删除不再被引用的旧版本矩阵（已映射旧文件的 worker 不受影响）"""
+  root, ext = os.path.splitext(path)
+  for stale in glob.glob(f"{glob.escape(root)}.*{ext}"):
+    if os.path.basename(stale) not in keep:
+      try:
+        os.remove(stale)
+      except OSError as e:
+        _log.warning("删除旧的商品向量矩阵 {} 失败: {}", stale, e)
+
+def export_product_index(
+  ids: Sequence[str],
+  embeddings: Sequence[Sequence[float]],
+  metadatas: Sequence[Dict[str, Any]],
+  path: str,
+  dtype: str = "float16",
+  model: str = ""
+) -> None:
+  """
+  把商品向量按行归一化后写成 .npy 矩阵（float32 / float16 / int8），商品信息写入同名 .meta.json。
+  每次导出的矩阵写成带版本号的新文件，由 .meta.json 记录版本和矩阵文件名；替换 .meta.json 是唯一的提交点，
+  worker 任何时候读到的矩阵和商品信息都属于同一次导出。正在映射旧文件的 worker 不受影响，下次检索时发现变化再重新映射
+  """
+  if dtype not in _DTYPES:
+    raise ValueError(f"unsupported dtype {dtype}")
+  matrix = np.asarray(embeddings, dtype=np.float32)
+  norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+  matrix = matrix / np.where(norms == 0, 1.0, norms)
+  if dtype == "int8":
+    matrix = np.clip(np.rint(matrix * _INT8_SCALE), -127, 127)
+  matrix = matrix.astype(_DTYPES[dtype])
+
+  version = str(time.time_ns())
+  matrix_file = _versioned_path(path, version)
+  meta = {
+    "version": version,
+    "matrix": os.path.basename(matrix_file),
+    "dtype": dtype,
+    "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+    "count": len(ids),
+    "model": model,
+    "items": [
+      {"id": item_id, "name": (metadata or {}).get("name", "未知商品"), "points": (metadata or {}).get("points", 0)}
+      for item_id, metadata in zip(ids, metadatas)
+    ]
+  }
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with open(matrix_file + ".tmp", "wb") as f:
+    np.save(f, matrix)
+  os.replace(matrix_file + ".tmp", matrix_file)
+  previous = None
+  try:
+    with open(_meta_path(path), "r", encoding="utf-8") as f:
+      previous = json.load(f).get("matrix")
+  except (OSError, ValueError):
+    pass
+  with open(_meta_path(path) + ".tmp", "w", encoding="utf-8") as f:
+    json.dump(meta, f, ensure_ascii=False)
+  os.replace(_meta_path(path) + ".tmp", _meta_path(path))
+  # 上一个版本可能仍在被刚读到旧 .meta.json 的 worker 加载，保留一份
+  _remove_stale_matrices(path, [meta["matrix"], previous])
+
+class ProductIndex:
+  """
+  只读内存映射的商品向量矩阵，精确 top-k 检索：一次矩阵向量乘法，不经过线程池。
+  多个 worker 映射同一个文件，共享操作系统的页缓存，只占一份内存。
+  返回的 distance 与 Chroma 默认的 l2（平方欧氏距离）一致：单位向量之间为 2 - 2·cos（int8 量化后为近似值，排序基本不变）
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._mtime = None
+    self._matrix: Optional[np.ndarray] = None
+    self._items: List[Dict[str, Any]] = []
+    self._points: Optional[np.ndarray] = None
+    self._scale = 1.0
+    self._load()
+
+  def _load(self) -> None:
+    mtime = os.stat(_meta_path(self.path)).st_mtime_ns
+    with open(_meta_path(self.path), "r", encoding="utf-8") as f:
+      meta = json.load(f)
+    # 旧版本导出的 .meta.json 没有 matrix 字段，矩阵就是 path 本身
+    matrix_file = os.path.join(os.path.dirname(self.path), meta["matrix"]) if meta.get("matrix") else self.path
+    matrix = np.load(matrix_file, mmap_mode="r")
+    if matrix.shape[0] != len(meta["items"]):
+      raise ValueError(f"product index {self.path} rows {matrix.shape[0]} != items {len(meta['items'])}")
+    self._matrix = matrix
+    self._items = meta["items"]
+    # 所需积分单独成列，按积分范围过滤时整列比较
+    self._points = np.asarray([item["points"] for item in meta["items"]], dtype=np.float64)
+    self._scale = _INT8_SCALE if meta["dtype"] == "int8" else 1.0
+    self._mtime = mtime
+    _log.info("商品向量索引已加载: {}，{} 条，{}，版本 {}", matrix_file, len(self._items), meta["dtype"], meta.get("version"))
+
+  def _maybe_reload(self) -> None:
+    # 只看 .meta.json：它最后替换，变化时引用的矩阵文件已经写完
+    try:
+      if os.stat(_meta_path(self.path)).st_mtime_ns == self._mtime:
+        return
+      with self._lock:
+        if os.stat(_meta_path(self.path)).st_mtime_ns != self._mtime:
+          self._load()
+    except Exception as e:
+      # 新文件不完整或不可读时继续使用已映射的旧索引
+      _log.warning("重新加载商品向量索引失败: {}", e)
+
+  def __len__(self) -> int:
+    return len(self._items)
+
+  def search(self, query_vector: Sequence[float], limit: int = 3, min_points: Optional[int] = None,
+             max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    """只在所需积分位于 [min_points, max_points] 内的商品中检索"""
+    self._maybe_reload()
+    matrix, items, points, scale = self._matrix, self._items, self._points, self._scale
+    if matrix is None or not items:
+      return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    # float16 / int8 按块转换成 float32 后用 BLAS 计算，临时内存不超过一个块
+    scores = np.empty(len(items), dtype=np.float32)
+    for begin in range(0, len(items), _BLOCK_ROWS):
+      block = matrix[begin:begin + _BLOCK_ROWS]
+      scores[begin:begin + len(block)] = block.astype(np.float32) @ query
+    scores /= scale
+    candidates = len(items)
+    if min_points is not None or max_points is not None:
+      mask = np.ones(len(items), dtype=bool)
+      if min_points is not None:
+        mask &= points >= min_points
+      if max_points is not None:
+        mask &= points <= max_points
+      scores[~mask] = -np.inf
+      candidates = int(mask.sum())
+    limit = min(limit, candidates)
+    if limit <= 0:
+      return []
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top])]
+    return [
+      {"name": items[i]["name"], "points": items[i]["points"], "distance": float(2.0 - 2.0 * scores[i])}
+      for i in top
+    ]
@@ -1,39 +1,66 @@
 # 2 个空格对齐
 import operator
-import json
-from typing import Annotated, List, TypedDict, Optional, Dict, Any
+import asyncio
+import contextlib
+from typing import Annotated, List, TypedDict, Optional, Dict, Any, Tuple
 from loguru import logger as _log
 
 # 异步组件导入
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage, message_chunk_to_message
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
 from langgraph.prebuilt import ToolNode
 
 import config.config as config
 import config.resource as resource
 from core import model_factory
+from core.model_router import is_simple_turn, reject_reason
+from core.metrics import LLMMetrics
 from core.simple_redis_saver import SimpleRedisSaver
+from core.transcript import TranscriptStore, to_transcript_entries
+from core.answer_cache import AnswerCache
+from core.context_window import ContextWindow, RollingSummary, summary_message, message_tokens
+from core import speculation
+from core import run_budget
+from core.run_budget import RunBudget
+from core.redemption_plan import parse_user_points
 from core.llm_tools import (
+  speculate_icbc_search,
   #get_ecard_voucher_rules, 
   vector_search_icbc_mall, 
   search_jd_promotion, 
+  compare_redemption_options,
+  calculate_redemption_plans,
   get_points_activities, 
   query_icbc_voucher_rules
 )
 
+# 预算不足时追加在消息末尾，要求模型不再调用工具
+_FORCE_ANSWER_PROMPT = "本轮的处理时间已用完，不能再调用任何工具。请只基于上面已经获得的信息直接给出最终回答；信息不完整的部分如实说明，并建议用户稍后再问。"
+# 工具调用超过截止时间时返回给模型的结果
+_TOOL_TIMEOUT = "本轮时间预算不足，该工具未能在截止时间前完成，请不要再调用工具，基于已有信息回答。"
+# 最终回答也没能在截止时间内完成时直接发给用户的兜底回答
+_DEADLINE_ANSWER = "抱歉，本次查询超时了，请稍后再问一次。"
+
 # --- 1. 状态定义 ---
 class AgentState(TypedDict):
   # 这里的 operator.add 用于合并消息历史
   messages: Annotated[List[BaseMessage], operator.add]
+  # 用户最近一次告知的i豆余额，商城检索默认只返回不超过余额的商品
   user_points: Optional[int]
+  # 滚动摘要 {upto, text}：每次对话开始时从 Redis 载入，覆盖 messages 中 upto 之前的内容
+  summary: Optional[Dict[str, Any]]
 
 class RedemptionAgent:
-  def __init__(self,saver: SimpleRedisSaver):
+  def __init__(self,saver: SimpleRedisSaver, transcript: Optional[TranscriptStore] = None, summaries: Optional[RollingSummary] = None,
+               answer_cache: Optional[AnswerCache] = None):
     # 预定义的友好描述映射
     # 2. 定义工具名称到友好描述的映射
     self.tool_descriptions = {
       "vector_search_icbc_mall": "正在工行商城为您搜寻最优惠的商品和E卡...",
       "search_jd_promotion": "正在对比京东同款商品的价格与优惠政策...",
+      "compare_redemption_options": "正在同时检索工行商城、京东同款和E卡比率并精算方案...",
+      "calculate_redemption_plans": "正在精算各兑换方案的i豆消耗...",
       "get_points_activities": "正在为您查询最新的攒豆活动...",
       "query_icbc_voucher_rules": "正在确认立减金的兑换限制与风控要求..."
     }
@@ -46,24 +73,55 @@ class RedemptionAgent:
       content=raw_prompt.replace("{{voucher_rate}}", str(voucher_rate))
     )
     
-    #获取支持异步的 LLM 实例
-    self.llm = model_factory.get_model()
+    #获取支持异步的 LLM 实例：多服务商模型池，按健康度路由并对慢请求发起对冲
+    self.llm = model_factory.get_model_pool()
+    # 级联路由：简单轮次先交给 fast 档模型，没有 fast 档成员时不启用
+    self.fast_llm = model_factory.get_model_pool("fast") if config.get_llm_cascade_enabled() else None
+    self.cascade_max_chars = config.get_llm_cascade_max_chars()
 
     #初始化异步持久化层
     self.checkpointer = saver
+    # 用户可见的对话记录（加载历史用），None 时回退为过滤完整状态
+    self.transcript = transcript
+    # 快照持久化级别：sync 每步写入；batch/exit 在一次对话内合并写入
+    self.checkpoint_durability = config.get_redis_checkpoint_durability()
+    self.checkpoint_flush_every = config.get_redis_checkpoint_flush_every()
+    # 与第一次 LLM 调用并行预取商城检索
+    self.speculative_search = config.get_speculative_search_enabled()
+    # 对话运行预算：超时或模型调用次数达到上限时强制给出最终回答
+    self.max_model_calls = max(1, config.get_chat_max_model_calls())
+
+    # 上下文窗口：按 token 预算裁剪历史，较早的轮次由后台生成的滚动摘要代替
+    self.context_window = ContextWindow(
+      max_tokens=config.get_context_max_tokens(),
+      tool_output_chars=config.get_context_tool_output_chars(),
+      keep_tool_turns=config.get_context_keep_tool_turns()
+    )
+    self._system_tokens = message_tokens(self.base_system_message)
+    self.summaries = summaries
+    self._summary_tasks: Dict[str, asyncio.Task] = {}
+    # 首轮问题的语义答案缓存，None 时不启用
+    self.answer_cache = answer_cache
+    self._cache_tasks: set = set()
     
     #注册工具
     self.tools = [
       #get_ecard_voucher_rules,
       vector_search_icbc_mall,
       search_jd_promotion,
+      compare_redemption_options,
+      calculate_redemption_plans,
       get_points_activities,
       query_icbc_voucher_rules
     ]
 
     #绑定工具并构建异步工作流
     self.model_with_tools = self.llm.bind_tools(self.tools)
-    self.tool_node = ToolNode(self.tools)
+    # 预算不足时的最终回答：保留相同的工具定义（前缀不变，可命中缓存），但禁止调用
+    self.final_model = self.llm.bind_tools(self.tools, tool_choice="none")
+    # 快速模型同样绑定工具：它发起工具调用即说明需要升级
+    self.fast_model_with_tools = self.fast_llm.bind_tools(self.tools) if self.fast_llm else None
+    self.tool_node = ToolNode(self.tools, awrap_tool_call=self._call_tool_within_budget)
     self.app = self._build_workflow().compile(
       checkpointer=self.checkpointer
     )
@@ -85,11 +143,125 @@ class RedemptionAgent:
   async def _call_model(self, state: AgentState):
     """异步大脑节点"""
     _log.debug("--- 正在调用 LLM ---") # 添加这一行    
-    messages = [self.base_system_message] + state["messages"]
-    
-    # 异步调用模型
-    response = await self.model_with_tools.ainvoke(messages)
-    return {"messages": [response]}
+    messages = self._build_prompt(state)
+    writer = get_stream_writer()
+
+    # 预算不足时不再给模型工具，基于已有信息直接回答，保证本轮在截止时间前结束
+    budget = run_budget.current()
+    if budget is not None and budget.next_model_call():
+      return await self._call_final_model(messages, writer, budget)
+
+    # 每次调用最多等到截止时间前 answer_reserve，超时后用剩下的时间给出最终回答
+    try:
+      if self.fast_model_with_tools is not None and is_simple_turn(state["messages"]):
+        answer = await asyncio.wait_for(self._call_fast_model(messages), run_budget.call_timeout())
+        if answer is not None:
+          writer({"token": answer.content})
+          return {"messages": [answer]}
+
+      response = await asyncio.wait_for(self._stream_model(self.model_with_tools, messages, writer), run_budget.call_timeout())
+    except asyncio.TimeoutError:
+      if budget is None:
+        raise
+      _log.warning("模型调用超过截止时间，强制最终回答")
+      budget.degrade("deadline")
+      writer({"discard_answer": True})
+      return await self._call_final_model(messages, writer, budget)
+    return {"messages": [message_chunk_to_message(response)]}
+
+  async def _call_final_model(self, messages: List[BaseMessage], writer: Any, budget: RunBudget):
+    """不带工具基于已有信息直接回答；已经没有剩余时间或仍然超时时发送兜底回答"""
+    if budget.answer_timeout() <= 0:
+      _log.warning("已超过截止时间，直接发送兜底回答")
+      writer({"discard_answer": True})
+      writer({"token": _DEADLINE_ANSWER})
+      return {"messages": [AIMessage(content=_DEADLINE_ANSWER)]}
+    try:
+      response = await asyncio.wait_for(
+        self._stream_model(self.final_model, messages + [SystemMessage(content=_FORCE_ANSWER_PROMPT)], writer),
+        budget.answer_timeout()
+      )
+    except asyncio.TimeoutError:
+      _log.warning("最终回答超过截止时间，发送兜底回答")
+      writer({"discard_answer": True})
+      writer({"token": _DEADLINE_ANSWER})
+      return {"messages": [AIMessage(content=_DEADLINE_ANSWER)]}
+    return {"messages": [message_chunk_to_message(response)]}
+
+  async def _call_tool_within_budget(self, request: Any, execute: Any) -> Any:
+    """工具调用最多等到截止时间前 answer_reserve；超时时返回说明，下一次模型调用会强制最终回答"""
+    try:
+      return await asyncio.wait_for(execute(request), run_budget.call_timeout())
+    except asyncio.TimeoutError:
+      budget = run_budget.current()
+      if budget is None:
+        raise
+      _log.warning("工具 {} 超过截止时间", request.tool_call["name"])
+      budget.degrade("deadline")
+      return ToolMessage(content=_TOOL_TIMEOUT, name=request.tool_call["name"], tool_call_id=request.tool_call["id"])
+
+  async def _stream_model(self, model: Any, messages: List[BaseMessage], writer: Any) -> Any:
+    """
+    流式调用模型：正文 token 和工具调用开始事件通过 custom 流实时转发给 stream_chat。
+    模型可能先输出一段过渡说明再调用工具，出现工具调用时通知 stream_chat 丢弃已转发的正文
+    """
+    response = None
+    async for chunk in model.astream(messages):
+      had_tool_calls = response is not None and bool(response.tool_call_chunks)
+      response = chunk if response is None else response + chunk
+      # 一旦出现工具调用，本次输出就不是最终回答：已转发的正文作废，后续正文不再转发
+      if response.tool_call_chunks and not had_tool_calls:
+        writer({"discard_answer": True})
+      for tool_chunk in chunk.tool_call_chunks or []:
+        # 工具名只出现在每个工具调用的第一个分片里
+        if tool_chunk.get("name"):
+          writer({"tool_start": tool_chunk["name"]})
+      if chunk.content and not response.tool_call_chunks:
+        writer({"token": chunk.content})
+    if response is None:
+      # 模型池会在空响应时切换服务商，单个模型的空响应按调用失败处理
+      raise RuntimeError("模型没有返回任何内容")
+    return response
+
+  async def _call_fast_model(self, messages: List[BaseMessage]) -> Optional[BaseMessage]:
+    """
+    用 fast 档模型回答简单轮次。输出先缓冲、通过检查后再一次性转发；
+    需要工具、回答未通过检查或调用失败时返回 None，由强模型重新回答
+    """
+    response = None
+    try:
+      async for chunk in self.fast_model_with_tools.astream(messages):
+        response = chunk if response is None else response + chunk
+        # 一出现工具调用就放弃，不等快速模型生成完参数
+        if response.tool_call_chunks:
+          break
+    except Exception as e:
+      _log.warning("快速模型调用失败，升级到强模型: {}", e)
+      LLMMetrics().inc("llm_cascade_total", route="escalated", reason="error")
+      return None
+    reason = reject_reason(response, self.cascade_max_chars) if response is not None else "empty"
+    if reason is not None:
+      _log.debug("快速模型回答未采用（{}），升级到强模型", reason)
+      LLMMetrics().inc("llm_cascade_total", route="escalated", reason=reason)
+      return None
+    LLMMetrics().inc("llm_cascade_total", route="fast")
+    return message_chunk_to_message(response)
+
+  def _build_prompt(self, state: AgentState) -> List[BaseMessage]:
+    """
+    组装发给模型的消息，保证前缀字节稳定以命中服务商的前缀缓存：
+    固定的系统提示词（工具定义在初始化时绑定一次，顺序固定）→ 滚动摘要 → 历史。
+    摘要只在后台更新时变化；历史窗口起点尽量保持不动，每轮只有末尾几轮的内容发生变化。
+    """
+    summary = state.get("summary")
+    summary_msg = summary_message(summary)
+    prefix = [self.base_system_message] + ([summary_msg] if summary_msg else [])
+    _, history = self.context_window.select_stable(
+      state["messages"],
+      upto=summary["upto"] if summary_msg else 0,
+      reserved_tokens=sum(message_tokens(m) for m in prefix)
+    )
+    return prefix + history
 
   def _router(self, state: AgentState):
     """路由逻辑"""
@@ -98,149 +270,178 @@ class RedemptionAgent:
       return "tools"
     return END
 
-  async def get_history(self, user_id: str) -> List[Dict]:
+  async def get_history(self, user_id: str, cursor: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict], Optional[int]]:
     """
-    异步获取历史记录：严格过滤掉所有工具交互及中间 JSON 报文
+    异步获取历史记录：优先读取已过滤好的对话记录（一次范围读取），返回 (history, next_cursor)。
+    对话记录不存在时（例如该功能上线前的会话）从 LangGraph 状态回填。
     """
+    if not self.transcript:
+      # 未配置对话记录存储时直接过滤完整状态
+      history = await self._load_state_history(user_id)
+      await self.checkpointer.arefresh_ttl(user_id)
+      return history[-limit:], None
+
+    # 用户仍在活跃，读取的同时滑动续期会话数据
+    page, _ = await asyncio.gather(
+      self.transcript.page(user_id, cursor, limit),
+      self.checkpointer.arefresh_ttl(user_id)
+    )
+    if page is None and cursor is None:
+      await self._backfill_transcript(user_id)
+      page = await self.transcript.page(user_id, None, limit)
+    return page or ([], None)
+
+  async def _load_state_history(self, user_id: str) -> List[Dict]:
     config_dict = {"configurable": {"thread_id": user_id}}
     state = await self.app.aget_state(config_dict)
-    
-    history = []
     if state and "messages" in state.values:
-      msgs = state.values["messages"]
-      
-      for msg in msgs:
-        # 兼容处理字典或对象
-        content = getattr(msg, 'content', '') or (msg.get('content', '') if isinstance(msg, dict) else '')
-        msg_type = getattr(msg, 'type', '') or (msg.get('type', '') if isinstance(msg, dict) else '')
-        tool_calls = getattr(msg, 'tool_calls', None) or (msg.get('tool_calls') if isinstance(msg, dict) else None)
-
-        # --- 核心过滤逻辑 ---
-        
-        # 1. 必须有内容
-        if not content or not str(content).strip():
-          continue
-          
-        # 2. 排除工具执行结果 (ToolMessage)
-        if msg_type == "tool":
-          continue
-          
-        # 3. 排除 AI 的工具调用指令 (带 tool_calls 的 AIMessage)
-        if tool_calls:
-          continue
-
-        # 4. 排除 AI 直接复读的原始 JSON 数据 (防止那种 AI: [{"name":...}] 的情况)
-        # 判定标准：内容是以 [ 开头并以 ] 结尾，且尝试解析 JSON 成功
-        stripped_content = str(content).strip()
-        if stripped_content.startswith("[") and stripped_content.endswith("]"):
-          try:
-            json.loads(stripped_content)
-            continue # 如果是纯 JSON 数组，跳过，不给用户看
-          except:
-            pass # 解析失败说明是普通文本，保留
-
-        # 5. 确定角色
-        if msg_type == "human":
-          history.append({"role": "user", "content": content})
-        elif msg_type == "ai":
-          history.append({"role": "assistant", "content": content})
-          
-    return history
-
-  async def stream_chat(self, user_input: str, user_id: str, seq: str, websocket: Any, with_trace: bool = False):
+      return to_transcript_entries(state.values["messages"])
+    return []
+
+  async def _backfill_transcript(self, user_id: str) -> None:
+    """用 LangGraph 状态生成对话记录；只在记录不存在时写入，避免与并发的追加重复"""
+    if not self.transcript:
+      return
+    history = await self._load_state_history(user_id)
+    if history:
+      await self.transcript.append(user_id, history, mode="new")
+
+  async def _record_transcript(self, user_id: str, entries: List[Dict]) -> None:
+    """本轮对话结束时追加对话记录；记录不存在时整体回填（状态中已包含本轮消息）"""
+    if not self.transcript:
+      return
+    try:
+      if await self.transcript.append(user_id, entries, mode="exists") < 0:
+        await self._backfill_transcript(user_id)
+    except Exception as e:
+      # 对话记录只影响历史展示，失败不影响本次回答
+      _log.warning("用户 {} 对话记录写入失败: {}", user_id, e)
+
+  def _checkpoint_writes(self):
+    """一次对话运行内的快照写入范围：按配置的持久化级别合并写入"""
+    if self.checkpoint_durability == "batch":
+      return self.checkpointer.coalesce(flush_every=self.checkpoint_flush_every)
+    if self.checkpoint_durability == "exit":
+      return self.checkpointer.coalesce()
+    return contextlib.nullcontext()
+
+  @contextlib.asynccontextmanager
+  async def _run_scope(self, user_input: str, budget: RunBudget):
+    """一次对话运行的范围：运行预算 + 商城检索预取 + 快照合并写入"""
+    with run_budget.scope(budget), speculation.scope():
+      if self.speculative_search:
+        speculate_icbc_search(user_input)
+      async with self._checkpoint_writes():
+        yield
+
+  async def stream_chat(self, user_input: str, user_id: str, seq: str, websocket: Any, with_trace: bool = False, deadline_ms: Optional[int] = None):
     """
-    异步流式对话接口：保持 type 为 chat，通过 isTrace 区分内容
+    异步流式对话接口：保持 type 为 chat，通过 isTrace 区分内容。
+    deadline_ms 为本次对话的时间预算，None 时使用服务端默认值
     """
     _log.debug("stream_chat 开始执行, seq: {}", seq)
     
     config_dict = {"configurable": {"thread_id": user_id}}
+    budget = RunBudget(
+      deadline_seconds=(deadline_ms or config.get_chat_deadline_ms()) / 1000,
+      max_model_calls=self.max_model_calls,
+      answer_reserve=config.get_chat_answer_reserve_ms() / 1000,
+      optional_tool_min=config.get_chat_optional_tool_min_ms() / 1000
+    )
     inputs = {"messages": [HumanMessage(content=user_input)]}
+    # 本轮没有提到余额时沿用会话状态中的值
+    user_points = parse_user_points(user_input)
+    if user_points is not None:
+      inputs["user_points"] = user_points
+    if self.summaries:
+      inputs["summary"] = await self._load_summary(user_id, budget.call_timeout())
     has_sent_answer = False
+    answers = []
 
     try:
-      async for event in self.app.astream(
-        inputs, 
-        config=config_dict, 
-        stream_mode="updates"
-      ):
-        for node_name, output in event.items():
-          # 1. 处理 Trace (中间过程)
-          if with_trace:
-            trace_msg = None
-            if node_name == "tools":
-              msgs = output.get("messages", [])
-              if msgs and isinstance(msgs[-1], ToolMessage):
-                tool_msg = msgs[-1]
+      # 0. 没有历史的首轮问题先查答案缓存，命中时直接回放
+      # 缓存和摘要都是可选的，超过预算时当作未命中，不占用回答的时间
+      first_turn = self.answer_cache is not None and await self._is_first_turn(config_dict, budget.call_timeout())
+      vector = None
+      if first_turn:
+        cached, vector = await self._lookup_answer(user_input, budget.call_timeout())
+        if cached is not None:
+          await self._replay_answer(user_input, user_id, seq, websocket, cached, user_points)
+          return
+
+      # 合并写入的快照在退出该范围时落盘，必须早于发送 end，避免用户紧接着的下一轮读到旧快照
+      async with self._run_scope(user_input, budget):
+        async for mode, event in self.app.astream(
+          inputs, 
+          # 每次模型调用最多跟一次工具节点，预算会在达到上限前强制结束，这里只是兜底
+          config={**config_dict, "recursion_limit": 2 * self.max_model_calls + 2}, 
+          stream_mode=["updates", "custom"]
+        ):
+          if mode == "custom":
+            # 1. 工具开始调用时立即发送 Trace (中间过程)
+            if "tool_start" in event:
+              if with_trace:
                 # 获取友好描述，如果没定义则回退到函数名
                 friendly_desc = self.tool_descriptions.get(
-                  tool_msg.name, 
-                  f"正在执行 {tool_msg.name}..."
+                  event["tool_start"], 
+                  f"正在执行 {event['tool_start']}..."
                 )
-                
-                trace_msg = {
+                await websocket.send_json({
                   "seq": seq,
                   "type": "chat",
                   "userCode": user_id,
                   "status": "success",
                   "isTrace": True,
-                  "answer": friendly_desc,
-                  # don't send the full tool output to frontend, just indicate which tool is being executed
-                  #"data": {"tool": tool_msg.name, "output": str(tool_msg.content)[:100]}
-                }
-            elif node_name == "agent":
-              # 只有当接下来还要调工具时，才发送“思考中”的 trace
-              last_msg = output.get("messages", [])[-1]
-              if getattr(last_msg, 'tool_calls', None):
-                trace_msg = {
+                  "answer": friendly_desc
+                })
+            # 2. 工具调用前的过渡说明或超时中断的回答不是最终回答，通知前端丢弃已拼接的 answer
+            elif "discard_answer" in event:
+              if has_sent_answer:
+                has_sent_answer = False
+                await websocket.send_json({
                   "seq": seq,
                   "type": "chat",
                   "userCode": user_id,
                   "status": "success",
-                  "isTrace": True,
-                  "answer": "AI 正在分析需求并准备调用工具..."
-                }
-
-            if trace_msg:
-              await websocket.send_json(trace_msg)
+                  "isTrace": False,
+                  "answer": "",
+                  "discardAnswer": True
+                })
+            # 3. 最终回答按 token 增量发送，前端按顺序拼接 answer
+            elif "token" in event:
+              has_sent_answer = True
+              await websocket.send_json({
+                "seq": seq,
+                "type": "chat",
+                "userCode": user_id,
+                "status": "success",
+                "isTrace": False,
+                "answer": event["token"]
+              })
+            continue
 
-          # 2. 处理正式 Answer (最终回答)
-          if node_name == "agent":
+          # 节点完成：收集最终回答用于对话记录（内容已经流式发送过）
+          output = event.get("agent")
+          if output:
             messages = output.get("messages", [])
             if messages:
               last_msg = messages[-1]
               # 仅当没有 tool_calls 时，才认为这是发给用户的最终文本
               if last_msg.content and not getattr(last_msg, 'tool_calls', None):
-                has_sent_answer = True
-                await websocket.send_json({
-                  "seq": seq,
-                  "type": "chat",
-                  "userCode": user_id,
-                  "status": "success",
-                  "isTrace": False,
-                  "answer": last_msg.content
-                })
+                answers.append(last_msg)
 
-      # 3. 发送结束标志
-      await websocket.send_json({
-        "seq": seq,
-        "type": "chat",
-        "userCode": user_id,
-        "status": "end",
-        "isTrace": False,
-        "answer": "" if has_sent_answer else "未搜索到相关结果。",
-        "products": [
-          {
-            "appid": "wx6e370ef37e04de68",
-            "productId": "10000269008161",
-            "productPromotionLink": "v1=HP0MkpO6bIljStk8xA118vN69R7OC0n632MSQOzq1a3V7IE5BfHlFVIhDDpcjgJ6jQrcow"
-          },
-          {
-            "appid": "wx1a86fc3d682a6563",
-            "productId": "10000265845466",
-            "productPromotionLink": "v1=HLu-HUXAaB7seNcFyw6TlTXzgkdYkTGTEBnDez-CENOWUY017-Q-O2S0l9IFkdyP9pL8Sw"
-          }
-        ]
-      })
+      # 4. 记录用户可见的对话（与加载历史使用同一套过滤规则）
+      await self._record_transcript(user_id, to_transcript_entries(inputs["messages"] + answers))
+
+      # 5. 发送结束标志
+      await self._send_end(user_id, seq, websocket, "" if has_sent_answer else "未搜索到相关结果。", budget.degraded)
+      for reason in budget.degraded:
+        LLMMetrics().inc("chat_degraded_total", reason=reason.split(":")[0])
+
+      # 6. 对话结束后在后台更新滚动摘要、写入答案缓存，不占用请求路径
+      self._schedule_summary(user_id)
+      if first_turn and answers and not budget.degraded:
+        self._schedule_cache_store(user_input, "".join(str(m.content) for m in answers), vector)
 
     except Exception as e:
       _log.error("流式对话异常: {}", e)
@@ -254,6 +455,122 @@ class RedemptionAgent:
         "errorMsg": str(e)
       })
 
+  async def _send_end(self, user_id: str, seq: str, websocket: Any, answer: str, degraded: Optional[List[str]] = None) -> None:
+    await websocket.send_json({
+      "seq": seq,
+      "type": "chat",
+      "userCode": user_id,
+      "status": "end",
+      "isTrace": False,
+      "answer": answer,
+      # 因时间或轮次预算不足而降级的原因，为空表示完整执行
+      "degraded": degraded or [],
+      "products": [
+        {
+          "appid": "wx6e370ef37e04de68",
+          "productId": "10000269008161",
+          "productPromotionLink": "v1=HP0MkpO6bIljStk8xA118vN69R7OC0n632MSQOzq1a3V7IE5BfHlFVIhDDpcjgJ6jQrcow"
+        },
+        {
+          "appid": "wx1a86fc3d682a6563",
+          "productId": "10000265845466",
+          "productPromotionLink": "v1=HLu-HUXAaB7seNcFyw6TlTXzgkdYkTGTEBnDez-CENOWUY017-Q-O2S0l9IFkdyP9pL8Sw"
+        }
+      ]
+    })
+
+  async def _is_first_turn(self, config_dict: Dict[str, Any], timeout: Optional[float] = None) -> bool:
+    """没有任何快照即没有历史上下文，答案只取决于问题本身"""
+    try:
+      return await asyncio.wait_for(self.checkpointer.aget_tuple(config_dict), timeout) is None
+    except Exception as e:
+      _log.warning("读取快照失败，不使用答案缓存: {}", e)
+      return False
+
+  async def _lookup_answer(self, user_input: str, timeout: Optional[float] = None) -> Tuple[Optional[str], Optional[List[float]]]:
+    try:
+      return await asyncio.wait_for(self.answer_cache.lookup(user_input), timeout)
+    except Exception as e:
+      # 缓存不可用时走正常流程
+      _log.warning("答案缓存查询失败: {}", e)
+      return None, None
+
+  async def _replay_answer(self, user_input: str, user_id: str, seq: str, websocket: Any, answer: str,
+                           user_points: Optional[int] = None) -> None:
+    """按正常的流式协议回放缓存的答案，并把这一轮写入会话状态，后续追问可以接着聊"""
+    LLMMetrics().inc("answer_cache_hits_total")
+    await websocket.send_json({
+      "seq": seq,
+      "type": "chat",
+      "userCode": user_id,
+      "status": "success",
+      "isTrace": False,
+      "answer": answer
+    })
+    messages = [HumanMessage(content=user_input), AIMessage(content=answer)]
+    update = {"messages": messages}
+    if user_points is not None:
+      update["user_points"] = user_points
+    await self.app.aupdate_state({"configurable": {"thread_id": user_id}}, update, as_node="agent")
+    await self._record_transcript(user_id, to_transcript_entries(messages))
+    await self._send_end(user_id, seq, websocket, "")
+
+  def _schedule_cache_store(self, user_input: str, answer: str, vector: Optional[List[float]]) -> None:
+    async def store():
+      try:
+        await self.answer_cache.store(user_input, answer, vector)
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        _log.warning("答案缓存写入失败: {}", e)
+    task = asyncio.create_task(store())
+    self._cache_tasks.add(task)
+    task.add_done_callback(self._cache_tasks.discard)
+
+  async def _load_summary(self, user_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    try:
+      return await asyncio.wait_for(self.summaries.aload(user_id), timeout)
+    except Exception as e:
+      # 摘要不可用时只是少了较早的上下文
+      _log.warning("用户 {} 摘要读取失败: {}", user_id, e)
+      return None
+
+  def _schedule_summary(self, user_id: str) -> None:
+    if not self.summaries or user_id in self._summary_tasks:
+      return
+    task = asyncio.create_task(self._refresh_summary(user_id))
+    self._summary_tasks[user_id] = task
+    task.add_done_callback(lambda _: self._summary_tasks.pop(user_id, None))
+
+  async def _refresh_summary(self, user_id: str) -> None:
+    """
+    有轮次移出上下文窗口但尚未被摘要覆盖时，把它们并入摘要。
+    一次摘要到历史预算一半的位置，留出余量，避免之后每轮对话都触发摘要。
+    """
+    try:
+      state = await self.app.aget_state({"configurable": {"thread_id": user_id}})
+      messages = state.values.get("messages", []) if state else []
+      summary = await self.summaries.aload(user_id) or {}
+      upto = summary.get("upto", 0) if summary.get("text") else 0
+      if upto > len(messages):
+        upto, summary = 0, {}
+      reserved = self._system_tokens + self.summaries.max_chars
+      start, _ = self.context_window.select(messages, upto, reserved)
+      if start <= upto:
+        return
+      target, _ = self.context_window.select(messages, upto, reserved, budget=self.context_window.half_budget(reserved))
+      text = await self.summaries.asummarize(self.llm, summary.get("text", ""), messages[upto:target])
+      await self.summaries.asave(user_id, target, text)
+      _log.info("用户 {} 摘要已更新，覆盖前 {} 条消息", user_id, target)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      _log.warning("用户 {} 摘要生成失败: {}", user_id, e)
+
   async def close_resource(self):
     """清理资源，在 lifespan 的 yield 之后调用"""
-    pass
\ No newline at end of file
+    tasks = list(self._summary_tasks.values()) + list(self._cache_tasks)
+    for task in tasks:
+      task.cancel()
+    if tasks:
+      await asyncio.gather(*tasks, return_exceptions=True)
\ No newline at end of file
@@ -0,0 +1,119 @@
+# 2 个空格对齐
+import re
+import math
+from typing import Any, Dict, List, Optional
+
+# 立减金风控：超过该金额的部分需人工补发，非实时到账
+VOUCHER_REALTIME_LIMIT = 5000
+# 立减金每月限额（元）
+VOUCHER_MONTHLY_LIMIT = 10000
+
+# 用户告知i豆余额的说法：“我有5万i豆”“还剩 12000 豆”“i豆余额：3.5万”“积分有8000”
+_BALANCE_PATTERNS = [
+  re.compile(r"(?:(?<![没沒])有|剩下?|余额)(?:i豆|积分)?[\s:：]*(\d+(?:\.\d+)?)\s*(万|w)?\s*个?\s*(?:i豆|积分|豆)", re.IGNORECASE),
+  re.compile(r"(?:i豆|积分)(?:余额)?\s*(?:还有|有|是|为|剩下?|共|[:：])\s*(\d+(?:\.\d+)?)\s*(万|w)?", re.IGNORECASE)
+]
+
+def parse_user_points(text: str) -> Optional[int]:
+  """从用户输入中解析i豆余额，有多处时以最后一处为准（用户修正后的数值）；没有时返回 None"""
+  matches = [m for pattern in _BALANCE_PATTERNS for m in pattern.finditer(text or "")]
+  if not matches:
+    return None
+  last = max(matches, key=lambda m: m.start(1))
+  points = float(last.group(1)) * (10000 if last.group(2) else 1)
+  return int(round(points))
+
+def _cash_plan(plan: str, name: str, jd_price: float, rate: float, user_points: Optional[int], cap_yuan: Optional[int] = None) -> Dict[str, Any]:
+  """
+  i豆换成 E卡/立减金后去京东购买：卡券面额最小单位为 1 元，面额向下取整到元，差价用现金补齐。
+  user_points 不足时按能兑换的最大面额计算；cap_yuan 为面额上限（立减金月度限额），超出部分同样以现金补齐
+  """
+  whole_yuan = math.floor(jd_price)
+  card_yuan = whole_yuan if cap_yuan is None else min(whole_yuan, cap_yuan)
+  affordable = user_points is None or user_points >= math.ceil(card_yuan * rate)
+  if not affordable:
+    card_yuan = math.floor(user_points / rate)
+  points = math.ceil(card_yuan * rate)
+  return {
+    "plan": plan,
+    "name": name,
+    "feasible": True,
+    "rate": rate,
+    "card_yuan": card_yuan,
+    "points": points,
+    "cash": round(jd_price - card_yuan, 2),
+    # 售价整元部分全部用卡券覆盖所需的i豆（不考虑余额和面额上限），用于比较各方案
+    "full_points": math.ceil(whole_yuan * rate),
+    "affordable": affordable
+  }
+
+def _infeasible(plan: str, name: str, reason: str) -> Dict[str, Any]:
+  return {"plan": plan, "name": name, "feasible": False, "reason": reason}
+
+def compute_plans(
+  icbc_points: Optional[int],
+  jd_price: Optional[float],
+  support_ecard: bool,
+  ecard_rate: Optional[float],
+  voucher_rate: float,
+  user_points: Optional[int] = None
+) -> Dict[str, Any]:
+  """
+  计算三种兑换路径的i豆消耗：
+  - A 工行直兑：消耗 icbc_points
+  - B 京东E卡：E卡面额 × ecard_rate（豆/元），仅京东自营且支持E卡的商品可用
+  - C 立减金：立减金面额 × voucher_rate（豆/元），所有京东商品可用，受 5000/10000 元风控限制
+  最优方案按全额兑换所需的i豆比较（B、C 取售价的整元部分，不受余额和立减金月度限额影响）
+  """
+  plans: List[Dict[str, Any]] = []
+  warnings: List[str] = []
+
+  if icbc_points is not None and icbc_points > 0:
+    plans.append({
+      "plan": "A",
+      "name": "工行商城直兑",
+      "feasible": True,
+      "points": int(icbc_points),
+      "cash": 0,
+      "full_points": int(icbc_points),
+      "affordable": user_points is None or user_points >= icbc_points
+    })
+  else:
+    plans.append(_infeasible("A", "工行商城直兑", "工行商城没有该商品"))
+
+  if jd_price is None or jd_price <= 0:
+    plans.append(_infeasible("B", "京东E卡", "京东没有同款商品"))
+    plans.append(_infeasible("C", "微信立减金", "京东没有同款商品"))
+  else:
+    if not support_ecard:
+      plans.append(_infeasible("B", "京东E卡", "该商品不支持京东E卡（非京东自营）"))
+    elif not ecard_rate or ecard_rate <= 0:
+      plans.append(_infeasible("B", "京东E卡", "缺少E卡实时兑换比率，需先检索工行商城的京东E卡"))
+    else:
+      plans.append(_cash_plan("B", "京东E卡", jd_price, ecard_rate, user_points))
+
+    plans.append(_cash_plan("C", "微信立减金", jd_price, voucher_rate, user_points, cap_yuan=VOUCHER_MONTHLY_LIMIT))
+    if jd_price > VOUCHER_REALTIME_LIMIT:
+      warnings.append(f"立减金超过 {VOUCHER_REALTIME_LIMIT} 元部分需人工补发，非实时到账")
+    if jd_price > VOUCHER_MONTHLY_LIMIT:
+      warnings.append(f"立减金每月限额 {VOUCHER_MONTHLY_LIMIT // 10000} 万元，本月无法通过立减金全额覆盖")
+
+  feasible = [p for p in plans if p["feasible"]]
+  best = None
+  saving = 0
+  if feasible:
+    ranked = sorted(feasible, key=lambda p: p["full_points"])
+    best = ranked[0]["plan"]
+    if len(ranked) > 1:
+      saving = ranked[1]["full_points"] - ranked[0]["full_points"]
+
+  if user_points is not None and feasible and not any(p["affordable"] for p in feasible):
+    warnings.append("i豆不足以全额兑换，卡券方案按可兑换的最大面额计算，差价需现金补齐")
+
+  return {
+    "plans": plans,
+    "best_plan": best,
+    "saving_points": saving,
+    "user_points": user_points,
+    "warnings": warnings
+  }
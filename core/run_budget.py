@@ -0,0 +1,82 @@
+# 2 个空格对齐
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+from loguru import logger as _log
+
+class RunBudget:
+  """
+  一次对话运行的时间和轮次预算：
+  - deadline：剩余时间少于 answer_reserve 时强制模型不带工具直接给出最终回答；
+    answer_reserve 不超过总时间的一半，时间预算很短时前面的调用也有时间可用
+  - max_model_calls：模型调用达到上限时同样强制最终回答
+  - 剩余时间少于 optional_tool_min 时跳过可选工具（如京东比价）
+  - 每次模型、工具调用最多等待到截止时间前 answer_reserve，超时后同样强制最终回答
+  降级原因记录在 degraded 中，由 stream_chat 放进 end 消息
+  """
+  def __init__(self, deadline_seconds: float, max_model_calls: int, answer_reserve: float, optional_tool_min: float):
+    self.started = time.monotonic()
+    self.deadline = self.started + deadline_seconds
+    self.max_model_calls = max_model_calls
+    self.answer_reserve = min(answer_reserve, deadline_seconds / 2)
+    self.optional_tool_min = optional_tool_min
+    self.model_calls = 0
+    self.degraded: List[str] = []
+
+  def remaining(self) -> float:
+    return self.deadline - time.monotonic()
+
+  def call_timeout(self) -> float:
+    """模型或工具调用最多可以等待的秒数，留出 answer_reserve 给最终回答"""
+    return max(self.remaining() - self.answer_reserve, 0.0)
+
+  def answer_timeout(self) -> float:
+    """最终回答最多可以等待的秒数：不超过截止时间"""
+    return max(self.remaining(), 0.0)
+
+  def degrade(self, reason: str) -> None:
+    if reason not in self.degraded:
+      self.degraded.append(reason)
+      _log.info("对话预算不足，降级: {}（剩余 {:.1f} 秒，已调用模型 {} 次）", reason, self.remaining(), self.model_calls)
+
+  def next_model_call(self) -> bool:
+    """登记一次模型调用，返回本次是否必须不带工具直接回答"""
+    self.model_calls += 1
+    if self.model_calls >= self.max_model_calls:
+      self.degrade("max_model_calls")
+      return True
+    if self.remaining() < self.answer_reserve:
+      self.degrade("deadline")
+      return True
+    return False
+
+  def allow_optional(self, name: str) -> bool:
+    if self.remaining() >= self.optional_tool_min:
+      return True
+    self.degrade(f"skipped:{name}")
+    return False
+
+# 当前对话运行的预算。对话运行内创建的子任务（模型节点、工具节点）继承该上下文
+_budget: ContextVar[Optional[RunBudget]] = ContextVar("run_budget", default=None)
+
+@contextmanager
+def scope(budget: RunBudget) -> Iterator[RunBudget]:
+  token = _budget.set(budget)
+  try:
+    yield budget
+  finally:
+    _budget.reset(token)
+
+def current() -> Optional[RunBudget]:
+  return _budget.get()
+
+def call_timeout() -> Optional[float]:
+  """当前调用的超时时间；不在预算范围内时不限时"""
+  budget = _budget.get()
+  return None if budget is None else budget.call_timeout()
+
+def allow_optional(name: str) -> bool:
+  """可选工具调用前检查；不在预算范围内时总是允许"""
+  budget = _budget.get()
+  return budget is None or budget.allow_optional(name)
@@ -1,26 +1,126 @@
 # 2 个空格对齐
 import ormsgpack
 import json
+import random
 import asyncio
-from typing import Any, Optional, Iterator, AsyncIterator, Sequence
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Optional, Union, Iterator, AsyncIterator, Sequence, Dict, List, Tuple
 from redis.asyncio import Redis # 核心：使用异步 Redis
+from redis.asyncio.cluster import RedisCluster
+from redis.exceptions import NoScriptError, ResponseError
+from datetime import datetime
 from langgraph.checkpoint.base import (
   BaseCheckpointSaver,
   SerializerProtocol,
-  CheckpointTuple
+  CheckpointTuple,
+  WRITES_IDX_MAP,
+  copy_checkpoint
 )
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
 from loguru import logger as _log
 
+from cache.redis_cache import SlidingTTL, RedisShardRouter, client_for
+from core.blob_compressor import BlobCompressor
+
+# --- 序列化格式 ---
+# 新格式 blob = 0xc1 + 版本号 + msgpack。0xc1 在 msgpack 中是保留字节，
+# 旧格式（msgpack / JSON）永远不会以它开头，因此新旧 blob 可以共存。
+_CODEC_MAGIC = b"\xc1"
+_CODEC_VERSION = 1
+_CODEC_HEADER = _CODEC_MAGIC + bytes([_CODEC_VERSION])
+_PACK_OPTION = ormsgpack.OPT_NON_STR_KEYS
+
+# LangChain 消息对应的 msgpack 扩展类型；tool_calls 作为 AIMessage 的字段一并编码
+_EXT_HUMAN = 1
+_EXT_AI = 2
+_EXT_TOOL = 3
+_EXT_SYSTEM = 4
+
+_MESSAGE_EXT = {
+  HumanMessage: _EXT_HUMAN,
+  AIMessage: _EXT_AI,
+  ToolMessage: _EXT_TOOL,
+  SystemMessage: _EXT_SYSTEM
+}
+_EXT_MESSAGE = {code: cls for cls, code in _MESSAGE_EXT.items()}
+
+# 各消息类型需要保留的字段（content 之外，空值不写入）
+_BASE_FIELDS = ("additional_kwargs", "response_metadata", "id", "name")
+_MESSAGE_FIELDS = {
+  _EXT_HUMAN: _BASE_FIELDS,
+  _EXT_AI: _BASE_FIELDS + ("tool_calls", "invalid_tool_calls", "usage_metadata"),
+  _EXT_TOOL: _BASE_FIELDS + ("tool_call_id", "status", "artifact"),
+  _EXT_SYSTEM: _BASE_FIELDS
+}
+
+# 旧格式中 model_dump 出来的消息字典，按 type 还原成消息对象
+_LEGACY_MESSAGE_TYPES = {
+  "human": HumanMessage,
+  "ai": AIMessage,
+  "tool": ToolMessage,
+  "system": SystemMessage
+}
+
 # --- 兼容性序列化器 (保持同步，因为内存处理不涉及 IO) ---
 class CrossCompatibleSerializer(SerializerProtocol):
+  """
+  带类型的 msgpack 编解码：LangChain 消息以扩展类型编码，解码后仍是原始的消息类型。
+  旧版本写入的 blob（预先转成 dict 的 msgpack 或 JSON）仍可读取，其中的消息字典会被还原成消息对象。
+  可选的 compressor 对编码结果再做一层压缩，读取时按格式头自动识别。
+  """
+  def __init__(self, compressor: Optional[BlobCompressor] = None):
+    self.compressor = compressor
+
   def dumps(self, obj: Any) -> bytes:
+    try:
+      data = _CODEC_HEADER + ormsgpack.packb(obj, option=_PACK_OPTION, default=self._default_encoder)
+    except Exception as e:
+      _log.debug("typed msgpack fallback to legacy format: {}", e)
+      data = self._dumps_legacy(obj)
+    return self.compressor.compress(data) if self.compressor else data
+
+  def _default_encoder(self, obj: Any) -> Any:
+    code = _MESSAGE_EXT.get(type(obj))
+    if code is None:
+      code = next((c for cls, c in _MESSAGE_EXT.items() if isinstance(obj, cls)), None)
+    if code is not None:
+      fields = {"content": obj.content}
+      for name in _MESSAGE_FIELDS[code]:
+        value = getattr(obj, name, None)
+        if value:
+          fields[name] = value
+      return ormsgpack.Ext(code, ormsgpack.packb(fields, option=_PACK_OPTION, default=self._default_encoder))
+
+    if isinstance(obj, (set, frozenset)):
+      return list(obj)
+    if hasattr(obj, "model_dump") and callable(obj.model_dump):
+      return obj.model_dump()
+    if hasattr(obj, "__dict__"):
+      return vars(obj)
+    return str(obj)
+
+  def _ext_hook(self, code: int, data: bytes) -> Any:
+    cls = _EXT_MESSAGE.get(code)
+    if cls is None:
+      raise ValueError(f"unknown msgpack ext type {code}")
+    return cls(**ormsgpack.unpackb(data, ext_hook=self._ext_hook, option=_PACK_OPTION))
+
+  def loads(self, data: bytes) -> Any:
+    if self.compressor:
+      data = self.compressor.decompress(data)
+    if data[:1] == _CODEC_MAGIC:
+      if data[1:2] != bytes([_CODEC_VERSION]):
+        raise ValueError(f"unsupported checkpoint codec version {data[1:2]!r}")
+      return ormsgpack.unpackb(data[2:], ext_hook=self._ext_hook, option=_PACK_OPTION)
+    return self._revive_legacy(self._loads_legacy(data))
+
+  # --- 旧格式 ---
+  def _dumps_legacy(self, obj: Any) -> bytes:
     safe_obj = self._clean_for_serialization(obj)
     try:
-      return ormsgpack.packb(
-        safe_obj,
-        option=ormsgpack.OPT_NON_STR_KEYS,
-        default=self._default_encoder
-      )
+      return ormsgpack.packb(safe_obj, option=_PACK_OPTION, default=str)
     except Exception as e:
       _log.debug("ormsgpack fallback to JSON: {}", e)
       return json.dumps(safe_obj, default=str).encode("utf-8")
@@ -40,22 +140,256 @@ class CrossCompatibleSerializer(SerializerProtocol):
       return obj
     return str(obj)
 
-  def _default_encoder(self, obj: Any) -> Any:
-    return str(obj)
-
-  def loads(self, data: bytes) -> Any:
+  def _loads_legacy(self, data: bytes) -> Any:
+    # 旧格式顶层总是 map/array；以 { 或 [ 开头的只能是 JSON 兜底格式（msgpack 会把它当成单个整数，忽略后面的数据）
+    if data[:1] in (b"{", b"["):
+      return json.loads(data.decode("utf-8"))
     try:
       return ormsgpack.unpackb(data)
     except Exception:
       return json.loads(data.decode("utf-8"))
 
+  def _revive_legacy(self, obj: Any) -> Any:
+    if isinstance(obj, list):
+      return [self._revive_legacy(item) for item in obj]
+    if not isinstance(obj, dict):
+      return obj
+    cls = _LEGACY_MESSAGE_TYPES.get(obj.get("type"))
+    if cls is not None and "content" in obj:
+      try:
+        return cls(**{k: v for k, v in obj.items() if k != "type" and v is not None})
+      except Exception as e:
+        _log.debug("legacy message revive failed, keep dict: {}", e)
+        return obj
+    return {k: self._revive_legacy(v) for k, v in obj.items()}
+
+# --- 快照写入脚本 ---
+# 在服务端原子地完成：写入快照及 __latest__ 指针、维护按时间排序的快照索引、
+# 按保留策略清理最旧的快照(连同其 writes 与不再被引用的 channel 值)，并为整个会话续期。
+# delta 模式下还会写入变化的 channel 值、向追加型 channel 的 List 追加新元素，
+# 并根据实际追加位置生成本快照的引用信息(refs)。
+# refs 中的追加区间是逻辑位置：清理快照时 List 头部已不被引用的元素会被裁掉，
+# 各 List 已裁掉的元素个数记在 channel_refs 的 __base__ 字段，List 下标 = 逻辑位置 - base。
+# KEYS[1]=checkpoints  KEYS[2]=checkpoint_index  KEYS[3]=channel_refs  KEYS[4]=channel_values
+# KEYS[5]=checkpoint_meta  KEYS[6..]=追加型 channel 的 List
+# ARGV: ttl, checkpoint_id, blob, refs_json(全量模式为空串), score, keep, writes_prefix, metadata, n,
+#       n 组 (field, value)，随后每个追加型 channel 依次为 (channel, count, count 条元素)
+_PUT_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local checkpoint_id = ARGV[2]
+local keep = tonumber(ARGV[6])
+local writes_prefix = ARGV[7]
+local refs_json = ARGV[4]
+local pos = 9
+local n = tonumber(ARGV[pos])
+pos = pos + 1
+for i = 1, n do
+  redis.call('HSET', KEYS[4], ARGV[pos], ARGV[pos + 1])
+  pos = pos + 2
+end
+local base = cjson.decode(redis.call('HGET', KEYS[3], '__base__') or '{}')
+if refs_json ~= '' then
+  local refs = cjson.decode(refs_json)
+  for k = 6, #KEYS do
+    local channel = ARGV[pos]
+    local count = tonumber(ARGV[pos + 1])
+    pos = pos + 2
+    if count > 0 then
+      local start = redis.call('LLEN', KEYS[k]) + (base[channel] or 0)
+      for i = 1, count do
+        redis.call('RPUSH', KEYS[k], ARGV[pos])
+        pos = pos + 1
+      end
+      local segments = refs['a'][channel] or {}
+      local last = segments[#segments]
+      if last and last[2] == start then
+        last[2] = start + count
+      else
+        table.insert(segments, {start, start + count})
+      end
+      refs['a'][channel] = segments
+    end
+  end
+  refs_json = cjson.encode(refs)
+  redis.call('HSET', KEYS[3], checkpoint_id, refs_json)
+end
+redis.call('HSET', KEYS[1], checkpoint_id, ARGV[3], '__latest__', checkpoint_id)
+redis.call('HSET', KEYS[5], checkpoint_id, ARGV[8])
+redis.call('ZADD', KEYS[2], ARGV[5], checkpoint_id)
+
+if keep > 0 then
+  local excess = redis.call('ZCARD', KEYS[2]) - keep
+  if excess > 0 then
+    local dropped = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    -- 仍被保留快照引用的 channel 值不能删除；追加型 channel 记录保留快照引用的最小逻辑位置
+    local live = {}
+    local oldest = {}
+    for _, raw in ipairs(redis.call('HMGET', KEYS[3], unpack(redis.call('ZRANGE', KEYS[2], excess, -1)))) do
+      if raw then
+        local refs = cjson.decode(raw)
+        for _, field in ipairs(refs['v']) do
+          live[field] = true
+        end
+        for channel, segments in pairs(refs['a']) do
+          -- 区间按追加顺序排列，第一个区间的起点最小
+          if segments[1] and (not oldest[channel] or segments[1][1] < oldest[channel]) then
+            oldest[channel] = segments[1][1]
+          end
+        end
+      end
+    end
+    for _, id in ipairs(dropped) do
+      local raw = redis.call('HGET', KEYS[3], id)
+      if raw then
+        for _, field in ipairs(cjson.decode(raw)['v']) do
+          if not live[field] then
+            redis.call('HDEL', KEYS[4], field)
+          end
+        end
+      end
+      redis.call('HDEL', KEYS[1], id)
+      redis.call('HDEL', KEYS[3], id)
+      redis.call('HDEL', KEYS[5], id)
+      redis.call('DEL', writes_prefix .. id)
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+    -- 裁掉追加型 channel List 头部不再被任何保留快照引用的元素
+    if #KEYS > 5 then
+      local pos = 10 + 2 * n
+      for k = 6, #KEYS do
+        local channel = ARGV[pos]
+        local count = tonumber(ARGV[pos + 1])
+        pos = pos + 2 + count
+        local skip = base[channel] or 0
+        local len = redis.call('LLEN', KEYS[k])
+        local trim = math.min(oldest[channel] or (skip + len), skip + len) - skip
+        if trim > 0 then
+          redis.call('LTRIM', KEYS[k], trim, -1)
+          base[channel] = skip + trim
+        end
+      end
+      redis.call('HSET', KEYS[3], '__base__', cjson.encode(base))
+    end
+  end
+end
+
+if ttl > 0 then
+  for k = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[k], ttl)
+  end
+  for _, id in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    redis.call('EXPIRE', writes_prefix .. id, ttl)
+  end
+end
+return refs_json
+"""
+
+# --- 快照读取脚本 ---
+# 一次往返取回指定(或最新)快照、delta 模式下引用的 channel 值与追加型 channel 元素，以及该快照的 pending writes。
+# 若调用方本地缓存的快照(ARGV[3])仍是目标快照且 writes 数量(ARGV[4])未变，只返回 {checkpoint_id} 表示缓存有效。
+# KEYS 与 _PUT_SCRIPT 相同；ARGV[1]=checkpoint_id(空串表示最新), ARGV[2]=writes_prefix,
+# ARGV[3]=缓存的 checkpoint_id(可为空串), ARGV[4]=缓存的 writes 数量, ARGV[5..]=追加型 channel 名称（与 KEYS[6..] 一一对应）
+# 返回 {checkpoint_id, blob, refs_json, values, logs, writes}
+_GET_SCRIPT = """
+local id = ARGV[1]
+if id == '' then
+  id = redis.call('HGET', KEYS[1], '__latest__')
+  if not id then
+    return false
+  end
+end
+if id == ARGV[3] and redis.call('HLEN', ARGV[2] .. id) == tonumber(ARGV[4]) then
+  return {id}
+end
+local blob = redis.call('HGET', KEYS[1], id)
+if not blob then
+  return false
+end
+local refs_json = redis.call('HGET', KEYS[3], id)
+local values = {}
+local logs = {}
+if refs_json then
+  local refs = cjson.decode(refs_json)
+  local base = cjson.decode(redis.call('HGET', KEYS[3], '__base__') or '{}')
+  if #refs['v'] > 0 then
+    values = redis.call('HMGET', KEYS[4], unpack(refs['v']))
+  end
+  for k = 6, #KEYS do
+    local items = {}
+    local channel = ARGV[k - 1]
+    local segments = refs['a'][channel]
+    if segments then
+      local skip = base[channel] or 0
+      for _, segment in ipairs(segments) do
+        for _, item in ipairs(redis.call('LRANGE', KEYS[k], segment[1] - skip, segment[2] - 1 - skip)) do
+          table.insert(items, item)
+        end
+      end
+    end
+    table.insert(logs, items)
+  end
+else
+  refs_json = ''
+end
+return {id, blob, refs_json, values, logs, redis.call('HGETALL', ARGV[2] .. id)}
+"""
+
+def _normalize_versions(checkpoint: Any) -> None:
+  """
+  旧快照中的整数版本号转成与 get_next_version 相同的字符串格式（随机后缀为 0），
+  避免 LangGraph 比较版本号时整数与字符串混用
+  """
+  def normalize(version: Any) -> Any:
+    return f"{version:032}.{0:016}" if isinstance(version, int) else version
+  checkpoint["channel_versions"] = {k: normalize(v) for k, v in checkpoint.get("channel_versions", {}).items()}
+  checkpoint["versions_seen"] = {
+    node: {k: normalize(v) for k, v in seen.items()} for node, seen in checkpoint.get("versions_seen", {}).items()
+  }
+
+# refs 缓存条数上限（按 thread_id + checkpoint_id 缓存，快照不可变，因此多进程下也是安全的）
+_REFS_MEMO_SIZE = 1024
+
+class _CoalesceBuffer:
+  """一次合并写入范围内缓冲的快照：thread_id -> {parent, checkpoint, metadata, versions, writes, steps}"""
+  def __init__(self, flush_every: int = 0):
+    self.flush_every = flush_every
+    self.threads: Dict[str, Dict[str, Any]] = {}
+
+# 当前上下文的合并写入缓冲，None 表示直接写入
+_coalesce_buffer: ContextVar[Optional[_CoalesceBuffer]] = ContextVar("checkpoint_coalesce_buffer", default=None)
+
 # --- 异步 SimpleRedisSaver ---
 class SimpleRedisSaver(BaseCheckpointSaver):
-  def __init__(self, redis_client: Redis, ttl: int = 86400):
+  def __init__(
+    self,
+    redis_client: Union[Redis, RedisCluster, RedisShardRouter],
+    ttl: int = 86400,
+    delta: bool = False,
+    append_channels: Sequence[str] = ("messages",),
+    max_checkpoints: int = 0,
+    l1_cache_size: int = 0,
+    compressor: Optional[BlobCompressor] = None,
+    legacy_client: Optional[Redis] = None
+  ):
     super().__init__()
     self.redis_client = redis_client
     self.ttl = ttl
-    self.serde = CrossCompatibleSerializer()
+    self.serde = CrossCompatibleSerializer(compressor)
+    # delta 模式：快照只保存相对父快照发生变化的 channel，
+    # append_channels 中的 channel（reducer 为 operator.add 的列表）只追加新增元素
+    self.delta = delta
+    self.append_channels = tuple(append_channels)
+    # 每个会话最多保留的快照数（0 表示不限制），超出部分在写入时原子清理
+    self.max_checkpoints = max_checkpoints
+    self._refs_memo: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+    # 进程内 L1 缓存：thread_id -> 最近写入/读取的最新快照，读取时由服务端校验 __latest__ 与 writes 数量
+    self.l1_cache_size = l1_cache_size
+    self._l1: "OrderedDict[str, CheckpointTuple]" = OrderedDict()
+    # 旧版本（key 不带 hash tag）写入会话的 Redis；设置后读取不到会话时先把旧 key 迁移过来
+    self.legacy_client = legacy_client
+    self._put_script = redis_client.register_script(_PUT_SCRIPT)
+    self._get_script = redis_client.register_script(_GET_SCRIPT)
+    self._sliding_ttl = SlidingTTL(redis_client, ttl)
 
   def get_tuple(self, config: dict):
     raise NotImplementedError("Use aget_tuple instead")
@@ -68,25 +402,165 @@ class SimpleRedisSaver(BaseCheckpointSaver):
 
   def list(self, config: dict, *, before: Optional[dict] = None, limit: Optional[int] = None):
     raise NotImplementedError("Use alist instead")
-  
+
+  def get_next_version(self, current: Optional[Union[str, int]], channel: Any) -> str:
+    """
+    channel 版本号 = 递增序号 + 随机后缀。delta 模式按 channel|version 存储 channel 值，
+    从同一父快照分叉出的两个分支（如对历史快照 aupdate_state）序号相同，随机后缀保证不会互相覆盖。
+    序号补零到固定宽度，按字符串比较与按序号比较一致；旧快照中的整数版本号仍可识别
+    """
+    if current is None:
+      current_v = 0
+    elif isinstance(current, int):
+      current_v = current
+    else:
+      current_v = int(str(current).split(".")[0])
+    return f"{current_v + 1:032}.{random.random():016}"
+
+  # --- key 布局 ---
+  # 所有 key 以 {thread_id} 作为 hash tag，同一会话的数据落在 Redis Cluster 的同一个 slot，
+  # 保证 Lua 脚本与 pipeline 可以跨这些 key 执行；客户端分片时也按 thread_id 选实例
+  def _client(self, thread_id: str) -> Redis:
+    return client_for(self.redis_client, thread_id)
+
+  def _checkpoint_key(self, thread_id: str) -> str:
+    return f"checkpoints:{{{thread_id}}}"
+
+  def _refs_key(self, thread_id: str) -> str:
+    return f"channel_refs:{{{thread_id}}}"
+
+  def _values_key(self, thread_id: str) -> str:
+    return f"channel_values:{{{thread_id}}}"
+
+  def _log_key(self, thread_id: str, channel: str) -> str:
+    return f"append_log:{{{thread_id}}}:{channel}"
+
+  def _meta_key(self, thread_id: str) -> str:
+    return f"checkpoint_meta:{{{thread_id}}}"
+
+  def _index_key(self, thread_id: str) -> str:
+    return f"checkpoint_index:{{{thread_id}}}"
+
+  def _writes_prefix(self, thread_id: str) -> str:
+    return f"writes:{{{thread_id}}}:"
+
+  def _thread_keys(self, thread_id: str) -> List[str]:
+    """写入脚本使用的 key 列表，顺序与 _PUT_SCRIPT 中的 KEYS 约定一致"""
+    return [
+      self._checkpoint_key(thread_id),
+      self._index_key(thread_id),
+      self._refs_key(thread_id),
+      self._values_key(thread_id),
+      self._meta_key(thread_id)
+    ] + [self._log_key(thread_id, channel) for channel in self.append_channels]
+
+  def _legacy_key_pairs(self, thread_id: str, checkpoint_ids: List[str]) -> List[Tuple[str, str]]:
+    """(旧 key, 新 key)；快照 hash 放在最后，迁移中途其他 worker 读不到不完整的会话"""
+    pairs = [
+      (f"checkpoint_index:{thread_id}", self._index_key(thread_id)),
+      (f"channel_refs:{thread_id}", self._refs_key(thread_id)),
+      (f"channel_values:{thread_id}", self._values_key(thread_id)),
+      (f"checkpoint_meta:{thread_id}", self._meta_key(thread_id))
+    ]
+    pairs += [(f"append_log:{thread_id}:{channel}", self._log_key(thread_id, channel)) for channel in self.append_channels]
+    pairs += [(f"writes:{thread_id}:{cid}", f"{self._writes_prefix(thread_id)}{cid}") for cid in checkpoint_ids]
+    pairs.append((f"checkpoints:{thread_id}", self._checkpoint_key(thread_id)))
+    return pairs
+
+  async def amigrate_legacy(self, thread_id: str, source: Optional[Redis] = None) -> bool:
+    """
+    把旧 key（checkpoints:<thread_id> 等，不带 hash tag）迁移到当前的 key，保留剩余 TTL 并删除旧 key。
+    source 默认为 legacy_client；会话没有旧 key 时返回 False。
+    新 key 已存在时（其他 worker 已迁移，之后可能已写入新的快照）不覆盖，只删除旧 key，
+    因此多个 worker 同时迁移同一会话也不会丢失迁移后的写入
+    """
+    thread_id = str(thread_id)
+    source = source or self.legacy_client
+    if source is None:
+      return False
+    fields = await source.hkeys(f"checkpoints:{thread_id}")
+    if not fields:
+      return False
+    checkpoint_ids = [f.decode("utf-8") if isinstance(f, bytes) else f for f in fields]
+    target = self._client(thread_id)
+    for old_key, new_key in self._legacy_key_pairs(thread_id, [cid for cid in checkpoint_ids if cid != "__latest__"]):
+      dumped = await source.dump(old_key)
+      if dumped is None:
+        continue
+      ttl = await source.pttl(old_key)
+      # -2：旧 key 在 DUMP 之后已被删除（过期或其他 worker 已迁移）；-1：没有 TTL
+      if ttl == -2:
+        continue
+      try:
+        await target.restore(new_key, max(ttl, 0), dumped)
+      except ResponseError as e:
+        if "BUSYKEY" not in str(e):
+          raise
+      await source.delete(old_key)
+    _log.info("会话 {} 已从旧 key 迁移", thread_id)
+    return True
+
+  async def arefresh_ttl(self, thread_id: str) -> None:
+    """会话有读访问（例如加载历史）时续期，写入时脚本会自动续期"""
+    thread_id = str(thread_id)
+    await self._sliding_ttl.refresh(
+      self._thread_keys(thread_id),
+      index_key=self._index_key(thread_id),
+      member_prefix=self._writes_prefix(thread_id),
+      client=self._client(thread_id)
+    )
+
+  # --- 写入合并 ---
+  @asynccontextmanager
+  async def coalesce(self, flush_every: int = 0) -> AsyncIterator[None]:
+    """
+    在该上下文内（包括其中创建的子任务）合并快照写入：中间快照只保存在内存中，
+    每累计 flush_every 个快照（0 表示不按步数落盘）以及退出上下文时，
+    把最新快照连同它的 pending writes 在一个 pipeline 里写入 Redis。
+    中途进程崩溃会丢失未落盘的步骤，重新运行时从上一次落盘的快照继续。
+    """
+    buffer = _CoalesceBuffer(flush_every)
+    token = _coalesce_buffer.set(buffer)
+    try:
+      yield
+    finally:
+      _coalesce_buffer.reset(token)
+      for thread_id in list(buffer.threads):
+        await self._aflush(buffer, thread_id)
+
+  async def _aflush(self, buffer: "_CoalesceBuffer", thread_id: str) -> None:
+    entry = buffer.threads.pop(thread_id, None)
+    if not entry:
+      return
+    if "checkpoint" in entry:
+      # 父快照为缓冲开始前最后落盘的快照，new_versions 为期间所有步骤的合并
+      await self._aput_now(
+        thread_id, entry["parent"], entry["checkpoint"], entry["metadata"], entry["versions"], entry["writes"]
+      )
+      return
+    # 只有针对已落盘快照的写入
+    for config, task_id, writes in entry["writes"]:
+      await self._aput_writes_now(thread_id, config, writes, task_id)
+
   # 1. 异步存储快照
   async def aput(self, config: dict, checkpoint: Any, metadata: Any, new_versions: dict) -> dict:
     thread_id = str(config["configurable"]["thread_id"])
     checkpoint_id = str(checkpoint["id"])
-    key = f"checkpoints:{thread_id}"
-    
-    blob = self.serde.dumps({
-      "checkpoint": checkpoint,
-      "metadata": metadata,
-      "parent_config": config.get("parent_config")
-    })
-
-    async with self.redis_client.pipeline() as pipe:
-      pipe.hset(key, checkpoint_id, blob)
-      pipe.hset(key, "__latest__", checkpoint_id)
-      if self.ttl:
-        pipe.expire(key, self.ttl)
-      await pipe.execute()
+    buffer = _coalesce_buffer.get()
+    if buffer is None:
+      await self._aput_now(thread_id, config, checkpoint, metadata, new_versions)
+    else:
+      entry = buffer.threads.setdefault(thread_id, {"writes": [], "versions": {}, "steps": 0})
+      if "checkpoint" not in entry:
+        entry["parent"] = config
+      entry["checkpoint"] = copy_checkpoint(checkpoint)
+      entry["metadata"] = dict(metadata)
+      entry["versions"].update(new_versions)
+      # 之前缓冲的写入已体现在新快照的 channel 值中
+      entry["writes"] = []
+      entry["steps"] += 1
+      if buffer.flush_every and entry["steps"] >= buffer.flush_every:
+        await self._aflush(buffer, thread_id)
 
     return {
       "configurable": {
@@ -95,69 +569,412 @@ class SimpleRedisSaver(BaseCheckpointSaver):
       }
     }
 
+  async def _aput_now(
+    self,
+    thread_id: str,
+    config: dict,
+    checkpoint: Any,
+    metadata: Any,
+    new_versions: dict,
+    writes: Optional[List[Tuple[dict, str, Sequence[Any]]]] = None
+  ) -> None:
+    """写入快照；writes 为该快照的 pending writes，与快照在同一个 pipeline 中写入"""
+    checkpoint_id = str(checkpoint["id"])
+    parent_id = config["configurable"].get("checkpoint_id")
+    parent_config = {
+      "configurable": {"thread_id": thread_id, "checkpoint_id": str(parent_id)}
+    } if parent_id else None
+
+    if self.delta:
+      refs_json, value_args, log_args = await self._prepare_delta(thread_id, checkpoint, new_versions, parent_config)
+      stored = {k: v for k, v in checkpoint.items() if k != "channel_values"}
+      stored["channel_values"] = {}
+    else:
+      refs_json, value_args = "", []
+      log_args = [arg for channel in self.append_channels for arg in (channel, 0)]
+      stored = checkpoint
+
+    blob = self.serde.dumps({
+      "checkpoint": stored,
+      "metadata": metadata,
+      "parent_config": parent_config,
+      "delta": self.delta
+    })
+    args = [
+      self.ttl or 0, checkpoint_id, blob, refs_json, self._checkpoint_score(checkpoint),
+      self.max_checkpoints or 0, self._writes_prefix(thread_id), self.serde.dumps(metadata), len(value_args) // 2
+    ] + value_args + log_args
+    keys = self._thread_keys(thread_id)
+    client = self._client(thread_id)
+    results = []
+    if writes:
+      writes_key = f"{self._writes_prefix(thread_id)}{checkpoint_id}"
+
+      async def _execute():
+        async with client.pipeline(transaction=False) as pipe:
+          await self._put_script(keys=keys, args=args, client=pipe)
+          for _, task_id, task_writes in writes:
+            self._queue_writes(pipe, writes_key, task_writes, task_id)
+          if self.ttl:
+            pipe.expire(writes_key, self.ttl)
+          return await pipe.execute()
+
+      try:
+        results = await _execute()
+      except NoScriptError:
+        # Redis Cluster 的 pipeline 遇到 NOSCRIPT 不会自动加载脚本；写入均为幂等操作，加载后重试一次
+        await client.script_load(_PUT_SCRIPT)
+        results = await _execute()
+      refs_json = results[0]
+    else:
+      refs_json = await self._put_script(keys=keys, args=args, client=client)
+    if self.delta:
+      self._remember_refs(thread_id, checkpoint_id, json.loads(refs_json))
+    self._cache_tuple(thread_id, CheckpointTuple(
+      config={"configurable": {"thread_id": thread_id, "checkpoint_id": checkpoint_id}},
+      checkpoint=copy_checkpoint(checkpoint),
+      metadata=dict(metadata),
+      parent_config=parent_config,
+      pending_writes=[]
+    ))
+    pos = 1
+    for _, task_id, task_writes in writes or []:
+      self._cache_writes(thread_id, checkpoint_id, task_writes, task_id, results[pos:pos + len(task_writes)])
+      pos += len(task_writes)
+
+  async def _prepare_delta(self, thread_id: str, checkpoint: Any, new_versions: dict, parent_config: Optional[dict]):
+    """
+    delta 写入准备：普通 channel 按 (channel, version) 只写一次；追加型 channel 只追加父快照之后新增的元素。
+    返回 (refs_json, value_args, log_args)，追加位置由写入脚本在服务端确定。
+    """
+    parent_refs = None
+    if parent_config:
+      parent_refs = await self._aget_refs(thread_id, parent_config["configurable"]["checkpoint_id"])
+    if parent_refs is None:
+      # 没有父快照或父快照是全量格式：所有 channel 视为新写入
+      parent_refs = {"v": [], "a": {}}
+      new_versions = checkpoint["channel_versions"]
+
+    values = checkpoint["channel_values"]
+    # 未变化的 channel 直接沿用父快照引用的 field（旧快照的版本号在读取时已被规整，不能再由版本号拼出 field）
+    parent_fields = {field.rsplit("|", 1)[0]: field for field in parent_refs["v"]}
+    refs = {"v": [], "a": {}}
+    value_args = []
+    new_items_by_channel = {}
+    for channel, version in checkpoint["channel_versions"].items():
+      items = values.get(channel)
+      if channel in self.append_channels and isinstance(items, list):
+        segments = parent_refs["a"].get(channel, [])
+        known = sum(end - start for start, end in segments)
+        if len(items) < known:
+          # 非追加式修改（例如删除了消息），放弃父快照的引用整体重写
+          segments, known = [], 0
+        if channel in new_versions or not segments:
+          new_items_by_channel[channel] = items[known:]
+        if segments:
+          refs["a"][channel] = segments
+        continue
+
+      field = f"{channel}|{version}" if channel in new_versions else parent_fields.get(channel, f"{channel}|{version}")
+      refs["v"].append(field)
+      if channel in new_versions:
+        # channel 当前无值时写入空串占位，读取时跳过
+        value_args += [field, self.serde.dumps(items) if channel in values else b""]
+
+    log_args = []
+    for channel in self.append_channels:
+      new_items = new_items_by_channel.get(channel, [])
+      log_args += [channel, len(new_items)] + [self.serde.dumps(item) for item in new_items]
+    return json.dumps(refs), value_args, log_args
+
+  def _checkpoint_score(self, checkpoint: Any) -> int:
+    """快照索引的排序分值：快照时间戳(毫秒)"""
+    try:
+      return int(datetime.fromisoformat(checkpoint["ts"]).timestamp() * 1000)
+    except (KeyError, TypeError, ValueError):
+      return int(datetime.now().timestamp() * 1000)
+
   # 2. 异步存储中间写入
-  async def aput_writes(self, config: dict, writes: Sequence[Any], task_id: str) -> None:
+  async def aput_writes(self, config: dict, writes: Sequence[Any], task_id: str, task_path: str = "") -> None:
     thread_id = str(config["configurable"]["thread_id"])
+    buffer = _coalesce_buffer.get()
+    if buffer is not None:
+      entry = buffer.threads.setdefault(thread_id, {"writes": [], "versions": {}, "steps": 0})
+      entry["writes"].append((config, task_id, list(writes)))
+      return
+    await self._aput_writes_now(thread_id, config, writes, task_id)
+
+  async def _aput_writes_now(self, thread_id: str, config: dict, writes: Sequence[Any], task_id: str) -> None:
     checkpoint_id = str(config["configurable"]["checkpoint_id"])
-    key = f"writes:{thread_id}:{checkpoint_id}"
+    key = f"{self._writes_prefix(thread_id)}{checkpoint_id}"
     
-    async with self.redis_client.pipeline() as pipe:
-      for idx, write in enumerate(writes):
-        write_key = f"{task_id}_{idx}"
-        blob = self.serde.dumps(write)
-        pipe.hset(key, write_key, blob)
-      
+    # 所有命令只涉及同一个 key，不需要 MULTI；Redis Cluster 的 pipeline 也不支持事务
+    async with self._client(thread_id).pipeline(transaction=False) as pipe:
+      self._queue_writes(pipe, key, writes, task_id)
       if self.ttl:
         pipe.expire(key, self.ttl)
-      await pipe.execute()
+      results = await pipe.execute()
+    self._cache_writes(thread_id, checkpoint_id, writes, task_id, results)
+
+  def _queue_writes(self, pipe: Any, key: str, writes: Sequence[Any], task_id: str) -> None:
+    for idx, write in enumerate(writes):
+      # 特殊 channel(ERROR/INTERRUPT 等) 使用固定的负数下标并允许覆盖，普通写入只写一次
+      idx = WRITES_IDX_MAP.get(write[0], idx)
+      write_key = f"{task_id}_{idx}"
+      blob = self.serde.dumps(write)
+      if idx < 0:
+        pipe.hset(key, write_key, blob)
+      else:
+        pipe.hsetnx(key, write_key, blob)
+
+  def _cache_writes(self, thread_id: str, checkpoint_id: str, writes: Sequence[Any], task_id: str, results: List[Any]) -> None:
+    """同步更新缓存中该快照的 pending writes，保持与 Redis 中的数量一致；results 为对应 HSET/HSETNX 的返回值"""
+    cached = self._l1.get(thread_id)
+    if cached and cached.config["configurable"]["checkpoint_id"] == checkpoint_id:
+      pending = list(cached.pending_writes)
+      for (channel, value), added in zip(writes, results):
+        idx = WRITES_IDX_MAP.get(channel, 0)
+        if idx < 0:
+          pending = [w for w in pending if not (w[0] == task_id and w[1] == channel)]
+          pending.append((task_id, channel, value))
+        elif added:
+          pending.append((task_id, channel, value))
+      self._l1[thread_id] = cached._replace(pending_writes=pending)
 
   # 3. 异步读取快照
   async def aget_tuple(self, config: dict) -> Optional[CheckpointTuple]:
     thread_id = str(config["configurable"]["thread_id"])
     checkpoint_id = config["configurable"].get("checkpoint_id")
-    key = f"checkpoints:{thread_id}"
 
-    if not checkpoint_id:
-      res = await self.redis_client.hget(key, "__latest__")
-      checkpoint_id = res.decode("utf-8") if res else None
-    
-    if not checkpoint_id:
+    # 一次服务端脚本取回快照、其引用的 channel 值和 pending writes，只有一次网络往返
+    # 本进程缓存的快照只需服务端确认仍有效，命中时省去 blob 下载与反序列化
+    cached = self._l1.get(thread_id)
+    if cached and checkpoint_id and cached.config["configurable"]["checkpoint_id"] != checkpoint_id:
+      cached = None
+    res = await self._get_script(
+      keys=self._thread_keys(thread_id),
+      args=self._get_args(thread_id, checkpoint_id, cached),
+      client=self._client(thread_id)
+    )
+    if not res and self.legacy_client is not None and await self.amigrate_legacy(thread_id):
+      res = await self._get_script(
+        keys=self._thread_keys(thread_id),
+        args=self._get_args(thread_id, checkpoint_id),
+        client=self._client(thread_id)
+      )
+    if not res:
       return None
+    if len(res) == 1:
+      self._l1.move_to_end(thread_id)
+      return self._copy_tuple(cached)
 
-    data = await self.redis_client.hget(key, checkpoint_id)
-    if data:
-      try:
-        content = self.serde.loads(data)
-        return CheckpointTuple(
-          config={"configurable": {"thread_id": thread_id, "checkpoint_id": checkpoint_id}},
-          checkpoint=content["checkpoint"],
-          metadata=content.get("metadata", {}),
-          parent_config=content.get("parent_config"),
-          pending_writes=[]
+    tup = self._build_tuple(thread_id, res)
+    if tup and not checkpoint_id:
+      self._cache_tuple(thread_id, tup)
+    return tup
+
+  def _get_args(self, thread_id: str, checkpoint_id: Optional[str], cached: Optional[CheckpointTuple] = None) -> List[Any]:
+    """读取脚本的 ARGV，顺序与 _GET_SCRIPT 的约定一致"""
+    cached_id = cached.config["configurable"]["checkpoint_id"] if cached else ""
+    cached_writes = len(cached.pending_writes) if cached else 0
+    return [checkpoint_id or "", self._writes_prefix(thread_id), cached_id, cached_writes] + list(self.append_channels)
+
+  # --- 进程内 L1 缓存 ---
+  def _cache_tuple(self, thread_id: str, tup: CheckpointTuple) -> None:
+    if self.l1_cache_size <= 0:
+      return
+    self._l1[thread_id] = tup
+    self._l1.move_to_end(thread_id)
+    if len(self._l1) > self.l1_cache_size:
+      self._l1.popitem(last=False)
+
+  def _copy_tuple(self, tup: CheckpointTuple) -> CheckpointTuple:
+    # LangGraph 会原地修改读到的快照(channel_versions 等)，缓存项必须复制后再返回
+    return tup._replace(
+      checkpoint=copy_checkpoint(tup.checkpoint),
+      metadata=dict(tup.metadata),
+      pending_writes=list(tup.pending_writes)
+    )
+
+  def _build_tuple(self, thread_id: str, res: List[Any]) -> Optional[CheckpointTuple]:
+    """把读取脚本的返回值组装成 CheckpointTuple"""
+    checkpoint_id, data, refs_json, values, logs, writes = res
+    checkpoint_id = checkpoint_id.decode("utf-8")
+    try:
+      content = self.serde.loads(data)
+      checkpoint = content["checkpoint"]
+      _normalize_versions(checkpoint)
+      if content.get("delta"):
+        if not refs_json:
+          raise ValueError(f"channel refs of checkpoint {checkpoint_id} not found")
+        refs = self._remember_refs(thread_id, checkpoint_id, json.loads(refs_json))
+        checkpoint["channel_values"] = self._build_channel_values(
+          refs, values, {channel: items for channel, items in zip(self.append_channels, logs) if channel in refs["a"]}
         )
-      except Exception as e:
-        _log.error("Failed to load checkpoint {}: {}", checkpoint_id, e)
+
+      return CheckpointTuple(
+        config={"configurable": {"thread_id": thread_id, "checkpoint_id": checkpoint_id}},
+        checkpoint=checkpoint,
+        metadata=content.get("metadata", {}),
+        parent_config=content.get("parent_config"),
+        pending_writes=self._build_pending_writes(writes)
+      )
+    except Exception as e:
+      _log.error("Failed to load checkpoint {}: {}", checkpoint_id, e)
     return None
 
+  def _build_pending_writes(self, flat: List[bytes]) -> List[Tuple[str, str, Any]]:
+    """HGETALL 的扁平结果 [field, blob, ...] -> [(task_id, channel, value)]，按 (task_id, idx) 排序"""
+    entries = []
+    for field, blob in zip(flat[::2], flat[1::2]):
+      task_id, idx = field.decode("utf-8").rsplit("_", 1)
+      channel, value = self.serde.loads(blob)
+      entries.append((task_id, int(idx), channel, value))
+    entries.sort(key=lambda e: (e[0], e[1]))
+    return [(task_id, channel, value) for task_id, _, channel, value in entries]
+
   # 4. 异步流式历史记录
-  async def alist(self, config: dict, *, before: Optional[dict] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
-    thread_id = str(config["configurable"]["thread_id"])
-    key = f"checkpoints:{thread_id}"
-    count = 0
-    
-    # 使用异步迭代器 hscan_iter
-    async for ckpt_id, data in self.redis_client.hscan_iter(key, match="*", count=100):
-      if limit and count >= limit: break
-      if ckpt_id == b"__latest__": continue
+  async def alist(
+    self,
+    config: Optional[dict],
+    *,
+    filter: Optional[Dict[str, Any]] = None,
+    before: Optional[dict] = None,
+    limit: Optional[int] = None
+  ) -> AsyncIterator[CheckpointTuple]:
+    """
+    按时间倒序(最新在前)列出快照。基于快照索引分页，before/limit 的代价为 O(log n + k)；
+    指定 filter 时先只读元数据过滤，命中后才加载完整快照。
+    快照按会话存储，不支持跨会话列出，config 必须包含 thread_id。
+    """
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    if thread_id is None:
+      raise ValueError("SimpleRedisSaver.alist requires config['configurable']['thread_id']; listing across threads is not supported")
+    thread_id = str(thread_id)
+    checkpoint_id = config["configurable"].get("checkpoint_id")
+    if checkpoint_id:
+      tup = await self.aget_tuple(config)
+      if tup and self._match_metadata(tup.metadata, filter):
+        yield tup
+      return
+
+    remaining = limit
+    async for page in self._aiter_index_pages(thread_id, before, limit if not filter else None):
+      if filter:
+        metas = await self._aload_metadata(thread_id, page)
+        page = [cid for cid, meta in zip(page, metas) if self._match_metadata(meta, filter)]
+      if remaining is not None:
+        page = page[:remaining]
+      if not page:
+        continue
+
       try:
-        content = self.serde.loads(data)
-        yield CheckpointTuple(
-          config={"configurable": {"thread_id": thread_id, "checkpoint_id": ckpt_id.decode("utf-8")}},
-          checkpoint=content["checkpoint"],
-          metadata=content.get("metadata", {}),
-          parent_config=content.get("parent_config"),
-          pending_writes=[]
+        results = await self._aget_page(thread_id, page)
+      except NoScriptError:
+        # Redis Cluster 的 pipeline 遇到 NOSCRIPT 不会自动加载脚本（例如节点刚完成故障切换），加载后重试一次
+        await self._client(thread_id).script_load(_GET_SCRIPT)
+        results = await self._aget_page(thread_id, page)
+      for res in results:
+        tup = self._build_tuple(thread_id, res) if res else None
+        if tup:
+          yield tup
+          if remaining is not None:
+            remaining -= 1
+      if remaining is not None and remaining <= 0:
+        return
+
+  async def _aget_page(self, thread_id: str, page: List[str]) -> List[Any]:
+    """同一页的快照在一个 pipeline 里读取"""
+    async with self._client(thread_id).pipeline(transaction=False) as pipe:
+      for cid in page:
+        await self._get_script(
+          keys=self._thread_keys(thread_id),
+          args=self._get_args(thread_id, cid),
+          client=pipe
         )
-        count += 1
-      except:
-        continue
\ No newline at end of file
+      return await pipe.execute()
+
+  async def alist_metadata(
+    self,
+    config: dict,
+    *,
+    before: Optional[dict] = None,
+    limit: Optional[int] = None
+  ) -> AsyncIterator[Tuple[dict, Dict[str, Any]]]:
+    """
+    只列出快照元数据 (config, metadata)，最新在前，不加载快照本体。用于历史浏览/时间回溯调试。
+    """
+    thread_id = str(config["configurable"]["thread_id"])
+    async for page in self._aiter_index_pages(thread_id, before, limit):
+      metas = await self._aload_metadata(thread_id, page)
+      for cid, meta in zip(page, metas):
+        yield {"configurable": {"thread_id": thread_id, "checkpoint_id": cid}}, meta
+
+  async def _aiter_index_pages(self, thread_id: str, before: Optional[dict], limit: Optional[int], page_size: int = 50) -> AsyncIterator[List[str]]:
+    """按索引倒序分页产出 checkpoint_id；before 为排他上界"""
+    index_key = self._index_key(thread_id)
+    start = 0
+    before_id = (before or {}).get("configurable", {}).get("checkpoint_id")
+    if before_id:
+      rank = await self._client(thread_id).zrevrank(index_key, before_id)
+      if rank is None:
+        return
+      start = rank + 1
+
+    total = 0
+    while limit is None or total < limit:
+      size = page_size if limit is None else min(page_size, limit - total)
+      ids = await self._client(thread_id).zrevrange(index_key, start, start + size - 1)
+      if not ids:
+        return
+      page = [cid.decode("utf-8") for cid in ids]
+      total += len(page)
+      start += len(page)
+      yield page
+      if len(page) < size:
+        return
+
+  async def _aload_metadata(self, thread_id: str, checkpoint_ids: List[str]) -> List[Dict[str, Any]]:
+    raws = await self._client(thread_id).hmget(self._meta_key(thread_id), checkpoint_ids)
+    metas = []
+    for cid, raw in zip(checkpoint_ids, raws):
+      if raw:
+        metas.append(self.serde.loads(raw))
+        continue
+      # 早期写入的快照没有单独的元数据，退回读取快照本体
+      data = await self._client(thread_id).hget(self._checkpoint_key(thread_id), cid)
+      metas.append(self.serde.loads(data).get("metadata", {}) if data else {})
+    return metas
+
+  def _match_metadata(self, metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    if not filter:
+      return True
+    return all((metadata or {}).get(k) == v for k, v in filter.items())
+
+  def _build_channel_values(self, refs: Dict, values: List[Optional[bytes]], logs: Dict[str, List[bytes]]) -> Dict[str, Any]:
+    channel_values = {}
+    for field, raw in zip(refs["v"], values):
+      # 空串表示该版本下 channel 无值；None 表示 field 已不存在
+      if raw:
+        channel_values[field.rsplit("|", 1)[0]] = self.serde.loads(raw)
+    for channel, items in logs.items():
+      channel_values[channel] = [self.serde.loads(item) for item in items]
+    return channel_values
+
+  async def _aget_refs(self, thread_id: str, checkpoint_id: str) -> Optional[Dict]:
+    refs = self._refs_memo.get((thread_id, checkpoint_id))
+    if refs is not None:
+      self._refs_memo.move_to_end((thread_id, checkpoint_id))
+      return refs
+    raw = await self._client(thread_id).hget(self._refs_key(thread_id), checkpoint_id)
+    if not raw:
+      return None
+    return self._remember_refs(thread_id, checkpoint_id, json.loads(raw))
+
+  def _remember_refs(self, thread_id: str, checkpoint_id: str, refs: Dict) -> Dict:
+    # Lua cjson 会把空数组编码成 {}，这里统一规整
+    refs = {"v": list(refs.get("v") or []), "a": dict(refs.get("a") or {})}
+    self._refs_memo[(thread_id, checkpoint_id)] = refs
+    if len(self._refs_memo) > _REFS_MEMO_SIZE:
+      self._refs_memo.popitem(last=False)
+    return refs
@@ -0,0 +1,86 @@
+# 2 个空格对齐
+import re
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+from loguru import logger as _log
+
+# 归一化时去掉空白与标点（\W 在 unicode 模式下不包含汉字）
+_NORMALIZE_RE = re.compile(r"[\W_]+")
+
+class Speculation:
+  """一次预取：基于用户原始输入提前发起的查询，只能被工具认领一次"""
+  def __init__(self, query: str, task: asyncio.Task):
+    self.query = query
+    self.normalized = normalize_query(query)
+    self.task = task
+    self.claimed = False
+
+# 当前对话运行中的预取：名称 -> Speculation。对话运行内创建的子任务（工具节点）继承该上下文
+_speculations: ContextVar[Optional[Dict[str, Speculation]]] = ContextVar("speculations", default=None)
+
+def normalize_query(text: str) -> str:
+  return _NORMALIZE_RE.sub("", text or "").lower()
+
+def _bigrams(text: str) -> List[str]:
+  return [text[i:i + 2] for i in range(len(text) - 1)]
+
+def query_similarity(prompt: str, query: str) -> float:
+  """
+  工具查询被用户原始输入覆盖的程度 [0, 1]，均为已归一化的文本。
+  模型的查询通常是从原始输入中提炼的关键词（“华为手机” / “我有5万豆想换个华为手机”）：
+  查询是原始输入的一部分时为 1，否则为查询的字符二元组出现在原始输入中的比例
+  """
+  if not prompt or not query:
+    return 0.0
+  if query in prompt:
+    return 1.0
+  grams = _bigrams(query)
+  if not grams:
+    return 0.0
+  prompt_grams = set(_bigrams(prompt))
+  return sum(gram in prompt_grams for gram in grams) / len(grams)
+
+@contextmanager
+def scope() -> Iterator[None]:
+  """
+  一次对话运行的预取范围：退出时取消未被认领的预取任务
+  """
+  specs: Dict[str, Speculation] = {}
+  token = _speculations.set(specs)
+  try:
+    yield
+  finally:
+    _speculations.reset(token)
+    for name, spec in specs.items():
+      if spec.claimed:
+        continue
+      if not spec.task.done():
+        spec.task.cancel()
+      elif not spec.task.cancelled() and spec.task.exception() is not None:
+        _log.debug("未被使用的预取 {} 失败: {}", name, spec.task.exception())
+
+def start(name: str, query: str, factory: Callable[[], Awaitable[Any]]) -> None:
+  """在当前预取范围内发起预取；不在范围内时忽略"""
+  specs = _speculations.get()
+  if specs is None or name in specs:
+    return
+  specs[name] = Speculation(query, asyncio.ensure_future(factory()))
+  _log.debug("已发起预取 {}: {}", name, query)
+
+def claim(name: str, query: str, threshold: float) -> Optional[asyncio.Task]:
+  """
+  工具实际查询被预取查询（用户原始输入）覆盖的程度不低于 threshold 时认领预取结果，返回预取任务；否则返回 None
+  """
+  specs = _speculations.get()
+  spec = specs.get(name) if specs else None
+  if spec is None or spec.claimed:
+    return None
+  score = query_similarity(spec.normalized, normalize_query(query))
+  if score < threshold:
+    _log.debug("预取 {} 未命中，相似度 {:.2f}: {} / {}", name, score, spec.query, query)
+    return None
+  spec.claimed = True
+  _log.info("预取 {} 命中，相似度 {:.2f}: {}", name, score, query)
+  return spec.task
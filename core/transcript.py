@@ -0,0 +1,159 @@
+# 2 个空格对齐
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from langchain_core.messages import BaseMessage
+from loguru import logger as _log
+
+from cache.redis_cache import client_for
+
+# 追加脚本：每条记录带自增 id（i），列表按 id 有序，超过 max_entries 时裁掉最旧的
+# KEYS[1]=transcript 列表；ARGV[1]=ttl, ARGV[2]=max_entries, ARGV[3]=mode(''=总是写入, 'exists'=仅列表已存在时, 'new'=仅列表不存在时), ARGV[4..]=记录 JSON
+# 返回写入的条数，未满足 mode 条件时返回 -1
+_APPEND_SCRIPT = """
+local exists = redis.call('EXISTS', KEYS[1]) == 1
+if (ARGV[3] == 'exists' and not exists) or (ARGV[3] == 'new' and exists) then
+  return -1
+end
+local next_id = 1
+local last = redis.call('LINDEX', KEYS[1], -1)
+if last then
+  next_id = cjson.decode(last).i + 1
+end
+for i = 4, #ARGV do
+  local entry = cjson.decode(ARGV[i])
+  entry.i = next_id
+  next_id = next_id + 1
+  redis.call('RPUSH', KEYS[1], cjson.encode(entry))
+end
+local max_entries = tonumber(ARGV[2])
+if max_entries > 0 then
+  redis.call('LTRIM', KEYS[1], -max_entries, -1)
+end
+local ttl = tonumber(ARGV[1])
+if ttl > 0 then
+  redis.call('EXPIRE', KEYS[1], ttl)
+end
+return #ARGV - 3
+"""
+
+# 分页读取脚本：cursor 为排他上界 id（''=从最新开始），返回 {最旧一条的 id, 记录...}，列表不存在时返回空
+# KEYS[1]=transcript 列表；ARGV[1]=cursor, ARGV[2]=limit, ARGV[3]=ttl（读访问顺便续期）
+_PAGE_SCRIPT = """
+local len = redis.call('LLEN', KEYS[1])
+if len == 0 then
+  return {}
+end
+local first_id = cjson.decode(redis.call('LINDEX', KEYS[1], 0)).i
+local stop = len - 1
+if ARGV[1] ~= '' then
+  stop = math.min(stop, tonumber(ARGV[1]) - first_id - 1)
+end
+local ttl = tonumber(ARGV[3])
+if ttl > 0 then
+  redis.call('EXPIRE', KEYS[1], ttl)
+end
+if stop < 0 then
+  return {first_id}
+end
+local start = math.max(0, stop - tonumber(ARGV[2]) + 1)
+local res = redis.call('LRANGE', KEYS[1], start, stop)
+table.insert(res, 1, first_id)
+return res
+"""
+
+def to_transcript_entries(messages: Iterable[Any]) -> List[Dict[str, str]]:
+  """
+  从 LangGraph 消息中筛出用户可见的对话：严格过滤掉所有工具交互及中间 JSON 报文
+  """
+  entries = []
+  for msg in messages:
+    # 序列化器保证还原出的是消息对象（旧格式的字典也会被还原）
+    if not isinstance(msg, BaseMessage):
+      continue
+    content = msg.content
+    msg_type = msg.type
+    tool_calls = getattr(msg, 'tool_calls', None)
+
+    # --- 核心过滤逻辑 ---
+
+    # 1. 必须有内容
+    if not content or not str(content).strip():
+      continue
+
+    # 2. 排除工具执行结果 (ToolMessage)
+    if msg_type == "tool":
+      continue
+
+    # 3. 排除 AI 的工具调用指令 (带 tool_calls 的 AIMessage)
+    if tool_calls:
+      continue
+
+    # 4. 排除 AI 直接复读的原始 JSON 数据 (防止那种 AI: [{"name":...}] 的情况)
+    if is_json_array(content):
+      continue
+
+    # 5. 确定角色
+    if msg_type == "human":
+      entries.append({"role": "user", "content": content})
+    elif msg_type == "ai":
+      entries.append({"role": "assistant", "content": content})
+
+  return entries
+
+def is_json_array(content: Any) -> bool:
+  """内容是以 [ 开头并以 ] 结尾，且能解析为 JSON"""
+  stripped_content = str(content).strip()
+  if stripped_content.startswith("[") and stripped_content.endswith("]"):
+    try:
+      json.loads(stripped_content)
+      return True
+    except ValueError:
+      pass # 解析失败说明是普通文本
+  return False
+
+class TranscriptStore:
+  """
+  每个用户已过滤好的可见对话记录（Redis 列表 transcript:{userCode}），
+  在发送最终回答时追加，加载历史只需一次范围读取，不再反序列化整个 LangGraph 状态。
+  key 使用 {userCode} 作为 hash tag，与该用户的会话数据位于同一分片/slot。
+  """
+  def __init__(self, redis_client: Any, ttl: int = 86400, max_entries: int = 200):
+    self.redis_client = redis_client
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self._append_script = redis_client.register_script(_APPEND_SCRIPT)
+    self._page_script = redis_client.register_script(_PAGE_SCRIPT)
+
+  def _key(self, user_id: str) -> str:
+    return f"transcript:{{{user_id}}}"
+
+  async def append(self, user_id: str, entries: List[Dict[str, str]], mode: str = "") -> int:
+    """
+    追加记录，返回写入条数；mode 为 'exists'/'new' 时条件不满足返回 -1
+    """
+    user_id = str(user_id)
+    args = [self.ttl or 0, self.max_entries or 0, mode] + [
+      json.dumps(e, ensure_ascii=False) for e in entries
+    ]
+    return int(await self._append_script(
+      keys=[self._key(user_id)], args=args, client=client_for(self.redis_client, user_id)
+    ))
+
+  async def page(self, user_id: str, cursor: Optional[int], limit: int) -> Optional[Tuple[List[Dict[str, str]], Optional[int]]]:
+    """
+    读取 cursor 之前(更早)的最多 limit 条记录，按时间正序返回 (records, next_cursor)；
+    next_cursor 为 None 表示没有更早的记录。列表不存在时返回 None。
+    """
+    user_id = str(user_id)
+    res = await self._page_script(
+      keys=[self._key(user_id)],
+      args=["" if cursor is None else int(cursor), limit, self.ttl or 0],
+      client=client_for(self.redis_client, user_id)
+    )
+    if not res:
+      return None
+    first_id, items = int(res[0]), [json.loads(item) for item in res[1:]]
+    next_cursor = items[0]["i"] if items and items[0]["i"] > first_id else None
+    records = [{"role": item["role"], "content": item["content"]} for item in items]
+    _log.debug("用户 {} 历史读取 {} 条，next_cursor={}", user_id, len(records), next_cursor)
+    return records, next_cursor
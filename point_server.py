@@ -1,18 +1,31 @@
 # 2 个空格对齐
 import os
 import asyncio,json,ssl
+import hashlib
+import hmac
 from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
+from typing import Any, Optional
 import uvicorn
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from loguru import logger as _log
 from redis.asyncio import Redis, ConnectionPool
+from redis.asyncio.cluster import RedisCluster, ClusterNode
 from fastapi import WebSocket, WebSocketDisconnect, status
 
 from core.simple_redis_saver import SimpleRedisSaver
+from core.blob_compressor import BlobCompressor
+from core.transcript import TranscriptStore
+from core.context_window import RollingSummary
+from core.answer_cache import AnswerCache
+from core.icbc_db import ICBCVectorDB
+from core.metrics import LLMMetrics
+from cache.redis_cache import RedisShardRouter, client_for
 import config.config as config
 import core.token as token_module
+import config.resource as resource
 from core.redemption_agent import RedemptionAgent
 
 # 禁用 LangChain 匿名遥测
@@ -95,7 +108,35 @@ async def token_management_server():
   
   async with server:
     await server.serve_forever()
-    
+
+def create_conversation_redis(shared_redis: Redis, max_connections: int):
+  """
+  会话存储(checkpoint)使用的 Redis：
+  - standalone: 与 Token 共用同一个节点
+  - cluster: Redis Cluster，会话 key 带 {thread_id} hash tag，同一会话落在同一个 slot
+  - sharded: 多个独立 Redis 实例，按 thread_id 在客户端分片
+  """
+  mode = config.get_redis_mode()
+  nodes = [(n.rsplit(":", 1)[0], int(n.rsplit(":", 1)[1])) for n in config.get_redis_nodes()]
+  if mode == "cluster":
+    if not nodes:
+      raise ValueError("redis.mode=cluster requires redis.nodes")
+    _log.info("会话存储使用 Redis Cluster，启动节点: {}", nodes)
+    return RedisCluster(
+      startup_nodes=[ClusterNode(host, port) for host, port in nodes],
+      max_connections=max_connections,
+      decode_responses=False
+    )
+  if mode == "sharded":
+    if not nodes:
+      raise ValueError("redis.mode=sharded requires redis.nodes")
+    _log.info("会话存储使用客户端分片，分片: {}", nodes)
+    return RedisShardRouter([
+      Redis(host=host, port=port, db=0, max_connections=max_connections, decode_responses=False)
+      for host, port in nodes
+    ])
+  return shared_redis
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
   """
@@ -116,6 +157,7 @@ async def lifespan(app: FastAPI):
     decode_responses=False # 注意：Saver 可能需要 bytes，TokenManager 自行处理字符串
   )
   shared_redis = Redis(connection_pool=redis_pool)
+  conversation_redis = create_conversation_redis(shared_redis, config.get_max_thread_workers() * 2 or 100)
 
   loop = asyncio.get_running_loop()
   executor = ThreadPoolExecutor(
@@ -131,18 +173,72 @@ async def lifespan(app: FastAPI):
   
   # 2. 初始化 Token 管理器
   tm = token_module.TokenManager(ttl=config.get_token_ttl_in_seconds())
-  tm.set_client(shared_redis)
+  # Token 只用单 key 命令，集群模式下直接放到集群里；客户端分片模式仍使用 Token 专用节点
+  tm.set_client(conversation_redis if isinstance(conversation_redis, RedisCluster) else shared_redis)
   state["token_manager"] = tm
   token_task = asyncio.create_task(token_management_server())
   
   # 3. 实例化 Agent
-  saver = SimpleRedisSaver(redis_client=shared_redis,ttl=config.get_redis_msg_ttl_in_seconds())
-  state["agent"] = RedemptionAgent(saver=saver)
+  compressor = BlobCompressor(
+    dict_file=config.get_redis_compression_dict_file(),
+    threshold=config.get_redis_compression_threshold(),
+    level=config.get_redis_compression_level(),
+    enabled=config.get_redis_compression_enabled()
+  )
+  saver = SimpleRedisSaver(
+    redis_client=conversation_redis,
+    ttl=config.get_redis_msg_ttl_in_seconds(),
+    delta=config.get_redis_checkpoint_delta(),
+    max_checkpoints=config.get_redis_max_checkpoints_per_thread(),
+    l1_cache_size=config.get_redis_l1_cache_size(),
+    compressor=compressor,
+    # 旧版本的会话都写在 Token 节点上
+    legacy_client=shared_redis if config.get_redis_legacy_key_fallback() else None
+  )
+  transcript = TranscriptStore(
+    conversation_redis,
+    ttl=config.get_redis_msg_ttl_in_seconds(),
+    max_entries=config.get_redis_transcript_max_entries()
+  )
+  summary_prompt = resource.get_resource()["default_values"].get("summarize_conversation_prompt")
+  if config.get_context_summary_enabled() and not summary_prompt:
+    _log.error("resource 文件中没有 default_values.summarize_conversation_prompt，不生成滚动摘要")
+  summaries = RollingSummary(
+    conversation_redis,
+    prompt=summary_prompt,
+    ttl=config.get_redis_msg_ttl_in_seconds(),
+    max_chars=config.get_context_summary_max_chars()
+  ) if config.get_context_summary_enabled() and summary_prompt else None
+  # 查询向量缓存的 Redis 层，多个 worker 共享
+  ICBCVectorDB().set_redis_client(conversation_redis, ttl=config.get_embedding_cache_ttl_in_seconds())
+  answer_cache = None
+  if config.get_answer_cache_enabled():
+    # 商品目录版本 + 系统提示词版本：任一变化后旧答案不再使用
+    prompt_version = hashlib.sha1(resource.get_resource()["default_values"]["analyze_intent_system_prompt"].encode("utf-8")).hexdigest()[:8]
+    answer_cache = AnswerCache(
+      conversation_redis,
+      embed=ICBCVectorDB().aembed_query,
+      scope=f"{config.get_answer_cache_catalog_version()}-{prompt_version}",
+      ttl=config.get_answer_cache_ttl_in_seconds(),
+      threshold=config.get_answer_cache_threshold(),
+      max_entries=config.get_answer_cache_max_entries()
+    )
+  state["agent"] = RedemptionAgent(saver=saver, transcript=transcript, summaries=summaries, answer_cache=answer_cache)
+
+  # 4. 指标：各 worker 定期把增量汇总到 Redis，/metrics 输出所有 worker 的汇总值
+  state["metrics_redis"] = client_for(conversation_redis, "llm")
+  metrics_task = asyncio.create_task(LLMMetrics().run_flusher(state["metrics_redis"]))
+  # /metrics 与 chat 共用对外端口，没有配置 token 时不开放
+  if config.get_metrics_enabled() and not config.get_metrics_token():
+    _log.error("metrics.enabled 已打开但没有配置 metrics.token，/metrics 不开放")
   
   yield # --- 运行中 ---
 
-  # 4. 资源回收
+  # 5. 资源回收
   _log.info("进程 PID:{} 正在清理资源...", os.getpid())
+  metrics_task.cancel()
+  try: await asyncio.wait_for(metrics_task, timeout=2.0)
+  except: pass
   # A. 先取消 Token Server 任务并等待它结束
   if not token_task.done():
     token_task.cancel()
@@ -158,6 +254,8 @@ async def lifespan(app: FastAPI):
 
   # C. 显式关闭 Redis (顺序：先 Client 后 Pool)
   try:
+    if conversation_redis is not shared_redis:
+      await conversation_redis.aclose()
     await shared_redis.aclose() # 注意异步库建议用 aclose()
     await redis_pool.disconnect()
     _log.info("Redis 共享连接池已断开")
@@ -185,6 +283,20 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(default=None)):
+  """
+  Prometheus 格式的 LLM 调用指标（token 用量、前缀缓存命中、首分片延迟）。
+  与对外的 chat 服务同一端口，只有打开 metrics.enabled 并配置了 metrics.token 时才开放，
+  请求需要带 Authorization: Bearer <token>
+  """
+  expected = config.get_metrics_token()
+  if not config.get_metrics_enabled() or not expected:
+    return PlainTextResponse("Not Found", status_code=404)
+  if not hmac.compare_digest((authorization or "").encode("utf-8"), f"Bearer {expected}".encode("utf-8")):
+    return PlainTextResponse("Unauthorized", status_code=401)
+  return PlainTextResponse(await LLMMetrics().render(state.get("metrics_redis")))
+
 @app.websocket("/v1/chat")
 async def websocket_endpoint(websocket: WebSocket):
   """
@@ -220,13 +332,30 @@ async def websocket_endpoint(websocket: WebSocket):
       # 根据协议分发
       if msg_type == "loadUserHistory":
         task = asyncio.create_task(
-          handle_load_history(user_id, seq, websocket)
+          handle_load_history(user_id, seq, websocket, data.get("cursor"), data.get("limit"))
         )
       else:
         enableTrace = data.get("enableTrace", False)
+        deadline_ms = data.get("deadlineMs")
+        try:
+          deadline_ms = int(deadline_ms) if deadline_ms not in (None, "") else None
+          if deadline_ms is not None and deadline_ms <= 0:
+            raise ValueError(deadline_ms)
+        except (TypeError, ValueError):
+          await websocket.send_json({
+            "seq": seq,
+            "type": "chat",
+            "userCode": user_id,
+            "status": "fail",
+            "errorCode": "400",
+            "errorMsg": "deadlineMs 必须是正整数"
+          })
+          continue
+        if deadline_ms is not None:
+          deadline_ms = min(deadline_ms, config.get_chat_max_deadline_ms())
         # chat 逻辑由 agent.stream_chat 处理，内部需遵循 status: success/end 逻辑
         task = asyncio.create_task(
-          agent.stream_chat(user_input, user_id, seq, websocket,enableTrace)
+          agent.stream_chat(user_input, user_id, seq, websocket, enableTrace, deadline_ms)
         )
 
       active_tasks.add(task)
@@ -240,21 +369,41 @@ async def websocket_endpoint(websocket: WebSocket):
     for task in active_tasks:
       if not task.done(): task.cancel()
 
-async def handle_load_history(user_id: str, seq: str, websocket: WebSocket):
+async def handle_load_history(user_id: str, seq: str, websocket: WebSocket, cursor: Any = None, limit: Any = None):
   """
-  严格按照设计文档返回历史记录
+  严格按照设计文档返回历史记录：按 cursor/limit 分页，较长的历史拆成多个 success 分片，最后一个为 end
   """
   agent: RedemptionAgent = state.get("agent")
   try:
-    history = await agent.get_history(user_id)
-    # 按照文档：字段名为 history，且单次返回 status 为 end
-    await websocket.send_json({
-      "seq": seq,
-      "type": "loadUserHistory",
-      "userCode": user_id,
-      "history": history,
-      "status": "end" 
-    })
+    try:
+      cursor = int(cursor) if cursor not in (None, "") else None
+      limit = int(limit) if limit not in (None, "") else config.get_history_page_size()
+    except (TypeError, ValueError):
+      await websocket.send_json({
+        "seq": seq,
+        "type": "loadUserHistory",
+        "status": "fail",
+        "errorCode": "400",
+        "errorMsg": "cursor/limit 必须是整数"
+      })
+      return
+    limit = max(1, min(limit, config.get_history_max_page_size()))
+
+    history, next_cursor = await agent.get_history(user_id, cursor, limit)
+    chunk_size = max(1, config.get_history_chunk_size())
+    chunks = [history[i:i + chunk_size] for i in range(0, len(history), chunk_size)] or [[]]
+    for i, chunk in enumerate(chunks):
+      last = i == len(chunks) - 1
+      response = {
+        "seq": seq,
+        "type": "loadUserHistory",
+        "userCode": user_id,
+        "history": chunk,
+        "status": "end" if last else "success"
+      }
+      if last:
+        response["nextCursor"] = None if next_cursor is None else str(next_cursor)
+      await websocket.send_json(response)
   except Exception as e:
     _log.error("获取历史记录失败: {}", e)
     await websocket.send_json({
@@ -0,0 +1,65 @@
+"""Unit tests for the semantic answer cache (fakeredis backed)"""
+
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import answer_cache
+from core.answer_cache import AnswerCache
+
+
+async def embed(text):
+  # one dimension per distinct question keeps unrelated questions apart
+  return [float(ord(ch)) for ch in (text + "    ")[:4]]
+
+
+class TestAnswerCacheEviction(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.redis = fakeredis.FakeAsyncRedis()
+    self.cache = AnswerCache(self.redis, embed, "1-test", ttl=100, threshold=0.999, max_entries=3)
+
+  async def asyncTearDown(self):
+    await self.redis.aclose()
+
+  async def _store_at(self, now, prompt):
+    with mock.patch.object(answer_cache, "time", mock.Mock(time=mock.Mock(return_value=now))):
+      await self.cache.store(prompt, f"answer {prompt}")
+
+  async def _prompts(self):
+    raw = await self.redis.hgetall(self.cache._key("ans"))
+    return sorted(json.loads(value)["prompt"] for value in raw.values())
+
+  async def test_full_cache_evicts_oldest(self):
+    for i, prompt in enumerate(["q1", "q2", "q3", "q4", "q5"]):
+      await self._store_at(1000 + i, prompt)
+    self.assertEqual(await self._prompts(), ["q3", "q4", "q5"])
+    self.assertEqual(await self.redis.hlen(self.cache._key("vec")), 3)
+    self.assertEqual(await self.redis.zcard(self.cache._key("exp")), 3)
+
+  async def test_expired_entries_are_evicted(self):
+    await self._store_at(1000, "q1")
+    await self._store_at(1001, "q2")
+    await self._store_at(1200, "q3")
+    self.assertEqual(await self._prompts(), ["q3"])
+
+  async def test_rewriting_a_question_keeps_one_entry(self):
+    for i in range(4):
+      await self._store_at(1000 + i, "q1")
+    self.assertEqual(await self._prompts(), ["q1"])
+
+  async def test_lookup_after_eviction(self):
+    for prompt in ["q1", "q2", "q3", "q4"]:
+      await self.cache.store(prompt, f"answer {prompt}")
+    self.assertEqual((await self.cache.lookup("q4"))[0], "answer q4")
+    self.assertIsNone((await self.cache.lookup("q1"))[0])
+
+
+if __name__ == "__main__":
+  unittest.main()
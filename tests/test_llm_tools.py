@@ -0,0 +1,59 @@
+"""Unit tests for reusing the speculative mall search inside the tools"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import llm_tools, speculation
+
+
+class FakeDB:
+  """Stands in for ICBCVectorDB and records every search"""
+
+  def __init__(self, items):
+    self.items = items
+    self.calls = []
+
+  async def asearch(self, query, limit=3, min_points=None, max_points=None):
+    self.calls.append((query, limit, min_points, max_points))
+    return [
+      item for item in self.items
+      if (min_points is None or item["points"] >= min_points) and (max_points is None or item["points"] <= max_points)
+    ][:limit]
+
+
+class TestSpeculativeSearch(unittest.IsolatedAsyncioTestCase):
+
+  async def _search(self, items, query, **kw):
+    db = FakeDB(items)
+    with mock.patch.object(llm_tools, "ICBCVectorDB", return_value=db), speculation.scope():
+      llm_tools.speculate_icbc_search(query)
+      results = await llm_tools._search_icbc(query, **kw)
+    return results, db.calls
+
+  async def test_ranged_search_reuses_prefetch(self):
+    items = [{"name": f"p{i}", "points": 1000 * (i + 1)} for i in range(9)]
+    results, calls = await self._search(items, "华为手机", max_points=5000)
+    self.assertEqual([item["name"] for item in results], ["p0", "p1", "p2"])
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(calls[0][2:], (None, None))
+
+  async def test_prefetch_filtered_by_points(self):
+    items = [{"name": f"p{i}", "points": p} for i, p in enumerate([9000, 100, 8000, 200, 300, 7000])]
+    results, calls = await self._search(items, "华为手机", max_points=1000)
+    self.assertEqual([item["name"] for item in results], ["p1", "p3", "p4"])
+    self.assertEqual(len(calls), 1)
+
+  async def test_too_few_in_range_searches_again(self):
+    items = [{"name": f"p{i}", "points": p} for i, p in enumerate([9000, 100, 8000])]
+    results, calls = await self._search(items, "华为手机", max_points=1000)
+    self.assertEqual([item["name"] for item in results], ["p1"])
+    self.assertEqual(len(calls), 2)
+    self.assertEqual(calls[1][2:], (None, 1000))
+
+
+if __name__ == "__main__":
+  unittest.main()
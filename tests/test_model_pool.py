@@ -0,0 +1,55 @@
+"""Unit tests for provider failover in the model pool"""
+
+import os
+import sys
+import unittest
+
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.model_pool import ModelPool
+
+
+class FakeModel:
+
+  def __init__(self, chunks=(), error=None):
+    self.chunks = list(chunks)
+    self.error = error
+    self.calls = 0
+
+  async def astream(self, messages, **kwargs):
+    self.calls += 1
+    if self.error is not None:
+      raise self.error
+    for chunk in self.chunks:
+      yield AIMessageChunk(content=chunk)
+
+
+class TestFailover(unittest.IsolatedAsyncioTestCase):
+
+  async def _collect(self, pool):
+    return [chunk.content async for chunk in pool.astream([HumanMessage("hi")])]
+
+  async def test_empty_stream_fails_over_to_next_provider(self):
+    empty, good = FakeModel(), FakeModel(["你", "好"])
+    pool = ModelPool({"empty": empty, "good": good})
+    pool.hedge_enabled = False
+    self.assertEqual(await self._collect(pool), ["你", "好"])
+    self.assertEqual((empty.calls, good.calls), (1, 1))
+    self.assertEqual(pool.health["empty"].failures, 1)
+
+  async def test_error_before_first_chunk_fails_over(self):
+    pool = ModelPool({"broken": FakeModel(error=ConnectionError("down")), "good": FakeModel(["ok"])})
+    pool.hedge_enabled = False
+    self.assertEqual(await self._collect(pool), ["ok"])
+
+  async def test_all_providers_empty(self):
+    pool = ModelPool({"a": FakeModel(), "b": FakeModel()})
+    pool.hedge_enabled = False
+    with self.assertRaises(RuntimeError):
+      await self._collect(pool)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,84 @@
+"""Unit tests for the fast/strong tier routing heuristics"""
+
+import os
+import sys
+import unittest
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.model_router import is_simple_turn, reject_reason
+
+
+class TestIsSimpleTurn(unittest.TestCase):
+
+  SIMPLE = [
+    "你好",
+    "Hello",
+    "谢谢！",
+    "好的",
+    "嗯嗯",
+    "再见",
+    "你是谁",
+    "你能做什么？",
+    "收到，明白了",
+  ]
+
+  COMPLEX = [
+    # greeting or acknowledgement followed by a real request
+    "你好，我有5万豆想换个华为手机",
+    "好的，那帮我换霸王茶姬",
+    "谢谢，再推荐一个京东E卡方案",
+    "嗯那立减金怎么用",
+    "hi，E卡兑换比率是多少",
+    # requests without a greeting
+    "我有50000i豆",
+    "积分能换什么",
+    "帮我查一下攒豆活动",
+    "霸王茶姬和奈雪哪个划算",
+    "我的i豆余额够不够",
+    # longer than the simple-turn limit
+    "你好你好你好你好你好你好你好你好你好你好你好你好你好你好你好你好",
+    "",
+    "   ",
+  ]
+
+  def test_simple_inputs(self):
+    for text in self.SIMPLE:
+      with self.subTest(text=text):
+        self.assertTrue(is_simple_turn([HumanMessage(text)]))
+
+  def test_complex_inputs(self):
+    for text in self.COMPLEX:
+      with self.subTest(text=text):
+        self.assertFalse(is_simple_turn([HumanMessage(text)]))
+
+  def test_only_first_call_of_a_turn(self):
+    cases = [
+      [],
+      [HumanMessage("你好"), AIMessage("您好")],
+      [HumanMessage("你好"), AIMessage("", tool_calls=[{"name": "t", "args": {}, "id": "c"}]), ToolMessage("{}", tool_call_id="c")],
+    ]
+    for messages in cases:
+      with self.subTest(messages=messages):
+        self.assertFalse(is_simple_turn(messages))
+
+
+class TestRejectReason(unittest.TestCase):
+
+  def test_reasons(self):
+    cases = [
+      (AIMessage("您好，我是工银i豆精算管家"), None),
+      (AIMessage("", tool_calls=[{"name": "t", "args": {}, "id": "c"}]), "tools"),
+      (AIMessage("  "), "empty"),
+      (AIMessage("很长" * 200), "too_long"),
+      (AIMessage("抱歉，我不确定"), "unsure"),
+    ]
+    for message, reason in cases:
+      with self.subTest(content=message.content[:10], reason=reason):
+        self.assertEqual(reject_reason(message, 300), reason)
+
+
+if __name__ == "__main__":
+  unittest.main()
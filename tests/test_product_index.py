@@ -0,0 +1,88 @@
+"""Unit tests for the memory-mapped product index"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import product_index
+from core.product_index import ProductIndex, export_product_index
+
+
+def catalog(names, points, reverse=False):
+  ids = [f"id{i}" for i in range(len(names))]
+  embeddings = np.eye(len(names), 8)[::-1 if reverse else 1].tolist()
+  metadatas = [{"name": name, "points": p} for name, p in zip(names, points)]
+  return ids, embeddings, metadatas
+
+
+class TestProductIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.dir.name, "product_index.npy")
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def _reload(self, index):
+    # mtime resolution may be coarser than the test; force the change to be seen
+    index._mtime = None
+    index._maybe_reload()
+
+  def test_search_within_points_range(self):
+    export_product_index(*catalog(["a", "b", "c"], [100, 200, 300]), self.path)
+    index = ProductIndex(self.path)
+    self.assertEqual([r["name"] for r in index.search(np.eye(3, 8)[1], 1)], ["b"])
+    self.assertEqual([r["name"] for r in index.search(np.eye(3, 8)[2], 3, max_points=200)][-1:], ["b"])
+    self.assertEqual(index.search(np.eye(3, 8)[0], 3, min_points=1000), [])
+
+  def test_reload_pairs_matrix_with_its_meta(self):
+    export_product_index(*catalog(["a", "b", "c"], [100, 200, 300]), self.path)
+    index = ProductIndex(self.path)
+
+    # an export interrupted after writing the new matrix but before replacing the meta
+    original_replace = os.replace
+    def crash_on_meta(src, dst):
+      if dst.endswith(".meta.json"):
+        raise OSError("interrupted")
+      original_replace(src, dst)
+    product_index.os.replace = crash_on_meta
+    try:
+      with self.assertRaises(OSError):
+        export_product_index(*catalog(["x", "y", "z"], [1, 2, 3], reverse=True), self.path)
+    finally:
+      product_index.os.replace = original_replace
+
+    self._reload(index)
+    self.assertEqual(index.search(np.eye(3, 8)[0], 1)[0]["name"], "a")
+
+    export_product_index(*catalog(["x", "y", "z"], [1, 2, 3], reverse=True), self.path)
+    self._reload(index)
+    self.assertEqual(index.search(np.eye(3, 8)[0], 1)[0]["name"], "z")
+
+  def test_old_matrices_are_removed(self):
+    for _ in range(4):
+      export_product_index(*catalog(["a", "b"], [1, 2]), self.path)
+    with open(self.path + ".meta.json", encoding="utf-8") as f:
+      current = json.load(f)["matrix"]
+    matrices = sorted(name for name in os.listdir(self.dir.name) if name.endswith(".npy"))
+    self.assertEqual(len(matrices), 2)
+    self.assertIn(current, matrices)
+
+  def test_legacy_layout_without_versioned_matrix(self):
+    ids, embeddings, metadatas = catalog(["a", "b"], [1, 2])
+    np.save(self.path, np.asarray(embeddings, dtype=np.float32))
+    with open(self.path + ".meta.json", "w", encoding="utf-8") as f:
+      json.dump({"dtype": "float32", "dim": 8, "count": 2, "model": "", "items": metadatas}, f)
+    index = ProductIndex(self.path)
+    self.assertEqual(index.search(np.eye(2, 8)[1], 1)[0]["name"], "b")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,82 @@
+"""Unit tests for the per-run deadline budget"""
+
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+from langchain_core.messages import AIMessageChunk
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FILES_RESOURCE", os.path.join(ROOT, "data", "resource_example.yaml"))
+
+from core import model_factory
+from core.model_pool import ModelPool
+from core.run_budget import RunBudget
+from core.simple_redis_saver import SimpleRedisSaver
+
+
+class TestRunBudget(unittest.TestCase):
+
+  def test_reserve_is_at_most_half_the_deadline(self):
+    budget = RunBudget(deadline_seconds=2, max_model_calls=5, answer_reserve=8, optional_tool_min=1)
+    self.assertEqual(budget.answer_reserve, 1)
+    self.assertGreater(budget.call_timeout(), 0.9)
+
+  def test_answer_timeout_never_passes_the_deadline(self):
+    budget = RunBudget(deadline_seconds=1, max_model_calls=5, answer_reserve=8, optional_tool_min=1)
+    self.assertLessEqual(budget.answer_timeout(), 1)
+    budget.deadline = time.monotonic() - 1
+    self.assertEqual(budget.answer_timeout(), 0)
+    self.assertEqual(budget.call_timeout(), 0)
+
+
+class SlowModel:
+  """Never finishes before the deadline, with or without tools"""
+
+  def bind_tools(self, tools, **kwargs):
+    return self
+
+  async def astream(self, messages):
+    await asyncio.sleep(30)
+    yield AIMessageChunk(content="too late")
+
+
+class RecordingSocket:
+
+  def __init__(self):
+    self.sent = []
+
+  async def send_json(self, message):
+    self.sent.append(message)
+
+
+class TestShortDeadline(unittest.IsolatedAsyncioTestCase):
+
+  async def test_short_deadline_is_honoured(self):
+    pools = {"strong": ModelPool({"slow": SlowModel()}), "fast": None}
+    with mock.patch.object(model_factory, "get_model_pool", lambda tier="strong": pools[tier]), \
+         mock.patch("config.config.get_chat_answer_reserve_ms", return_value=8000):
+      from core.redemption_agent import RedemptionAgent, _DEADLINE_ANSWER
+      redis = fakeredis.FakeAsyncRedis()
+      agent = RedemptionAgent(SimpleRedisSaver(redis, ttl=0))
+      websocket = RecordingSocket()
+      started = time.monotonic()
+      await agent.stream_chat("我有5万豆想换个华为手机", "u1", "1", websocket, deadline_ms=600)
+      elapsed = time.monotonic() - started
+      await redis.aclose()
+
+    self.assertLess(elapsed, 1.5)
+    end = websocket.sent[-1]
+    self.assertEqual(end["status"], "end")
+    self.assertIn("deadline", end["degraded"])
+    answer = "".join(m["answer"] for m in websocket.sent if m["status"] == "success" and not m["isTrace"])
+    self.assertEqual(answer, _DEADLINE_ANSWER)
+
+
+if __name__ == "__main__":
+  unittest.main()
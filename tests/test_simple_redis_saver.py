@@ -0,0 +1,303 @@
+"""Unit tests for SimpleRedisSaver (fakeredis backed)"""
+
+import json
+import operator
+import os
+import sys
+import unittest
+from typing import Annotated, Optional, TypedDict
+
+import fakeredis
+import ormsgpack
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, StateGraph
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.simple_redis_saver import CrossCompatibleSerializer, SimpleRedisSaver
+
+
+class State(TypedDict):
+  messages: Annotated[list, operator.add]
+  user_points: Optional[int]
+
+
+def build_app(saver):
+  def reply(state):
+    return {"messages": [AIMessage(content=f"reply {len(state['messages'])}")]}
+
+  graph = StateGraph(State)
+  graph.add_node("agent", reply)
+  graph.set_entry_point("agent")
+  graph.add_edge("agent", END)
+  return graph.compile(checkpointer=saver)
+
+
+class TestForkIsolation(unittest.IsolatedAsyncioTestCase):
+  """Branches forked from the same parent must not overwrite each other's channel values"""
+
+  async def asyncSetUp(self):
+    self.redis = fakeredis.FakeAsyncRedis()
+    self.config = {"configurable": {"thread_id": "u1"}}
+
+  async def asyncTearDown(self):
+    await self.redis.aclose()
+
+  async def _run_two_turns(self, saver):
+    app = build_app(saver)
+    await app.ainvoke({"messages": [HumanMessage("first")], "user_points": 100}, self.config)
+    await app.ainvoke({"messages": [HumanMessage("second")], "user_points": 200}, self.config)
+    return app
+
+  async def _assert_fork_isolated(self, saver):
+    app = await self._run_two_turns(saver)
+    head = (await app.aget_state(self.config)).config
+    history = [s async for s in app.aget_state_history(self.config)]
+    turn_two_input = next(s for s in history if s.metadata.get("source") == "input" and s.metadata.get("step") == 2)
+
+    forked = await app.aupdate_state(turn_two_input.config, {"user_points": 999})
+
+    main = await app.aget_state(head)
+    self.assertEqual(main.values["user_points"], 200)
+    self.assertEqual(len(main.values["messages"]), 4)
+    self.assertEqual((await app.aget_state(forked)).values["user_points"], 999)
+
+  async def test_fork_with_delta(self):
+    await self._assert_fork_isolated(SimpleRedisSaver(self.redis, ttl=0, delta=True))
+
+  async def test_fork_with_full_snapshots(self):
+    await self._assert_fork_isolated(SimpleRedisSaver(self.redis, ttl=0, delta=False))
+
+  async def test_versions_are_unique_and_ordered(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0)
+    first, second = saver.get_next_version(None, None), saver.get_next_version(None, None)
+    self.assertNotEqual(first, second)
+    self.assertLess(first, saver.get_next_version(first, None))
+    # integer versions written before the change are still accepted
+    self.assertLess(saver.get_next_version(9, None), saver.get_next_version(10, None))
+
+  async def test_continue_thread_with_integer_versions(self):
+    class IntegerVersionSaver(SimpleRedisSaver):
+      def get_next_version(self, current, channel):
+        return (current or 0) + 1
+
+    await build_app(IntegerVersionSaver(self.redis, ttl=0, delta=True)).ainvoke(
+      {"messages": [HumanMessage("first")], "user_points": 100}, self.config
+    )
+    app = build_app(SimpleRedisSaver(self.redis, ttl=0, delta=True))
+    await app.ainvoke({"messages": [HumanMessage("second")]}, self.config)
+
+    state = await app.aget_state(self.config)
+    self.assertEqual(state.values["user_points"], 100)
+    self.assertEqual([m.content for m in state.values["messages"]], ["first", "reply 1", "second", "reply 3"])
+
+
+class TestPutGetList(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.redis = fakeredis.FakeAsyncRedis()
+    self.config = {"configurable": {"thread_id": "u1"}}
+
+  async def asyncTearDown(self):
+    await self.redis.aclose()
+
+  async def _run(self, saver, turns=2):
+    app = build_app(saver)
+    for i in range(turns):
+      await app.ainvoke({"messages": [HumanMessage(f"q{i}")], "user_points": 100 * (i + 1)}, self.config)
+    return app
+
+  async def test_latest_state_roundtrip(self):
+    for delta in (False, True):
+      with self.subTest(delta=delta):
+        await self.redis.flushall()
+        saver = SimpleRedisSaver(self.redis, ttl=0, delta=delta)
+        await self._run(saver)
+        tup = await saver.aget_tuple(self.config)
+        self.assertEqual(tup.checkpoint["channel_values"]["user_points"], 200)
+        messages = tup.checkpoint["channel_values"]["messages"]
+        self.assertEqual([type(m) for m in messages], [HumanMessage, AIMessage, HumanMessage, AIMessage])
+        self.assertEqual(tup.parent_config["configurable"]["thread_id"], "u1")
+
+  async def test_alist_newest_first_with_before_and_limit(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0, delta=True)
+    await self._run(saver)
+    steps = [t.metadata["step"] async for t in saver.alist(self.config)]
+    self.assertEqual(steps, sorted(steps, reverse=True))
+    self.assertEqual(len(steps), 6)
+
+    page = [t async for t in saver.alist(self.config, limit=2)]
+    self.assertEqual([t.metadata["step"] for t in page], steps[:2])
+    rest = [t.metadata["step"] async for t in saver.alist(self.config, before=page[-1].config)]
+    self.assertEqual(rest, steps[2:])
+
+    inputs = [t.metadata["step"] async for t in saver.alist(self.config, filter={"source": "input"})]
+    self.assertEqual(inputs, [2, -1])
+
+  async def test_pending_writes_are_returned(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0, delta=True)
+    await self._run(saver, turns=1)
+    head = (await saver.aget_tuple(self.config)).config
+    await saver.aput_writes(head, [("user_points", 5), ("messages", [HumanMessage("w")])], "task-1")
+    tup = await saver.aget_tuple(head)
+    self.assertEqual([(t, c) for t, c, _ in tup.pending_writes], [("task-1", "user_points"), ("task-1", "messages")])
+
+  async def test_retention_keeps_latest_checkpoints(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0, delta=True, max_checkpoints=3)
+    await self._run(saver, turns=3)
+    self.assertEqual(await self.redis.zcard(saver._index_key("u1")), 3)
+    self.assertEqual(len([t async for t in saver.alist(self.config)]), 3)
+    # channel values still referenced by the kept checkpoints survive pruning
+    tup = await saver.aget_tuple(self.config)
+    self.assertEqual(tup.checkpoint["channel_values"]["user_points"], 300)
+    self.assertEqual(len(tup.checkpoint["channel_values"]["messages"]), 6)
+    # pruned checkpoints take their pending writes with them
+    writes = [k async for k in self.redis.scan_iter(match=f"{saver._writes_prefix('u1')}*")]
+    self.assertLessEqual(len(writes), 3)
+
+  async def test_retention_trims_append_logs(self):
+    # the node keeps only the latest two messages, so every turn rewrites the append channel
+    class Window(TypedDict):
+      messages: list
+
+    def reply(state):
+      return {"messages": state["messages"][-1:] + [AIMessage(content="reply")]}
+
+    graph = StateGraph(Window)
+    graph.add_node("agent", reply)
+    graph.set_entry_point("agent")
+    graph.add_edge("agent", END)
+    saver = SimpleRedisSaver(self.redis, ttl=0, delta=True, max_checkpoints=2)
+    app = graph.compile(checkpointer=saver)
+    for i in range(10):
+      await app.ainvoke({"messages": [HumanMessage(f"q{i}")]}, self.config)
+
+    # only the messages referenced by the two kept checkpoints remain in the log
+    self.assertLessEqual(await self.redis.llen(saver._log_key("u1", "messages")), 4)
+    saver._refs_memo.clear()
+    tup = await saver.aget_tuple(self.config)
+    self.assertEqual([m.content for m in tup.checkpoint["channel_values"]["messages"]], ["q9", "reply"])
+    states = [t async for t in saver.alist(self.config)]
+    self.assertEqual(len(states), 2)
+    self.assertEqual([m.content for m in states[-1].checkpoint["channel_values"]["messages"]], ["q9"])
+
+  async def test_l1_cache_sees_writes_from_other_workers(self):
+    worker_a = SimpleRedisSaver(self.redis, ttl=0, delta=True, l1_cache_size=8)
+    worker_b = SimpleRedisSaver(self.redis, ttl=0, delta=True, l1_cache_size=8)
+    await self._run(worker_a, turns=1)
+    self.assertEqual((await worker_a.aget_tuple(self.config)).checkpoint["channel_values"]["user_points"], 100)
+
+    await build_app(worker_b).ainvoke({"messages": [HumanMessage("q1")], "user_points": 500}, self.config)
+    self.assertEqual((await worker_a.aget_tuple(self.config)).checkpoint["channel_values"]["user_points"], 500)
+
+  async def test_coalesce_writes_only_final_checkpoint(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0, delta=True)
+    app = build_app(saver)
+    async with saver.coalesce():
+      await app.ainvoke({"messages": [HumanMessage("q0")], "user_points": 100}, self.config)
+      self.assertEqual(await self.redis.zcard(saver._index_key("u1")), 0)
+    self.assertEqual(await self.redis.zcard(saver._index_key("u1")), 1)
+    state = await app.aget_state(self.config)
+    self.assertEqual([m.content for m in state.values["messages"]], ["q0", "reply 1"])
+
+  async def test_alist_requires_thread_id(self):
+    saver = SimpleRedisSaver(self.redis, ttl=0)
+    for config in (None, {}, {"configurable": {}}):
+      with self.assertRaises(ValueError):
+        [t async for t in saver.alist(config)]
+
+
+class TestSerializer(unittest.TestCase):
+
+  def setUp(self):
+    self.serde = CrossCompatibleSerializer()
+
+  def test_typed_messages_roundtrip(self):
+    message = AIMessage(content="", tool_calls=[{"name": "search", "args": {"q": "E卡"}, "id": "c1"}])
+    decoded = self.serde.loads(self.serde.dumps({"messages": [HumanMessage("hi"), message]}))
+    self.assertIsInstance(decoded["messages"][0], HumanMessage)
+    self.assertEqual(decoded["messages"][1].tool_calls[0]["args"], {"q": "E卡"})
+
+  def test_legacy_msgpack_and_json_blobs(self):
+    legacy = {"messages": [HumanMessage("hi").model_dump(), AIMessage("hello").model_dump()], "user_points": 7}
+    for blob in (ormsgpack.packb(legacy), json.dumps(legacy).encode("utf-8")):
+      decoded = self.serde.loads(blob)
+      self.assertEqual(decoded["user_points"], 7)
+      self.assertIsInstance(decoded["messages"][0], HumanMessage)
+      self.assertIsInstance(decoded["messages"][1], AIMessage)
+
+
+class TestLegacyCheckpoint(unittest.IsolatedAsyncioTestCase):
+
+  async def test_read_checkpoint_written_by_the_original_saver(self):
+    redis = fakeredis.FakeAsyncRedis()
+    saver = SimpleRedisSaver(redis, ttl=0)
+    checkpoint = {
+      "v": 1, "id": "ckpt-1", "ts": "2025-01-01T00:00:00+00:00",
+      "channel_values": {"messages": [HumanMessage("hi").model_dump()], "user_points": 3},
+      "channel_versions": {"messages": 2, "user_points": 2},
+      "versions_seen": {"agent": {"messages": 1}}
+    }
+    blob = ormsgpack.packb({"checkpoint": checkpoint, "metadata": {"step": 0}, "parent_config": None})
+    await redis.hset(saver._checkpoint_key("u1"), mapping={"ckpt-1": blob, "__latest__": "ckpt-1"})
+
+    tup = await saver.aget_tuple({"configurable": {"thread_id": "u1"}})
+    self.assertEqual(tup.checkpoint["channel_values"]["user_points"], 3)
+    self.assertIsInstance(tup.checkpoint["channel_values"]["messages"][0], HumanMessage)
+    # integer versions are normalized to the string format used for new versions
+    self.assertEqual(tup.checkpoint["channel_versions"]["messages"], saver.get_next_version(1, None)[:32] + "." + "0" * 16)
+    await redis.aclose()
+
+
+
+class TestLegacyKeyMigration(unittest.IsolatedAsyncioTestCase):
+  """Conversations stored before keys carried the {thread_id} hash tag stay readable"""
+
+  async def test_untagged_keys_are_migrated_on_first_read(self):
+    redis = fakeredis.FakeAsyncRedis()
+    config = {"configurable": {"thread_id": "u1"}}
+    writer = SimpleRedisSaver(redis, ttl=0, delta=True)
+    await build_app(writer).ainvoke({"messages": [HumanMessage("q0")], "user_points": 100}, config)
+    # rename every key of the thread back to the old layout
+    async for key in redis.scan_iter(match="*{u1}*"):
+      await redis.rename(key, key.replace(b"{u1}", b"u1"))
+
+    self.assertIsNone(await SimpleRedisSaver(redis, ttl=0, delta=True).aget_tuple(config))
+
+    saver = SimpleRedisSaver(redis, ttl=0, delta=True, legacy_client=redis)
+    app = build_app(saver)
+    self.assertEqual((await app.aget_state(config)).values["user_points"], 100)
+    self.assertEqual([k async for k in redis.scan_iter(match="checkpoints:u1")], [])
+    await app.ainvoke({"messages": [HumanMessage("q1")]}, config)
+    self.assertEqual(len((await app.aget_state(config)).values["messages"]), 4)
+    await redis.aclose()
+
+  async def test_late_migration_does_not_overwrite_newer_writes(self):
+    redis = fakeredis.FakeAsyncRedis()
+    config = {"configurable": {"thread_id": "u1"}}
+    await build_app(SimpleRedisSaver(redis, ttl=0, delta=True)).ainvoke(
+      {"messages": [HumanMessage("q0")], "user_points": 100}, config
+    )
+    legacy = {}
+    async for key in redis.scan_iter(match="*{u1}*"):
+      old_key = key.replace(b"{u1}", b"u1")
+      await redis.rename(key, old_key)
+      legacy[old_key] = await redis.dump(old_key)
+
+    saver = SimpleRedisSaver(redis, ttl=0, delta=True, legacy_client=redis)
+    app = build_app(saver)
+    await app.ainvoke({"messages": [HumanMessage("q1")], "user_points": 200}, config)
+    # a second worker that listed the old keys before the first one deleted them
+    for old_key, dumped in legacy.items():
+      await redis.restore(old_key, 0, dumped)
+    self.assertTrue(await saver.amigrate_legacy("u1"))
+
+    state = await app.aget_state(config)
+    self.assertEqual(state.values["user_points"], 200)
+    self.assertEqual(len(state.values["messages"]), 4)
+    self.assertEqual([k async for k in redis.scan_iter(match="checkpoints:u1")], [])
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,61 @@
+"""Unit tests for claiming speculative prefetches"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import speculation
+from core.speculation import normalize_query, query_similarity
+
+THRESHOLD = 0.8
+
+
+async def result():
+  return ["prefetched"]
+
+
+class TestQuerySimilarity(unittest.TestCase):
+
+  def test_realistic_prompt_and_tool_queries(self):
+    cases = [
+      ("我有5万豆想换个华为手机", "华为手机", True),
+      ("我有5万豆想换个华为手机", "华为 手机", True),
+      ("帮我看看霸王茶姬的券划算吗", "霸王茶姬", True),
+      ("我想用豆换华为Mate 60 Pro", "华为mate60pro", True),
+      ("京东E卡怎么兑换比较划算", "京东E卡", True),
+      ("我有5万豆想换个华为手机", "小米暖风机", False),
+      ("霸王茶姬代金券", "奈雪的茶代金券", False),
+      ("我有5万豆想换个华为手机", "", False),
+    ]
+    for prompt, query, hit in cases:
+      with self.subTest(prompt=prompt, query=query):
+        score = query_similarity(normalize_query(prompt), normalize_query(query))
+        self.assertEqual(score >= THRESHOLD, hit, score)
+
+
+class TestClaim(unittest.IsolatedAsyncioTestCase):
+
+  async def test_keyword_query_claims_prompt_prefetch_once(self):
+    with speculation.scope():
+      speculation.start("mall", "我有5万豆想换个华为手机", result)
+      task = speculation.claim("mall", "华为手机", THRESHOLD)
+      self.assertIsNotNone(task)
+      self.assertEqual(await task, ["prefetched"])
+      self.assertIsNone(speculation.claim("mall", "华为手机", THRESHOLD))
+
+  async def test_unrelated_query_leaves_prefetch_unclaimed(self):
+    with speculation.scope():
+      speculation.start("mall", "我有5万豆想换个华为手机", result)
+      self.assertIsNone(speculation.claim("mall", "京东E卡", THRESHOLD))
+      await asyncio.sleep(0)
+
+  async def test_outside_scope(self):
+    speculation.start("mall", "华为手机", result)
+    self.assertIsNone(speculation.claim("mall", "华为手机", THRESHOLD))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,79 @@
+"""Unit tests for the materialized transcript (fakeredis backed)"""
+
+import os
+import sys
+import unittest
+
+import fakeredis
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.transcript import TranscriptStore, to_transcript_entries
+
+
+def entries(n):
+  return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(n)]
+
+
+class TestTranscriptPaging(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.redis = fakeredis.FakeAsyncRedis()
+    self.store = TranscriptStore(self.redis, ttl=0, max_entries=0)
+
+  async def asyncTearDown(self):
+    await self.redis.aclose()
+
+  async def test_pages_walk_backwards_in_order(self):
+    await self.store.append("u1", entries(7))
+    contents, cursor = [], None
+    while True:
+      records, cursor = await self.store.page("u1", cursor, 3)
+      contents = [r["content"] for r in records] + contents
+      if cursor is None:
+        break
+    self.assertEqual(contents, [f"m{i}" for i in range(7)])
+
+  async def test_first_page_is_the_newest(self):
+    await self.store.append("u1", entries(5))
+    records, cursor = await self.store.page("u1", None, 2)
+    self.assertEqual([r["content"] for r in records], ["m3", "m4"])
+    self.assertIsNotNone(cursor)
+
+  async def test_missing_transcript(self):
+    self.assertIsNone(await self.store.page("nobody", None, 10))
+
+  async def test_max_entries_trims_oldest(self):
+    store = TranscriptStore(self.redis, ttl=0, max_entries=4)
+    await store.append("u2", entries(3))
+    await store.append("u2", entries(3))
+    records, cursor = await store.page("u2", None, 10)
+    self.assertEqual([r["content"] for r in records], ["m2", "m0", "m1", "m2"])
+    self.assertIsNone(cursor)
+
+  async def test_append_modes(self):
+    self.assertEqual(await self.store.append("u3", entries(1), mode="exists"), -1)
+    self.assertEqual(await self.store.append("u3", entries(1), mode="new"), 1)
+    self.assertEqual(await self.store.append("u3", entries(1), mode="new"), -1)
+    self.assertEqual(await self.store.append("u3", entries(2), mode="exists"), 2)
+
+
+class TestTranscriptEntries(unittest.TestCase):
+
+  def test_only_visible_turns_are_kept(self):
+    messages = [
+      HumanMessage("我有5万豆"),
+      AIMessage(content="", tool_calls=[{"name": "search", "args": {}, "id": "c1"}]),
+      ToolMessage(content='[{"name": "E卡"}]', tool_call_id="c1"),
+      AIMessage(content='[{"name": "E卡"}]'),
+      AIMessage(content="推荐方案B"),
+    ]
+    self.assertEqual(to_transcript_entries(messages), [
+      {"role": "user", "content": "我有5万豆"},
+      {"role": "assistant", "content": "推荐方案B"},
+    ])
+
+
+if __name__ == "__main__":
+  unittest.main()
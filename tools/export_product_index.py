@@ -0,0 +1,37 @@
+# 2 个空格对齐
+import os
+import sys
+import argparse
+
+# 将项目根目录加入系统路径
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_path not in sys.path:
+  sys.path.append(root_path)
+
+import config.config as config
+import log.logger as logger
+from core.icbc_db import ICBCVectorDB
+from core.product_index import export_product_index
+
+_log = logger.get_logger()
+
+def main():
+  parser = argparse.ArgumentParser(description="把 Chroma 中 icbc_products 的向量导出为内存映射检索用的矩阵文件")
+  parser.add_argument("--output", default=config.get_product_index_file(), help="索引文件路径（商品信息写入同名 .meta.json，矩阵按版本写入 <文件名>.<版本>.npy）")
+  parser.add_argument("--dtype", default="float16", choices=["float32", "float16", "int8"], help="矩阵存储精度")
+  args = parser.parse_args()
+
+  db = ICBCVectorDB()
+  data = db.product_collection.get(include=["embeddings", "metadatas"])
+  if not data["ids"]:
+    _log.error("icbc_products 中没有商品，请先运行 tools/icbc_mall_to_db.py 导入")
+    return
+
+  export_product_index(data["ids"], data["embeddings"], data["metadatas"], args.output, args.dtype, db.embeddings.model)
+  _log.info("已导出 {} 条商品向量到 {}（{}）", len(data["ids"]), args.output, args.dtype)
+  # 入库前已存在的商品目录也在这里补建关键词索引
+  db.rebuild_keyword_index()
+  _log.info("将配置 icbc_mall.product_backend 设为 mmap 后生效；服务运行中重新导出会被自动加载")
+
+if __name__ == "__main__":
+  main()
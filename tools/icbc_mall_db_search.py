@@ -62,7 +62,10 @@ def interactive_search():
           
         _log.info(f"{i}. 【{name}】")
         _log.info(f"   所需积分: {pts_display}")
-        _log.info(f"   匹配相关度: {max(0, (1-score)*100):.1f}%")
+        if score is None:
+          _log.info("   匹配相关度: 关键词匹配")
+        else:
+          _log.info(f"   匹配相关度: {max(0, (1-score)*100):.1f}%")
       _log.info("-" * 40)
 
     except Exception as e:
@@ -0,0 +1,56 @@
+# 2 个空格对齐
+import os
+import sys
+import asyncio
+import argparse
+
+# 将项目根目录加入系统路径
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_path not in sys.path:
+  sys.path.append(root_path)
+
+from redis.asyncio import Redis
+
+import config.config as config
+import log.logger as logger
+from core.simple_redis_saver import SimpleRedisSaver
+from point_server import create_conversation_redis
+
+_log = logger.get_logger()
+
+_LEGACY_PREFIX = "checkpoints:"
+
+async def migrate(dry_run: bool) -> None:
+  """
+  把旧版本写在 Token 节点上、不带 hash tag 的会话 key 一次性迁移到当前的会话存储（按 redis.mode 路由）。
+  迁移完成后可以关闭 redis.legacy_key_fallback，省去新会话首次读取时对旧 key 的检查
+  """
+  source = Redis(host=config.get_token_redis_host(), port=config.get_token_redis_port(), db=0, decode_responses=False)
+  target = create_conversation_redis(source, 10)
+  saver = SimpleRedisSaver(redis_client=target, ttl=config.get_redis_msg_ttl_in_seconds())
+  migrated = 0
+  try:
+    async for key in source.scan_iter(match=f"{_LEGACY_PREFIX}*", count=500):
+      key = key.decode("utf-8")
+      thread_id = key[len(_LEGACY_PREFIX):]
+      # 新 key 形如 checkpoints:{thread_id}
+      if thread_id.startswith("{"):
+        continue
+      if dry_run:
+        _log.info("待迁移会话: {}", thread_id)
+      elif await saver.amigrate_legacy(thread_id, source):
+        migrated += 1
+  finally:
+    if target is not source:
+      await target.aclose()
+    await source.aclose()
+  _log.info("共迁移 {} 个会话", migrated)
+
+def main():
+  parser = argparse.ArgumentParser(description="把旧版本（不带 hash tag）的会话 key 迁移到当前的 key 布局")
+  parser.add_argument("--dry-run", action="store_true", help="只列出待迁移的会话")
+  args = parser.parse_args()
+  asyncio.run(migrate(args.dry_run))
+
+if __name__ == "__main__":
+  main()
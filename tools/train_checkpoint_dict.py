@@ -0,0 +1,100 @@
+# 2 个空格对齐
+import os
+import sys
+import asyncio
+import argparse
+import random
+
+# 将项目根目录加入系统路径
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_path not in sys.path:
+  sys.path.append(root_path)
+
+import zstandard as zstd
+from redis.asyncio import Redis
+from redis.asyncio.cluster import RedisCluster
+
+import config.config as config
+import log.logger as logger
+from core.blob_compressor import BlobCompressor
+from cache.redis_cache import RedisShardRouter
+from point_server import create_conversation_redis
+
+_log = logger.get_logger()
+
+# 参与训练的 key：快照本体、delta 模式下的 channel 值与消息列表、pending writes
+_SAMPLE_PATTERNS = ["checkpoints:*", "channel_values:*", "append_log:*", "writes:*"]
+
+def _shards(client: object) -> list:
+  """会话存储的各个实例：客户端分片逐个实例扫描；Redis Cluster 由客户端遍历所有主节点"""
+  if isinstance(client, RedisShardRouter):
+    return client.clients
+  return [client]
+
+async def collect_samples(client: object, max_samples: int, compressor: BlobCompressor) -> list:
+  """
+  从会话存储（按 redis.mode：单机、Redis Cluster 或客户端分片）抽样 checkpoint 相关 blob。
+  已压缩的 blob 先用现有字典解压，保证训练用的是原始数据。
+  """
+  samples = []
+  for shard in _shards(client):
+    scan_kwargs = {"target_nodes": RedisCluster.PRIMARIES} if isinstance(shard, RedisCluster) else {}
+    for pattern in _SAMPLE_PATTERNS:
+      async for key in shard.scan_iter(match=pattern, count=500, **scan_kwargs):
+        key_type = await shard.type(key)
+        if key_type == b"hash":
+          blobs = [v for k, v in (await shard.hgetall(key)).items() if k != b"__latest__"]
+        elif key_type == b"list":
+          blobs = await shard.lrange(key, -50, -1)
+        else:
+          continue
+        for blob in blobs:
+          try:
+            samples.append(compressor.decompress(blob))
+          except Exception as e:
+            _log.debug("跳过无法解压的样本 {}: {}", key, e)
+        if len(samples) >= max_samples * 2:
+          break
+
+  random.shuffle(samples)
+  return samples[:max_samples]
+
+async def sample_conversation_redis(max_samples: int, compressor: BlobCompressor) -> list:
+  """与服务端相同的方式连接会话存储（create_conversation_redis）后抽样"""
+  shared = Redis(host=config.get_token_redis_host(), port=config.get_token_redis_port(), db=0, decode_responses=False)
+  client = create_conversation_redis(shared, 10)
+  try:
+    return await collect_samples(client, max_samples, compressor)
+  finally:
+    if client is not shared:
+      await client.aclose()
+    await shared.aclose()
+
+def main():
+  parser = argparse.ArgumentParser(description="从 Redis 中的 checkpoint 样本训练 zstd 压缩字典")
+  parser.add_argument("--output-dir", default="data/zstd", help="字典输出目录（同目录下的旧字典会被保留用于解压）")
+  parser.add_argument("--dict-size", type=int, default=112640, help="字典大小（字节）")
+  parser.add_argument("--max-samples", type=int, default=20000, help="最多使用的样本数")
+  args = parser.parse_args()
+
+  compressor = BlobCompressor(dict_file=config.get_redis_compression_dict_file(), enabled=False)
+  samples = asyncio.run(sample_conversation_redis(args.max_samples, compressor))
+  if len(samples) < 100:
+    _log.error("样本太少（{} 条），无法训练字典", len(samples))
+    return
+
+  dictionary = zstd.train_dictionary(args.dict_size, samples)
+  os.makedirs(args.output_dir, exist_ok=True)
+  path = os.path.join(args.output_dir, f"checkpoint_{dictionary.dict_id()}.dict")
+  with open(path, "wb") as f:
+    f.write(dictionary.as_bytes())
+
+  # 估算压缩效果
+  cctx = zstd.ZstdCompressor(level=config.get_redis_compression_level(), dict_data=dictionary)
+  raw = sum(len(s) for s in samples)
+  packed = sum(len(cctx.compress(s)) for s in samples)
+  _log.info("字典已写入 {}，样本 {} 条，原始 {} 字节 -> 压缩后 {} 字节 ({:.1%})", path, len(samples), raw, packed, packed / raw)
+  _log.info("请将配置 redis.compression_dict_file 指向该文件并重启服务")
+
+if __name__ == "__main__":
+  main()